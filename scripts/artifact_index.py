@@ -0,0 +1,153 @@
+import os
+import re
+import time
+import fnmatch
+import sqlite3
+import hashlib
+import threading
+import collections
+
+
+# ================= 安装包索引配置 =================
+# 应用安装包命名: install_dt-XX.YY.ZZ.NNNN-ss528v100-Linux.tar.gz (版本号前可带 V/v)
+APP_PACKAGE_PATTERN = re.compile(r"^install_dt-[Vv]?(\d+(?:\.\d+)*)-ss528v100-Linux\.tar\.gz$")
+# 看起来是安装包但版本号无法解析的文件, 扫描时记录下来提示用户
+APP_PACKAGE_GLOB = "install_dt-*-ss528v100-Linux.tar.gz"
+# 计算摘要时每次读取的大小
+READ_CHUNK = 1024 * 1024
+# ======================================================
+
+Artifact = collections.namedtuple("Artifact", "path name version size mtime_ns digest")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    name     TEXT PRIMARY KEY,
+    version  TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algo     TEXT NOT NULL,
+    digest   TEXT NOT NULL,
+    indexed  REAL NOT NULL
+)
+"""
+
+
+def parse_version(version):
+    """'1.2.10.0345' / 'V1.2.10.0345' -> (1, 2, 10, 345), 用于按版本号 (而不是字符串或修改时间) 排序"""
+    return tuple(int(part) for part in version.lstrip("Vv").split("."))
+
+
+def package_version(filename):
+    """从安装包文件名中解析版本号, 不符合命名规则返回 None"""
+    m = APP_PACKAGE_PATTERN.match(os.path.basename(filename))
+    return m.group(1) if m else None
+
+
+def _file_digest(path, algo):
+    h = hashlib.new(algo)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactIndex:
+    """
+    本地安装包索引 (SQLite)
+    记录目录中每个安装包的版本、大小和摘要; 扫描时只对新增或大小/修改时间变化的文件重新计算摘要
+    """
+
+    def __init__(self, db_path, directory, algo='md5'):
+        self.db_path = db_path
+        self.directory = directory
+        self.algo = algo
+        self.lock = threading.Lock()
+        # 最近一次 scan 时跳过的文件名 (符合 APP_PACKAGE_GLOB 但版本号无法解析)
+        self.skipped = []
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(_SCHEMA)
+        return conn
+
+    def scan(self):
+        """增量更新索引, 返回 (新增/更新数量, 删除数量)"""
+        found = {}
+        skipped = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            version = package_version(entry.name)
+            if version is not None and entry.is_file():
+                found[entry.name] = (version, entry.stat())
+            elif version is None and fnmatch.fnmatchcase(entry.name, APP_PACKAGE_GLOB):
+                skipped.append(entry.name)
+        self.skipped = sorted(skipped)
+
+        updated = removed = 0
+        with self.lock:
+            conn = self._connect()
+            try:
+                rows = {r[0]: r[1:] for r in conn.execute(
+                    "SELECT name, size, mtime_ns, algo FROM artifacts")}
+                for name in set(rows) - set(found):
+                    conn.execute("DELETE FROM artifacts WHERE name = ?", (name,))
+                    removed += 1
+                for name, (version, st) in found.items():
+                    if rows.get(name) == (st.st_size, st.st_mtime_ns, self.algo):
+                        continue
+                    digest = _file_digest(os.path.join(self.directory, name), self.algo)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (name, version, st.st_size, st.st_mtime_ns, self.algo, digest, time.time()))
+                    updated += 1
+                conn.commit()
+            finally:
+                conn.close()
+        return updated, removed
+
+    def list(self):
+        """返回所有已索引的安装包, 按版本号从低到高排序"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT name, version, size, mtime_ns, digest FROM artifacts WHERE algo = ?",
+                    (self.algo,)).fetchall()
+            finally:
+                conn.close()
+        artifacts = [Artifact(os.path.join(self.directory, row[0]), *row) for row in rows]
+        return sorted(artifacts, key=lambda a: parse_version(a.version))
+
+    def select(self, version=None):
+        """
+        选择安装包: 指定 version 时精确匹配, 否则取版本号最高的
+        找不到返回 None
+        """
+        artifacts = self.list()
+        if version is not None:
+            wanted = parse_version(version)
+            matches = [a for a in artifacts if parse_version(a.version) == wanted]
+            return matches[-1] if matches else None
+        return artifacts[-1] if artifacts else None
+
+    def lookup(self, path):
+        """按路径查询已索引的安装包, 文件已变化或未索引返回 None"""
+        name = os.path.basename(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT name, version, size, mtime_ns, digest FROM artifacts"
+                    " WHERE name = ? AND size = ? AND mtime_ns = ? AND algo = ?",
+                    (name, st.st_size, st.st_mtime_ns, self.algo)).fetchone()
+            finally:
+                conn.close()
+        return Artifact(os.path.abspath(path), *row) if row else None
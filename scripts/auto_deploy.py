@@ -1,13 +1,39 @@
 import paramiko
 from scp import SCPClient
 import os
-import glob
 import time
 import sys
 import serial
+import select
 import threading
-import itertools
+import argparse
+import atexit
+import collections
+import re
+import math
+import shlex
+import ipaddress
+import hashlib
+import socket
+import queue
+import functools
+import contextlib
+import io
+import json
+import tarfile
+import gzip
+import posixpath
 import serial.tools.list_ports
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from artifact_index import ArtifactIndex, package_version, parse_version
+from progress import renderer, current_task, push_task, pop_task, report_progress
+from serial_console import SerialExpect, ExpectTimeout, UBootError, intercept_uboot, uboot_command, set_uboot_env, \
+    uboot_load_verified, uboot_tftp, uboot_check_crc32
+from ymodem import YModemError
+from tftp_server import TftpServer
+from uboot_env import UBootEnvError, EnvLocation, parse_fw_env_config, parse_env, active_copy, update_env
+from transcode import FORMATS, TranscodeCache, host_formats, compress_bytes, read_sample, gzip_raw_size
+from boot_log import SerialLog, BootProfiler, BOOT_DONE_PATTERN, append_profile, format_intervals, print_boot_report
 
 
 # ================= 基础配置 =================
@@ -23,6 +49,36 @@ REMOTE_TEMP = '/dev/shm'
 SERIAL_PORT = 'COM9'
 BAUDRATE = 115200
 SERIAL_PORT_CONNECT_TIMEOUT = True  
+# 需要在 U-Boot 中设置的环境变量
+UBOOT_ENV = {
+    'bootcmd': 'setvobg 0 0; run run_logo; run update_script;',
+}
+# 修改 U-Boot 环境变量的方式 (命令行 --uboot-env-method):
+# 'linux': 在系统中通过 SSH 直接修改并回读校验 (fw_setenv, 或按 fw_env.config 读写环境变量区),
+#          不需要串口、人工确认和额外的重启; 设备不支持时单台模式自动改用串口
+# 'serial': 重启进入 U-Boot 命令行, 通过串口 setenv
+UBOOT_ENV_METHOD = 'linux'
+# 环境变量区位置 [(设备, 偏移, 大小), ...], 第二项为冗余环境变量; None 表示使用设备上的 /etc/fw_env.config
+UBOOT_ENV_LOCATIONS = None
+UBOOT_ENV_CONFIG = '/etc/fw_env.config'
+# 在 U-Boot 下烧写镜像: 通过串口 loady (--serial-flash, 网络不可用时) 或 TFTP (--tftp-flash)
+# 镜像加载到的内存地址
+UBOOT_LOAD_ADDR = 0x42000000
+# 要烧写的镜像 (内核 / FIP / 开机画面等): [(本地文件, 烧写命令)]
+# 命令中的 {addr} {size} {blocks} 替换为加载地址、字节数和 512 字节块数 (十六进制)
+# 例如 (os.path.join(PARENT_DIR, 'bootlogo.jpg'), 'mmc write {addr} 0x<分区起始块> {blocks}')
+UBOOT_FLASH_IMAGES = []
+# 单条 tftp / 烧写命令的超时 (秒)
+UBOOT_FLASH_TIMEOUT = 120
+# loady 传输期间临时切换到的波特率 (USB 串口芯片一般支持 921600), None 表示保持 BAUDRATE
+SERIAL_LOAD_BAUDRATE = 921600
+# 本机 TFTP 服务地址 (U-Boot 的 serverip), None 表示自动选择能到达 DEVICE_IP 的本机地址
+TFTP_SERVER_IP = None
+# TFTP 服务端口, 不是 69 时通过 U-Boot 的 tftpdstp 告知设备 (0 表示随机端口)
+TFTP_PORT = 69
+# U-Boot 的 tftpblocksize / tftpwindowsize (RFC 2348 / 7440), 窗口需要 U-Boot 支持
+TFTP_BLKSIZE = 1468
+TFTP_WINDOWSIZE = 16
 
 # ================= 路径配置 =================
 # 获取当前脚本所在目录
@@ -36,42 +92,330 @@ AUDIO_PATCH_DIR_NAME = 'ss528v100增加USB音频'
 LOCAL_AUDIO_PATH = os.path.join(PARENT_DIR, AUDIO_PATCH_DIR_NAME)
 
 # 2. 应用安装包
-# 将通过 find_app_package() 动态查找
+# 通过 find_app_package() 从安装包索引中选择: 默认取版本号最高的一个
+# 指定版本号 (例如 '1.0.0.1', 或命令行 --app-version) 时固定使用该版本
+APP_VERSION = None
+
+# 3. 本地缓存目录 (文件摘要等)
+CACHE_DIR = os.path.join(BASE_DIR, '.deploy_cache')
+DIGEST_CACHE_FILE = os.path.join(CACHE_DIR, 'digests.json')
+# 安装包索引 (版本号/大小/摘要)
+ARTIFACT_INDEX_FILE = os.path.join(CACHE_DIR, 'artifacts.db')
+# 校验算法, 需与设备 busybox 提供的命令一致 (md5sum / sha256sum)
+DIGEST_ALGO = 'md5'
+# 应用安装包直接通过 SSH 通道流式解压 (False 则先上传到 REMOTE_TEMP 再解压)
+APP_STREAM_EXTRACT = True
+# 应用安装包的传输格式: 'auto' 先测量链路吞吐和设备解压速度, 选总耗时最短的格式;
+# 也可固定为 'none' / 'gzip' / 'lzop' / 'bzip2' / 'xz' (命令行 --transfer-format)
+APP_TRANSFER_FORMAT = 'auto'
+# 转码后的安装包缓存 (按安装包摘要保存, 每种格式只生成一次) 及容量上限
+TRANSCODE_CACHE_DIR = os.path.join(CACHE_DIR, 'transcode')
+TRANSCODE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# 探测样本大小 (安装包解压后的前这么多字节); 安装包小于 TRANSCODE_MIN_SIZE 时不探测, 直接传 gzip
+TRANSCODE_PROBE_BYTES = 4 * 1024 * 1024
+TRANSCODE_MIN_SIZE = 8 * 1024 * 1024
+# 在前面的步骤 (例如 fip.bin.sh) 执行期间, 把应用安装包提前上传到设备上重启后仍保留的目录
+# (上传前先把根目录重新挂载为可写); 安装时直接在设备上解压; None 表示不预上传
+PRESTAGE_DIR = '/root/.adp_stage'
+# 执行步骤前先在设备上检查目标状态 (一次往返), 已满足的步骤直接跳过
+REMOTE_PROBE_ENABLED = True
+# 设备上记录步骤完成标记的目录 (重启后保留), 标记内容为该步骤使用的本地文件摘要
+DEVICE_STATE_DIR = '/root/.adp_state'
+# USB 音频补丁中的 ALSA 版本
+ALSA_VERSION = '1.2.9'
+# 大文件多通道并行上传 (SFTP): 通道数、分块大小、超过该大小才启用
+# 默认 1 (不启用, 用 SCP): 所有通道共用一个 SSH 连接 (同一加密流和 GIL), 实测比 SCP 慢
+# (bench_deploy.py --upload-mb 64: SCP 87 MB/s, SFTP x4 52 MB/s); 用 --bench-upload 在实际链路上确认更快后再调大
+PARALLEL_UPLOAD_CHANNELS = 1
+PARALLEL_UPLOAD_CHUNK = 8 * 1024 * 1024
+PARALLEL_UPLOAD_MIN_SIZE = 16 * 1024 * 1024
+# SFTP 通道窗口和最大包长, 窗口越大单通道在高延迟链路上的吞吐越高
+SFTP_WINDOW_SIZE = 8 * 1024 * 1024
+SFTP_MAX_PACKET = 32768
+# 每次 write 的数据块大小
+SFTP_WRITE_BLOCK = 32 * 1024
+# 每台设备的部署记录 (断点续做)
+JOURNAL_DIR = os.path.join(CACHE_DIR, 'journal')
+JOURNAL_ENABLED = True
+# 音频补丁打包缓存目录及容量上限 (超出后按最近最少使用淘汰)
+BUNDLE_CACHE_DIR = os.path.join(CACHE_DIR, 'bundles')
+BUNDLE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 黄金镜像 (--golden-capture 从参考设备采集, --golden 写入新设备)
+GOLDEN_DIR = os.path.join(CACHE_DIR, 'golden')
+# 按块存储的分区: 开机画面分区
+GOLDEN_PARTITIONS = ['/dev/mmcblk0p4']
+# 按目录树存储的内容: 应用、ALSA 库、开机画面文件
+GOLDEN_TREES = ['/app/dt', '/root/hi626/lib-36a/_install', '/recovery/bootlogo.jpg']
+# ALSA 工具所在目录: 只采集步骤 1 复制进去的文件 (补丁包 alsa-utils-*/bin 下的文件), 不覆盖目录中的其他程序
+GOLDEN_TOOLS_DIR = '/usr/bin'
+
+# 分区存储的块大小, 每块单独压缩, 内容相同的块只存一份
+GOLDEN_BLOCK_SIZE = 1024 * 1024
+# fip.bin.sh 更新的内核分区不在 GOLDEN_PARTITIONS 中时, 写入镜像后仍需执行 fip.bin.sh
+# 把内核分区加入 GOLDEN_PARTITIONS 后可改为 False
+GOLDEN_RUN_FIP = True
+# 写入镜像后执行的命令 (不属于文件内容的配置)
+GOLDEN_POST_COMMANDS = ["addgroup audio || true", "sync"]
+
+# 每条远程命令的 stdout/stderr 只保留最后这么多字节 (出错时打印), 输出再多内存也不增长
+CMD_OUTPUT_TAIL = 16 * 1024
+# 远程命令的完整输出实时写入该文件, None 表示不记录 (可用 --cmd-log 指定)
+CMD_LOG_FILE = None
+# 串口输出 (含时间戳) 压缩保存到该目录, 按板子分文件并轮转, None 表示不记录
+SERIAL_LOG_DIR = os.path.join(CACHE_DIR, 'serial')
+# 每次启动的各阶段耗时追加到该文件 (python boot_log.py report 或 --boot-report 查看)
+BOOT_PROFILE_FILE = os.path.join(CACHE_DIR, 'boot_profiles.jsonl')
+# 步骤 4 reset 之后继续读串口直到设备启动完成, 记录启动耗时 (可用 --boot-profile 开启)
+BOOT_PROFILE_WAIT = False
+# 等待启动完成的超时 (秒)
+BOOT_PROFILE_TIMEOUT = 120
+
+# ================= 批量(产线)配置 =================
+# 同时处理的设备数量上限
+FLEET_WORKERS = 16
+# 重启后等待设备上线的超时 (秒)
+REBOOT_ONLINE_TIMEOUT = 120
+# 发送 reboot 后等待设备下线的超时 (秒), 避开设备刚关机时 sshd 仍可连接的假象
+REBOOT_DOWN_TIMEOUT = 30
+# 上线探测的间隔范围 (秒), 从最小值开始逐步退避到最大值
+PROBE_INTERVAL_MIN = 0.2
+PROBE_INTERVAL_MAX = 2.0
+# 重启后 SSH 重连的最大尝试次数
+RECONNECT_RETRIES = 3
+
+# SSH 保活间隔 (秒), 用于尽早发现失效的连接
+SSH_KEEPALIVE_INTERVAL = 5
+
+# 批量模式下 LoadingSpinner 不单独占一行, 只更新设备所在的进度行
+SPINNER_ENABLED = True
 # ======================================================
 
 class LoadingSpinner:
+    """
+    在统一的进度显示 (progress.renderer) 中显示一个任务
+    批量模式下不单独占一行, 而是显示在所属设备的进度行中
+    """
+
     def __init__(self, message="Loading...", delay=0.1):
         self.message = message
-        self.delay = delay
-        self.stop_running = False
-        self.screen_lock = threading.Lock()
-        
-    def spinner_task(self):
-        spinner = itertools.cycle(['|', '/', '-', '\\'])
-        while not self.stop_running:
-            with self.screen_lock:
-                sys.stdout.write(f'\r{next(spinner)} {self.message}')
-                sys.stdout.flush()
-            time.sleep(self.delay)
-            
-        # 清除最后一行
-        sys.stdout.write('\r' + ' ' * (len(self.message) + 2) + '\r')
-        sys.stdout.flush()
+        self.task = None
 
     def __enter__(self):
-        self.stop_running = False
-        self.thread = threading.Thread(target=self.spinner_task)
-        self.thread.start()
+        if SPINNER_ENABLED:
+            self.task = renderer.add_task(self.message.strip())
+            push_task(self.task)
+        else:
+            parent = current_task()
+            if parent is not None:
+                parent.update(status=self.message.strip())
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.stop_running = True
-        self.thread.join()
-
+        if self.task is None:
+            parent = current_task()
+            if parent is not None:
+                parent.reset_progress()
+            return
+        pop_task(self.task)
         if exc_type is None:
-            sys.stdout.write(f' {self.message} success\n')
+            self.task.finish(f' {self.message} success')
         elif not SERIAL_PORT_CONNECT_TIMEOUT:
-            sys.stdout.write(f' {self.message} FAILED\n')
+            self.task.finish(f' {self.message} FAILED')
+        else:
+            self.task.finish()
+
+
+# ================= 耗时追踪 =================
+# 当前线程所属的设备, 用于在追踪记录中区分批量模式下的多台设备
+_trace_ctx = threading.local()
+
+
+class Tracer:
+    """
+    记录各操作的开始/结束时间、传输字节数和返回码
+    可实时写入 JSONL, 结束后导出 Chrome trace (chrome://tracing / Perfetto)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = []
+        self.jsonl = None
+        self.t0 = time.time()
+
+    def open(self, jsonl_path=None):
+        self.enabled = True
+        if jsonl_path:
+            self.jsonl = open(jsonl_path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self.jsonl:
+            self.jsonl.close()
+            self.jsonl = None
+
+    def record(self, name, start, end=None, **fields):
+        if not self.enabled:
+            return
+        end = time.time() if end is None else end
+        event = {
+            'name': name,
+            'device': getattr(_trace_ctx, 'device', DEVICE_IP),
+            'thread': threading.current_thread().name,
+            'start': round(start, 6),
+            'end': round(end, 6),
+            'dur': round(end - start, 6),
+        }
+        event.update(fields)
+        if fields.get('bytes') and end > start:
+            event['mbps'] = round(fields['bytes'] / 1048576 / (end - start), 2)
+        with self.lock:
+            self.events.append(event)
+            if self.jsonl:
+                self.jsonl.write(json.dumps(event, ensure_ascii=False) + '\n')
+                self.jsonl.flush()
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        """记录一段代码的耗时; 可在 with 块中向返回的 dict 补充字段"""
+        start = time.time()
+        try:
+            yield fields
+        except Exception as e:
+            fields['error'] = str(e)
+            raise
+        finally:
+            self.record(name, start, **fields)
+
+    def export_chrome(self, path):
+        """导出 Chrome trace 格式, 每台设备一个进程, 每个线程一行"""
+        pids, tids, trace = {}, {}, []
+        with self.lock:
+            events = list(self.events)
+        for ev in events:
+            pid = pids.setdefault(ev['device'], len(pids) + 1)
+            tid = tids.setdefault((pid, ev['thread']), len(tids) + 1)
+            args = {k: v for k, v in ev.items() if k not in ('name', 'device', 'thread', 'start', 'end', 'dur')}
+            trace.append({'name': ev['name'], 'ph': 'X', 'pid': pid, 'tid': tid,
+                          'ts': int((ev['start'] - self.t0) * 1e6), 'dur': int(ev['dur'] * 1e6),
+                          'args': args})
+        for device, pid in pids.items():
+            trace.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': device}})
+        for (pid, thread), tid in tids.items():
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+tracer = Tracer()
+
+
+def traced(name):
+    """装饰器: 记录函数耗时和返回结果"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name) as fields:
+                result = func(*args, **kwargs)
+                fields['ok'] = bool(result)
+                return result
+        return wrapper
+    return decorator
+
+
+# ================= 命令输出 =================
+class OutputTail:
+    """只保留最后 limit 字节的输出缓冲区, 内存占用固定"""
+
+    def __init__(self, limit=None):
+        self.limit = CMD_OUTPUT_TAIL if limit is None else limit
+        self.buf = bytearray()
+        self.total = 0
+
+    def feed(self, data):
+        self.total += len(data)
+        self.buf += data
+        if len(self.buf) > self.limit:
+            del self.buf[:len(self.buf) - self.limit]
+
+    @property
+    def truncated(self):
+        return self.total > len(self.buf)
+
+    def text(self):
+        text = self.buf.decode(errors='replace').strip()
+        if self.truncated:
+            text = f"(省略前 {self.total - len(self.buf)} 字节) ..." + text
+        return text
+
+
+_cmd_log_lock = threading.Lock()
+_cmd_log = None
+
+
+def log_command_output(data):
+    """把命令输出实时追加到 CMD_LOG_FILE (未配置时忽略)"""
+    global _cmd_log
+    if not CMD_LOG_FILE:
+        return
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with _cmd_log_lock:
+        if _cmd_log is None:
+            _cmd_log = open(CMD_LOG_FILE, 'ab')
+            atexit.register(_cmd_log.close)
+        _cmd_log.write(data)
+        _cmd_log.flush()
+
+
+def _log_command_start(cmd):
+    device = getattr(_trace_ctx, 'device', DEVICE_IP)
+    log_command_output(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] [{device}] $ {cmd}\n")
+
+
+def drain_channel(chan, on_stdout, on_stderr):
+    """
+    在等待退出码的同时读取通道输出, 返回退出码
+    先 recv_exit_status 再读取的话, 输出较多 (例如 tar -v) 时 SSH 窗口被填满, 远程命令会一直阻塞
+    退出码可能先于最后一段输出到达, 必须等到 EOF (或通道关闭) 且缓冲区读空才算结束
+    """
+    while True:
+        # 先取 EOF 状态再读: EOF 之前的数据此时都已在缓冲区中
+        eof = chan.eof_received or chan.closed
+        got = False
+        if chan.recv_ready():
+            on_stdout(chan.recv(32768))
+            got = True
+        if chan.recv_stderr_ready():
+            on_stderr(chan.recv_stderr(32768))
+            got = True
+        if got:
+            continue
+        if eof and chan.exit_status_ready():
+            break
+        if eof:
+            # 输出已结束, 只等退出码
+            chan.status_event.wait(0.1)
+        else:
+            select.select([chan], [], [], 0.1)
+    return chan.recv_exit_status()
+
+
+def run_remote(ssh, command):
+    """执行命令, 返回 (退出码, stdout 尾部, stderr 尾部), 完整输出写入命令日志"""
+    stdin, stdout, stderr = ssh.exec_command(command)
+    out_tail, err_tail = OutputTail(), OutputTail()
+    _log_command_start(command)
+
+    def on_stdout(data):
+        out_tail.feed(data)
+        log_command_output(data)
+
+    def on_stderr(data):
+        err_tail.feed(data)
+        log_command_output(data)
+
+    exit_status = drain_channel(stdout.channel, on_stdout, on_stderr)
+    return exit_status, out_tail, err_tail
 
 
 def run_cmd_verbose(ssh, cmd):
@@ -79,16 +423,13 @@ def run_cmd_verbose(ssh, cmd):
     辅助函数：执行命令并打印返回码、标准输出和错误信息
     """
     print(f"\n[执行命令] {cmd}")
-    
-    # Paramiko 的标准执行方式
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    
-    # 阻塞直到命令执行完毕，获取退出状态码 (Exit Code)
-    exit_status = stdout.channel.recv_exit_status()
-    
-    # 获取输出内容
-    out_msg = stdout.read().decode().strip()
-    err_msg = stderr.read().decode().strip()
+    t0 = time.time()
+
+    exit_status, out_tail, err_tail = run_remote(ssh, cmd)
+    tracer.record("run_cmd_verbose", t0, cmd=cmd, exit_code=exit_status,
+                  out_bytes=out_tail.total, err_bytes=err_tail.total)
+
+    out_msg = out_tail.text()
 
     # 打印返回码
     print(f"  └─ [返回码]: {exit_status}")
@@ -99,57 +440,794 @@ def run_cmd_verbose(ssh, cmd):
     
     # 如果出错（返回码不为0），打印错误信息
     if exit_status != 0:
-        print(f"  └─ [ 错误信息]: {err_msg}")
+        # 有些脚本 (例如 install.sh) 把错误打印到 stdout, stderr 为空时打印 stdout 末尾
+        print(f"  └─ [ 错误信息]: {err_tail.text() or out_msg}")
         return False
     
     return True
 
 
+# 已连接过的设备主机密钥, 重连时直接使用, 省去主机密钥类型协商和 AutoAdd
+_host_key_cache = {}
+
 
-def create_ssh_client():
+@traced("create_ssh_client")
+def create_ssh_client(host=DEVICE_IP):
     """创建 SSH 连接"""
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    cached_key = _host_key_cache.get(host)
+    if cached_key is not None:
+        client.get_host_keys().add(f"[{host}]:{SSH_PORT}" if SSH_PORT != 22 else host,
+                                   cached_key.get_name(), cached_key)
     try:
-        with LoadingSpinner(f" 正在连接到设备 {DEVICE_IP}..."):
-            client.connect(DEVICE_IP, port=SSH_PORT, username=USERNAME, password=PASSWORD, timeout=10)
+        with LoadingSpinner(f" 正在连接到设备 {host}..."):
+            # 只用密码认证, 不尝试本机密钥和 agent (每次尝试都多一个往返)
+            client.connect(host, port=SSH_PORT, username=USERNAME, password=PASSWORD, timeout=10,
+                           look_for_keys=False, allow_agent=False)
+            transport = client.get_transport()
+            transport.set_keepalive(SSH_KEEPALIVE_INTERVAL)
+            _enable_tcp_keepalive(transport.sock)
+            _host_key_cache[host] = transport.get_remote_server_key()
             return client
+    except paramiko.BadHostKeyException as e:
+        client.close()
+        # 设备每次启动重新生成主机密钥 (例如只读根文件系统上的 dropbear -R): 丢弃缓存, 按新密钥重连
+        if _host_key_cache.pop(host, None) is None:
+            print(f" [{host}] 连接失败: {e}")
+            return None
+        print(f" [{host}] 主机密钥已变化 (设备重新生成了密钥)，重新连接")
+        return create_ssh_client(host)
     except Exception as e:
-        print(f" 连接失败: {e}")
+        print(f" [{host}] 连接失败: {e}")
         return None
 
+
+def _enable_tcp_keepalive(sock):
+    """开启 TCP 层保活, 设备断电/断网时连接能较快失效"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, SSH_KEEPALIVE_INTERVAL)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, SSH_KEEPALIVE_INTERVAL)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except (OSError, AttributeError):
+        pass
+
 def exec_cmd(ssh, command, ignore_error=False):
     """执行 SSH 命令并检查结果"""
     # print(f"   [CMD] {command}") 
-    stdin, stdout, stderr = ssh.exec_command(command)
-    exit_status = stdout.channel.recv_exit_status()
-    
-    output = stdout.read().decode().strip()
-    error = stderr.read().decode().strip()
+    t0 = time.time()
+    exit_status, out_tail, err_tail = run_remote(ssh, command)
+    tracer.record("exec_cmd", t0, cmd=command, exit_code=exit_status)
     
     if exit_status != 0 and not ignore_error:
         print(f" 命令执行失败: {command}")
-        print(f" 错误信息: {error}")
+        print(f" 错误信息: {err_tail.text() or out_tail.text()}")
+        return False
+    return True
+
+# 批量执行的单条命令结果
+CommandResult = collections.namedtuple("CommandResult", "cmd exit_status stdout stderr elapsed")
+
+# 批量执行时插入到 stdout/stderr 中的分隔标记
+_BATCH_MARKER = re.compile(rb"\n?@@ADP([0-9a-f]+):([BE]):(\d+)(?::(-?\d+))?\n")
+
+
+def _build_batch_script(commands, token):
+    """
+    把命令列表拼成一个 shell 脚本
+    每条命令在子 shell 中执行 (与单独 exec_command 一样, cd 不会影响下一条),
+    前后在 stdout/stderr 中各输出一个标记, 失败时立即退出
+    """
+    lines = []
+    for i, cmd in enumerate(commands):
+        lines.append(f"printf '\\n@@ADP{token}:B:{i}\\n'; printf '\\n@@ADP{token}:B:{i}\\n' >&2")
+        lines.append(f"( {cmd}\n) </dev/null")
+        lines.append("__rc=$?")
+        lines.append(f"printf '\\n@@ADP{token}:E:{i}:%d\\n' $__rc; printf '\\n@@ADP{token}:E:{i}:%d\\n' $__rc >&2")
+        lines.append("[ $__rc -eq 0 ] || exit $__rc")
+    return "\n".join(lines) + "\n"
+
+
+class _BatchStream:
+    """
+    按标记把批量执行的输出流切分到每条命令, 每条命令只保留输出尾部
+    数据边收边切分, 不保存完整输出
+    """
+
+    def __init__(self, token, commands=None, on_marker=None, log=False):
+        self.token = token
+        self.commands = commands
+        self.on_marker = on_marker
+        self.log = log
+        self.pending = bytearray()
+        self.current = None
+        # {序号: OutputTail}, {序号: 返回码}
+        self.sections = {}
+        self.codes = {}
+
+    def _emit(self, data):
+        if self.current is None or not data:
+            return
+        self.sections[self.current].feed(data)
+        if self.log:
+            log_command_output(data)
+
+    def feed(self, data):
+        self.pending += data
+        pos = 0
+        for m in _BATCH_MARKER.finditer(self.pending):
+            if m.group(1).decode() != self.token:
+                continue
+            self._emit(bytes(self.pending[pos:m.start()]))
+            pos = m.end()
+            idx = int(m.group(3))
+            if m.group(2) == b"B":
+                self.current = idx
+                self.sections[idx] = OutputTail()
+                if self.log and self.commands:
+                    _log_command_start(self.commands[idx])
+            else:
+                self.codes[idx] = int(m.group(4))
+                self.current = None
+            if self.on_marker:
+                self.on_marker(m.group(2), idx)
+        rest = self.pending[pos:]
+        # 标记总是以换行开头; 最后一个换行之后的短内容可能是不完整的标记, 留到下次
+        nl = rest.rfind(b"\n")
+        keep = nl if nl >= 0 and len(rest) - nl <= 64 else len(rest)
+        self._emit(bytes(rest[:keep]))
+        self.pending = rest[keep:]
+
+    def close(self):
+        self._emit(bytes(self.pending))
+        self.pending = bytearray()
+
+    def result(self, idx):
+        """返回 (输出, 返回码); 没有结束标记的命令 (例如连接被 reboot 断开) 返回码为 None"""
+        tail = self.sections.get(idx)
+        return (tail.text() if tail else ""), self.codes.get(idx)
+
+
+def exec_batch(ssh, commands, verbose=False):
+    """
+    在一个 SSH 通道中批量执行命令列表, 遇到第一条失败的命令即停止
+    返回 (是否全部成功, [CommandResult, ...])
+    """
+    batch_start = time.time()
+    token = os.urandom(4).hex()
+    chan = ssh.get_transport().open_session()
+    chan.exec_command(_build_batch_script(commands, token))
+
+    # 每条命令开始/结束标记到达的时间, 用于计算单条耗时
+    stamps = {}
+
+    def on_marker(kind, idx):
+        stamps.setdefault((kind, idx), time.time())
+
+    outs = _BatchStream(token, commands, on_marker, log=True)
+    errs = _BatchStream(token, log=True)
+    channel_status = drain_channel(chan, outs.feed, errs.feed)
+    chan.close()
+    outs.close()
+    errs.close()
+    end_time = time.time()
+
+    results = []
+    tracer.record("exec_batch", batch_start, end_time, commands=len(commands), exit_code=channel_status)
+    for i, cmd in enumerate(commands):
+        if i not in outs.sections:
+            break
+        out_msg, rc = outs.result(i)
+        err_msg = errs.result(i)[0]
+        if rc is None:
+            rc = channel_status if channel_status != 0 else -1
+        t_begin = stamps.get((b"B", i), end_time)
+        elapsed = stamps.get((b"E", i), end_time) - t_begin
+        results.append(CommandResult(cmd, rc, out_msg, err_msg, elapsed))
+        tracer.record("batch_cmd", t_begin, t_begin + elapsed, cmd=cmd, exit_code=rc)
+
+        if verbose:
+            print(f"\n[执行命令] {cmd}")
+            print(f"  └─ [返回码]: {rc}  ({elapsed:.1f}s)")
+            if out_msg:
+                print(f"  └─ [标准输出]: {out_msg[:200]}..." if len(out_msg)>200 else f"  └─ [标准输出]: {out_msg}")
+        if rc != 0:
+            if verbose:
+                print(f"  └─ [ 错误信息]: {err_msg or out_msg}")
+            else:
+                print(f" 命令执行失败: {cmd}")
+                print(f" 错误信息: {err_msg or out_msg}")
+            return False, results
+
+    ok = len(results) == len(commands) and channel_status == 0
+    if not ok and len(results) < len(commands):
+        print(f" 批量执行中断: 仅完成 {len(results)}/{len(commands)} 条命令 (返回码 {channel_status})")
+    return ok, results
+
+# ================= 上传去重 =================
+_digest_lock = threading.Lock()
+_digest_cache = None
+
+
+def _load_digest_cache():
+    global _digest_cache
+    if _digest_cache is None:
+        try:
+            with open(DIGEST_CACHE_FILE, 'r', encoding='utf-8') as f:
+                _digest_cache = json.load(f)
+        except (OSError, ValueError):
+            _digest_cache = {}
+    return _digest_cache
+
+
+def _save_digest_cache():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = DIGEST_CACHE_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(_digest_cache, f, indent=1)
+    os.replace(tmp, DIGEST_CACHE_FILE)
+
+
+def local_digest(path):
+    """
+    计算本地文件摘要
+    结果按 路径+大小+修改时间 缓存到磁盘, 文件未变化时不重新读取
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = f"{DIGEST_ALGO}:{path}"
+    with _digest_lock:
+        entry = _load_digest_cache().get(key)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return entry['digest']
+
+    # 应用安装包的摘要已记录在安装包索引中
+    artifact = get_artifact_index().lookup(path) if package_version(path) else None
+    if artifact is not None:
+        digest = artifact.digest
+    else:
+        h = hashlib.new(DIGEST_ALGO)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+
+    with _digest_lock:
+        _load_digest_cache()[key] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'digest': digest}
+        _save_digest_cache()
+    return digest
+
+
+def remote_digests(ssh, remote_paths):
+    """一次性获取多个远程文件的摘要, 不存在的文件不会出现在结果中"""
+    if not remote_paths:
+        return {}
+    # 按序号输出, 不依赖 md5sum 回显的文件名
+    script = "; ".join(f"echo {i} $( ({DIGEST_ALGO}sum < '{p}') 2>/dev/null)"
+                       for i, p in enumerate(remote_paths))
+    stdin, stdout, stderr = ssh.exec_command(script)
+    out_buf = bytearray()
+    # 每个文件一行, 输出量与文件数成正比, 完整保留; stderr 丢弃
+    drain_channel(stdout.channel, out_buf.extend, lambda data: None)
+    result = {}
+    for line in out_buf.decode(errors='replace').splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].isdigit() and int(parts[0]) < len(remote_paths):
+            result[remote_paths[int(parts[0])]] = parts[1].lower()
+    return result
+
+
+def upload_if_changed(ssh, files):
+    """
+    上传文件, 跳过设备上内容已一致的文件
+    files: [(本地路径, 远程完整路径), ...]
+    返回 (上传数量, 跳过数量)
+    """
+    remote = remote_digests(ssh, [r for _, r in files])
+    pending = [(l, r) for l, r in files if remote.get(r) != local_digest(l)]
+
+    small = []
+    for local_path, remote_path in pending:
+        if PARALLEL_UPLOAD_CHANNELS > 1 and os.path.getsize(local_path) >= PARALLEL_UPLOAD_MIN_SIZE:
+            try:
+                if parallel_upload(ssh, local_path, remote_path):
+                    continue
+            except paramiko.SSHException as e:
+                # 设备不支持 SFTP 时退回 SCP
+                print(f"\n   SFTP 并行上传不可用 ({e})，改用 SCP")
+        small.append((local_path, remote_path))
+
+    if small:
+        with SCPClient(ssh.get_transport(), progress=_scp_progress) as scp:
+            for local_path, remote_path in small:
+                with tracer.span("scp_put", file=os.path.basename(local_path),
+                                 bytes=os.path.getsize(local_path)):
+                    scp.put(local_path, remote_path)
+    return len(pending), len(files) - len(pending)
+
+
+def _scp_progress(filename, size, sent):
+    report_progress(done=sent, total=size)
+
+
+def _open_sftp(transport):
+    return paramiko.SFTPClient.from_transport(
+        transport, window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET)
+
+
+def parallel_upload(ssh, local_path, remote_path, channels=PARALLEL_UPLOAD_CHANNELS,
+                    chunk_size=PARALLEL_UPLOAD_CHUNK):
+    """
+    多通道并行上传大文件
+    文件按 chunk_size 分块, 多个 SFTP 通道 (同一 SSH 连接) 各自按偏移写入同一个远程文件,
+    写入使用流水线模式 (不逐包等待确认); 完成后在设备端计算摘要校验
+    """
+    with tracer.span("parallel_upload", file=os.path.basename(local_path),
+                     bytes=os.path.getsize(local_path), channels=channels) as fields:
+        ok = _parallel_upload(ssh, local_path, remote_path, channels, chunk_size)
+        fields['ok'] = ok
+        return ok
+
+
+def _parallel_upload(ssh, local_path, remote_path, channels, chunk_size):
+    transport = ssh.get_transport()
+    size = os.path.getsize(local_path)
+
+    sftp = _open_sftp(transport)
+    try:
+        with sftp.open(remote_path, 'wb') as f:
+            f.truncate(size)
+    finally:
+        sftp.close()
+
+    offsets = queue.Queue()
+    for offset in range(0, size, chunk_size):
+        offsets.put(offset)
+    errors = []
+    # 工作线程没有自己的任务, 进度记到调用方线程的任务上
+    task = current_task()
+    if task is not None:
+        task.update(done=0, total=size)
+
+    def worker():
+        client = _open_sftp(transport)
+        try:
+            with client.open(remote_path, 'r+b') as rf, open(local_path, 'rb') as lf:
+                rf.set_pipelined(True)
+                while not errors:
+                    try:
+                        offset = offsets.get_nowait()
+                    except queue.Empty:
+                        return
+                    lf.seek(offset)
+                    data = lf.read(chunk_size)
+                    rf.seek(offset)
+                    for i in range(0, len(data), SFTP_WRITE_BLOCK):
+                        rf.write(data[i:i + SFTP_WRITE_BLOCK])
+                    if task is not None:
+                        task.update(advance=len(data))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(channels, offsets.qsize())))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    remote = remote_digests(ssh, [remote_path]).get(remote_path)
+    if remote != local_digest(local_path):
+        print(f"\n 并行上传校验失败: {remote_path}")
+        return False
+    return True
+
+
+def benchmark_upload(ssh, local_path, remote_dir=REMOTE_TEMP, channel_counts=(1, 2, 4, 8)):
+    """对比 SCP 与多通道 SFTP 上传同一文件的吞吐量"""
+    size = os.path.getsize(local_path)
+    remote_path = f"{remote_dir}/.adp_bench_upload"
+    results = []
+
+    t0 = time.time()
+    with SCPClient(ssh.get_transport(), progress=_scp_progress) as scp:
+        with tracer.span("scp_put", file=os.path.basename(local_path), bytes=size):
+            scp.put(local_path, remote_path)
+    results.append(("SCP", time.time() - t0))
+
+    for n in channel_counts:
+        exec_cmd(ssh, f"rm -f {remote_path}", ignore_error=True)
+        t0 = time.time()
+        ok = parallel_upload(ssh, local_path, remote_path, channels=n)
+        results.append((f"SFTP x{n}" + ("" if ok else " (校验失败)"), time.time() - t0))
+
+    exec_cmd(ssh, f"rm -f {remote_path}", ignore_error=True)
+    print(f"\n上传测试: {os.path.basename(local_path)} ({size / 1048576:.1f} MB)")
+    for name, elapsed in results:
+        print(f"  {name:<20} {elapsed:>7.2f}s  {size / 1048576 / max(elapsed, 1e-6):>7.1f} MB/s")
+    return results
+
+def stream_to_remote(ssh, chunks, total, remote_dir, sink, trace_name="stream_to_remote", **trace_fields):
+    """
+    把 chunks 依次通过通道 stdin 直接送入设备端命令 sink (例如 tar -xz、gzip -dc | dd)
+    发送与处理同时进行; 本地和设备端在同一遍数据上计算摘要, 结束后比对
+    """
+    fifo = f"{remote_dir}/.adp_stream_fifo"
+    sum_file = f"{remote_dir}/.adp_stream_sum"
+    # 设备端: tee 把数据同时送给 sink 和 (经 fifo) 摘要计算
+    # sink 可能在 EOF 之前就停止读取 (例如 busybox tar 读到结束块), 之后由 cat 读完剩余数据,
+    # 保证 tee 和摘要计算看到完整的数据流; 返回码仍取 sink 的
+    script = (
+        f"cd {remote_dir} && rm -f {fifo} {sum_file} && mkfifo {fifo} || exit 1\n"
+        f"{DIGEST_ALGO}sum < {fifo} > {sum_file} &\n"
+        f"tee {fifo} | {{ {sink}; rc=$?; cat >/dev/null; exit $rc; }}\n"
+        "rc=$?\n"
+        "wait\n"
+        f"cat {sum_file}\n"
+        f"rm -f {fifo} {sum_file}\n"
+        "exit $rc\n"
+    )
+    t0 = time.time()
+    chan = ssh.get_transport().open_session()
+    chan.exec_command(script)
+
+    h = hashlib.new(DIGEST_ALGO)
+    report_progress(done=0, total=total)
+    out_tail = OutputTail()
+    err_tail = OutputTail()
+
+    def drain():
+        while chan.recv_ready():
+            out_tail.feed(chan.recv(32768))
+        while chan.recv_stderr_ready():
+            err_tail.feed(chan.recv_stderr(32768))
+
+    for chunk in chunks:
+        if chan.exit_status_ready():
+            # 设备端提前退出 (例如 tar 解压出错)
+            break
+        chan.sendall(chunk)
+        # 只计入实际发送的数据
+        h.update(chunk)
+        report_progress(advance=len(chunk))
+        drain()
+    chan.shutdown_write()
+
+    exit_status = drain_channel(chan, out_tail.feed, err_tail.feed)
+    chan.close()
+
+    tracer.record(trace_name, t0, bytes=total, exit_code=exit_status, **trace_fields)
+    if exit_status != 0:
+        print(f" 设备端处理失败 (返回码 {exit_status}): {err_tail.text()}")
+        return False
+
+    # 摘要是最后一行输出
+    lines = out_tail.text().splitlines()
+    remote = lines[-1].split()[0].lower() if lines and lines[-1].split() else ''
+    if remote != h.hexdigest():
+        print(f" 校验失败: 本地 {h.hexdigest()} / 设备 {remote or '(无)'}")
         return False
     return True
 
+
+def stream_extract(ssh, local_path, remote_dir, tar_flags='-xzf', chunk_size=256 * 1024, sink=None):
+    """
+    将本地 .tar.gz 通过通道 stdin 直接送入设备端 tar -xz
+    上传与解压同时进行, 设备端校验摘要
+    sink: 其他格式的设备端解压命令 (例如 xz -dc | tar -xf -), 默认 tar {tar_flags} -
+    """
+    def read_chunks():
+        with open(local_path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+    return stream_to_remote(ssh, read_chunks(), os.path.getsize(local_path), remote_dir,
+                            sink or f"tar {tar_flags} -", "stream_extract", file=os.path.basename(local_path))
+
+# ================= 补丁打包缓存 =================
+_bundle_lock = threading.Lock()
+
+
+def _dir_manifest(src_dir):
+    """目录顶层文件的 (名称, 大小, 修改时间) 列表, 用于判断目录是否变化"""
+    entries = []
+    for name in sorted(os.listdir(src_dir)):
+        full_path = os.path.join(src_dir, name)
+        if os.path.isfile(full_path):
+            st = os.stat(full_path)
+            entries.append([name, st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def _load_bundle_index():
+    try:
+        with open(os.path.join(BUNDLE_CACHE_DIR, 'index.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'sources': {}, 'bundles': {}}
+
+
+def _save_bundle_index(index):
+    path = os.path.join(BUNDLE_CACHE_DIR, 'index.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _evict_bundles(index, keep):
+    """按最近使用时间淘汰旧包, 直到总大小不超过 BUNDLE_CACHE_MAX_BYTES"""
+    bundles = index['bundles']
+    total = sum(b['size'] for b in bundles.values())
+    for digest in sorted(bundles, key=lambda d: bundles[d]['last_used']):
+        if total <= BUNDLE_CACHE_MAX_BYTES:
+            break
+        if digest == keep:
+            continue
+        total -= bundles.pop(digest)['size']
+        try:
+            os.remove(os.path.join(BUNDLE_CACHE_DIR, digest + '.tar'))
+        except OSError:
+            pass
+    live = set(bundles)
+    index['sources'] = {k: v for k, v in index['sources'].items() if v in live}
+
+
+def _build_bundle(src_dir, manifest, out_path):
+    """生成确定性的 tar 包 (固定顺序/属主), 相同内容得到相同摘要"""
+    with tarfile.open(out_path, 'w', format=tarfile.GNU_FORMAT) as tar:
+        for name, _, _ in manifest:
+            info = tar.gettarinfo(os.path.join(src_dir, name), arcname=name)
+            info.uid = info.gid = 0
+            info.uname = info.gname = 'root'
+            with open(os.path.join(src_dir, name), 'rb') as f:
+                tar.addfile(info, f)
+
+
+def get_patch_bundle(src_dir):
+    """
+    获取补丁目录的打包文件, 返回 (路径, 摘要)
+    目录内容未变化时直接使用缓存, 否则重新打包
+    """
+    with _bundle_lock:
+        os.makedirs(BUNDLE_CACHE_DIR, exist_ok=True)
+        index = _load_bundle_index()
+        manifest = _dir_manifest(src_dir)
+        source_key = hashlib.md5(json.dumps([os.path.abspath(src_dir), manifest]).encode()).hexdigest()
+
+        digest = index['sources'].get(source_key)
+        if digest is None or not os.path.exists(os.path.join(BUNDLE_CACHE_DIR, digest + '.tar')):
+            tmp = os.path.join(BUNDLE_CACHE_DIR, f'build-{os.getpid()}.tar')
+            _build_bundle(src_dir, manifest, tmp)
+            h = hashlib.new(DIGEST_ALGO)
+            with open(tmp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            os.replace(tmp, os.path.join(BUNDLE_CACHE_DIR, digest + '.tar'))
+            index['sources'][source_key] = digest
+
+        path = os.path.join(BUNDLE_CACHE_DIR, digest + '.tar')
+        index['bundles'][digest] = {'size': os.path.getsize(path), 'last_used': time.time()}
+        _evict_bundles(index, keep=digest)
+        _save_bundle_index(index)
+        return path, digest
+
+# 本次运行选定的应用安装包, 所有步骤和设备都使用同一个
+_app_package = None
+_app_package_lock = threading.Lock()
+
+
+def get_artifact_index():
+    return ArtifactIndex(ARTIFACT_INDEX_FILE, PARENT_DIR, DIGEST_ALGO)
+
+
+def _select_app_package():
+    index = get_artifact_index()
+    index.scan()
+    artifacts = index.list()
+    for name in index.skipped:
+        print(f"   注意: 跳过 {name}: 无法解析版本号 (应为 install_dt-[V]XX.YY.ZZ.NNNN-ss528v100-Linux.tar.gz)")
+
+    if not artifacts:
+        print(f" 未在目录 {PARENT_DIR} 中找到应用安装包！")
+        print("   请确保文件命名格式为: install_dt-XX.YY.ZZ.NNNN-ss528v100-Linux.tar.gz (版本号前可带 V)")
+        sys.exit(1)
+
+    artifact = index.select(APP_VERSION)
+    if artifact is None:
+        print(f" 未找到版本为 {APP_VERSION} 的应用安装包，可用版本: {', '.join(a.version for a in artifacts)}")
+        sys.exit(1)
+
+    print(f" 发现应用包: {artifact.name} (版本 {artifact.version}，共 {len(artifacts)} 个)")
+    newest = max(artifacts, key=lambda a: a.mtime_ns)
+    if APP_VERSION is None and newest.name != artifact.name:
+        print(f"   注意: 最近修改的是 {newest.name}，但按版本号选择了 {artifact.version}")
+    return artifact
+
+
 def find_app_package():
     """
     在上一级目录自动搜寻应用安装包
     规则: install_dt-*-ss528v100-Linux.tar.gz 
+    按版本号 (而不是修改时间) 选择, 同一次运行中只选择一次
     """
-    pattern = os.path.join(PARENT_DIR, 'install_dt-*-ss528v100-Linux.tar.gz')
-    files = glob.glob(pattern)
-    
-    if not files:
-        print(f" 未在目录 {PARENT_DIR} 中找到应用安装包！")
-        print("   请确保文件命名格式为: install_dt-XX.YY.ZZ.NNNN-ss528v100-Linux.tar.gz")
-        sys.exit(1)
-    
-    # 如果有多个，取修改时间最新的
-    latest_file = max(files, key=os.path.getmtime)
-    print(f" 发现应用包: {os.path.basename(latest_file)}")
-    return latest_file
+    global _app_package
+    with _app_package_lock:
+        if _app_package is None:
+            _app_package = _select_app_package()
+        return _app_package.path
+
+
+def app_package_digest():
+    find_app_package()
+    return _app_package.digest
+
+
+def list_app_packages():
+    """打印安装包索引中的所有版本"""
+    index = get_artifact_index()
+    index.scan()
+    artifacts = index.list()
+    if not artifacts:
+        print(f" 目录 {PARENT_DIR} 中没有应用安装包")
+    for a in artifacts:
+        print(f"  {a.version:<16} {a.size / 1048576:>8.1f} MB  {a.digest}  {a.name}")
+
+# ================= 安装包传输格式 =================
+# 本次运行选定的传输格式及对应文件, 所有设备共用 (同一批设备、同一网络, 只探测一次)
+TransferPlan = collections.namedtuple("TransferPlan", "fmt path digest decompress")
+_transfer_plan = None
+_transfer_plan_lock = threading.Lock()
+# 探测选出的 (格式, 解压命令), 在第一个步骤开始前确定
+_transfer_format = None
+_transfer_format_lock = threading.Lock()
+
+
+def get_transcode_cache():
+    return TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES, DIGEST_ALGO)
+
+
+def _timed_remote(ssh, command, rtt=0.0):
+    """执行一条命令, 返回 (退出码, stdout, 扣除往返时间后的耗时)"""
+    t0 = time.time()
+    exit_status, out_tail, _ = run_remote(ssh, command)
+    return exit_status, out_tail.text(), max(time.time() - t0 - rtt, 1e-3)
+
+
+def probe_transfer_formats(ssh, src, formats):
+    """
+    用安装包开头的一段样本测量链路吞吐, 以及设备对每种格式的解压速度
+    返回 (链路 字节/秒, {格式: (解压命令, 解压 字节/秒, 压缩率)}), 设备上没有解压命令的格式不在结果中
+    """
+    raw = read_sample(src, TRANSCODE_PROBE_BYTES)
+    samples = {fmt: compress_bytes(fmt, raw) for fmt in formats}
+    probe_dir = f"{REMOTE_TEMP}/.adp_probe"
+    if not exec_cmd(ssh, f"rm -rf {probe_dir} && mkdir -p {probe_dir}"):
+        raise RuntimeError("无法创建探测目录")
+    try:
+        # 空命令的往返时间, 从后面的计时中扣除
+        rtt = min(_timed_remote(ssh, "true")[2] for _ in range(3))
+
+        # 未压缩样本的上传耗时即链路吞吐 (包含 SSH 加密开销)
+        chunks = [raw[i:i + 256 * 1024] for i in range(0, len(raw), 256 * 1024)]
+        t0 = time.time()
+        if not stream_to_remote(ssh, chunks, len(raw), probe_dir, "cat > sample.none", "transfer_probe"):
+            raise RuntimeError("样本上传失败")
+        link = len(raw) / max(time.time() - t0 - rtt, 1e-3)
+
+        # 压缩后的样本打成一个包一次传完
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            for fmt, data in samples.items():
+                if fmt != 'none':
+                    info = tarfile.TarInfo(f"sample.{fmt}")
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+        if not stream_to_remote(ssh, [buf.getvalue()], buf.tell(), probe_dir, "tar -xf -", "transfer_probe"):
+            raise RuntimeError("样本上传失败")
+
+        results = {}
+        for fmt in formats:
+            for cmd in FORMATS[fmt][1]:
+                exit_status, out, elapsed = _timed_remote(
+                    ssh, f"cd {probe_dir} && {cmd} < sample.{fmt} | wc -c", rtt)
+                # 命令不存在或不支持该格式时, 输出的字节数对不上
+                if exit_status == 0 and out.strip() == str(len(raw)):
+                    results[fmt] = (cmd, len(raw) / elapsed, len(samples[fmt]) / len(raw))
+                    break
+        return link, results
+    finally:
+        exec_cmd(ssh, f"rm -rf {probe_dir}", ignore_error=True)
+
+
+def estimate_install_time(raw_size, size, link, rate, streaming):
+    """估算传输 + 解压耗时: 流式解压时两者同时进行, 取较慢的一方; 否则先传完再解压"""
+    transfer, decompress = size / link, raw_size / rate
+    return max(transfer, decompress) if streaming else transfer + decompress
+
+
+def choose_transfer_format(ssh, src):
+    """探测后返回 (格式, 设备端解压命令), 按估算的总耗时选择"""
+    link, results = probe_transfer_formats(ssh, src, host_formats())
+    if not results:
+        raise RuntimeError("设备上没有可用的解压命令")
+    raw_size = gzip_raw_size(src)
+    # 预上传时安装包先落盘, 解压在之后的步骤中进行
+    streaming = APP_STREAM_EXTRACT and not PRESTAGE_DIR
+    print(f"   链路吞吐 {link / 1048576:.1f} MB/s, 安装包解压后约 {raw_size / 1048576:.1f} MB")
+
+    estimates = {}
+    for fmt, (cmd, rate, ratio) in results.items():
+        size = os.path.getsize(src) if fmt == 'gzip' else raw_size * ratio
+        estimates[fmt] = estimate_install_time(raw_size, size, link, rate, streaming)
+        print(f"   {fmt:<6} 约 {size / 1048576:>7.1f} MB  解压 {rate / 1048576:>7.1f} MB/s  "
+              f"预计 {estimates[fmt]:>6.2f}s  ({cmd})")
+    fmt = min(estimates, key=estimates.get)
+    return fmt, results[fmt][0]
+
+
+def app_transfer_format(ssh):
+    """
+    选择应用安装包的传输格式, 返回 (格式, 解压命令)
+    同一次运行只探测一次; 探测要测设备的解压速度, 应在设备空闲时 (第一个步骤之前) 调用
+    探测失败时使用原始的 gzip 安装包
+    """
+    global _transfer_format
+    with _transfer_format_lock:
+        if _transfer_format is None:
+            src = find_app_package()
+            fmt = APP_TRANSFER_FORMAT if APP_TRANSFER_FORMAT != 'auto' else 'gzip'
+            # gzip / none 未经探测时由 tar 自己处理 (tar -xzf / -xf)
+            decompress = FORMATS[fmt][1][0] if fmt not in ('gzip', 'none') else None
+            if APP_TRANSFER_FORMAT == 'auto' and os.path.getsize(src) >= TRANSCODE_MIN_SIZE:
+                try:
+                    fmt, decompress = choose_transfer_format(ssh, src)
+                except Exception as e:
+                    print(f"   传输格式探测失败, 使用 gzip: {e}")
+            print(f"   安装包传输格式: {fmt}")
+            _transfer_format = (fmt, decompress)
+        return _transfer_format
+
+
+def app_transfer_plan(ssh):
+    """
+    准备选定格式的安装包文件 (转码结果按安装包摘要缓存), 返回 TransferPlan
+    转码在本机进行, 可以在预上传线程中与设备上的步骤并行
+    """
+    global _transfer_plan
+    fmt, decompress = app_transfer_format(ssh)
+    with _transfer_plan_lock:
+        if _transfer_plan is None:
+            path, digest = get_transcode_cache().get(find_app_package(), app_package_digest(), fmt)
+            _transfer_plan = TransferPlan(fmt, path, digest, decompress)
+        return _transfer_plan
+
+
+def transfer_extract_command(plan, source=None, verbose=False):
+    """设备端解压命令: source 为设备上的文件路径, None 表示从 stdin 读取"""
+    flags = '-xvf' if verbose else '-xf'
+    if plan.fmt == 'none' or plan.decompress is None:
+        if plan.fmt == 'gzip':
+            flags = flags.replace('x', 'xz')
+        return f"tar {flags} {source or '-'}"
+    redirect = f" < {source}" if source else ""
+    return f"{plan.decompress}{redirect} | tar {flags} -"
+
+def upload_audio_bundle(ssh):
+    """整个补丁目录打成一个包, 一次传输并在设备端解包到 REMOTE_TEMP"""
+    bundle_path, bundle_digest = get_patch_bundle(LOCAL_AUDIO_PATH)
+    marker = f"{REMOTE_TEMP}/.audio_bundle"
+    stdin, stdout, stderr = ssh.exec_command(f"cat {marker} 2>/dev/null")
+    if stdout.read().decode(errors='replace').strip() == bundle_digest:
+        print("\n   设备上已有相同的补丁文件，跳过上传")
+        return True
+    if not stream_extract(ssh, bundle_path, REMOTE_TEMP, tar_flags='-xf'):
+        return False
+    return exec_cmd(ssh, f"echo {bundle_digest} > {marker}")
 
 def step_1_usb_audio(ssh):
     """
@@ -162,12 +1240,8 @@ def step_1_usb_audio(ssh):
             return False
 
     with LoadingSpinner(f" 上传音频补丁文件..."):
-    # 使用 SCP 遍历上传目录下的所有文件
-        with SCPClient(ssh.get_transport()) as scp:
-            for filename in os.listdir(LOCAL_AUDIO_PATH):
-                full_path = os.path.join(LOCAL_AUDIO_PATH, filename)
-                if os.path.isfile(full_path):
-                    scp.put(full_path, remote_path=REMOTE_TEMP)
+        if not upload_audio_bundle(ssh):
+            return False
 
     # 执行文档中的命令序列
         commands = [
@@ -188,59 +1262,109 @@ def step_1_usb_audio(ssh):
             "addgroup audio || true"
         ]
         
-        for cmd in commands:
-            if not exec_cmd(ssh, cmd):
-                return False
+        # 整个命令序列通过一个 SSH 通道执行
+        ok, _ = exec_batch(ssh, commands)
+        if not ok:
+            return False
             
     print("   USB 音频补丁安装成功")
 
+    # 重启由 DeviceProvisioner 统一发送 (见 PIPELINE_STEPS)
     print("WARNING:重启设备以生效配置")
-    # 发送 reboot 命令，ignore_error=True 防止因连接立即断开而报错
-    exec_cmd(ssh, "reboot", ignore_error=True)
     return True
 
+def _app_dir_name():
+    """安装包解压后的目录名 (去除 .tar.gz)"""
+    pkg_name = os.path.basename(find_app_package())
+    return pkg_name[:-7] if pkg_name.endswith('.tar.gz') else pkg_name
+
+
+def _prestage_path(plan):
+    return f"{PRESTAGE_DIR}/{_app_dir_name()}{FORMATS[plan.fmt][0]}"
+
+
+def prestage_app_package(ssh):
+    """把应用安装包提前上传到 PRESTAGE_DIR (重启后仍在), 与其他步骤并行执行"""
+    plan = app_transfer_plan(ssh)
+    remote_path = _prestage_path(plan)
+    # 只保留当前版本, 删除之前预上传的其他安装包
+    name = os.path.basename(remote_path)
+    # 重启后根文件系统可能是只读挂载, 与步骤 2 一样先重新挂载为可写 (已可写时 mount 失败也无妨)
+    if not exec_cmd(ssh, f"mount -o remount,rw / 2>/dev/null; mkdir -p {PRESTAGE_DIR} && cd {PRESTAGE_DIR} && "
+                         f"for f in *; do [ \"$f\" = '{name}' ] || rm -f \"$f\"; done"):
+        return False
+    upload_if_changed(ssh, [(plan.path, remote_path)])
+    return True
+
+
+def prestaged_app_package(ssh, plan):
+    """预上传的安装包存在且摘要一致时返回其路径, 否则返回 None"""
+    if not PRESTAGE_DIR:
+        return None
+    remote_path = _prestage_path(plan)
+    if remote_digests(ssh, [remote_path]).get(remote_path) != plan.digest:
+        return None
+    return remote_path
+
 def step_2_install_app(ssh):
     """
     步骤 4.2.3: 应用安装
     """
-    local_pkg = find_app_package()
-    pkg_name = os.path.basename(local_pkg)
+    pkg_name = os.path.basename(find_app_package())
     print(f"\n[2/4] 安装应用: {pkg_name} ")
-    
-    remote_file_path = f"{REMOTE_TEMP}/{pkg_name}"
+    dir_name = _app_dir_name()
+    # 传输格式 (gzip 原包或转码后的文件)
+    plan = app_transfer_plan(ssh)
 
-    with LoadingSpinner(f" 正在上传应用安装包..."):
-        try:
-            with SCPClient(ssh.get_transport()) as scp:
-                scp.put(local_pkg, remote_file_path)
-        except Exception as e:
-            print(f"上传过程发生异常: {e}")
-            return False
+    staged = prestaged_app_package(ssh, plan)
+    if staged:
+        # 安装包已在前面的步骤期间上传并校验过
+        print("\n   使用预先上传的安装包")
+        commands = [f"cd {REMOTE_TEMP} && {transfer_extract_command(plan, staged)}"]
+    elif APP_STREAM_EXTRACT:
+        # 边上传边解压, 不在 /dev/shm 中暂存安装包
+        with LoadingSpinner(" 正在上传并解压应用安装包..."):
+            try:
+                if not stream_extract(ssh, plan.path, REMOTE_TEMP, sink=transfer_extract_command(plan)):
+                    print(f"错误: {pkg_name} 上传解压失败！")
+                    return False
+            except Exception as e:
+                print(f"上传过程发生异常: {e}")
+                return False
+        commands = []
+    else:
+        remote_name = dir_name + FORMATS[plan.fmt][0]
+        remote_file_path = f"{REMOTE_TEMP}/{remote_name}"
 
-    # ================= 验证上传是否成功 =================
-    with LoadingSpinner(f" 正在验证上传结果..."):
-    # 使用 ls -l 查看文件是否存在，exec_cmd 如果返回 False 说明文件没找到
-        if not exec_cmd(ssh, f"ls -l {remote_file_path}"):
-            print(f"错误: 远程文件验证失败，{pkg_name} 未成功上传！")
-            return False
-    # =========================================================
-    with LoadingSpinner(f" 执行应用安装脚本..."):
+        with LoadingSpinner(" 正在上传应用安装包..."):
+            try:
+                uploaded, _ = upload_if_changed(ssh, [(plan.path, remote_file_path)])
+                if not uploaded:
+                    print("\n   设备上已有相同的安装包，跳过上传")
+            except Exception as e:
+                print(f"上传过程发生异常: {e}")
+                return False
 
-        # 处理解压后的目录名 (去除 .tar.gz)
-        if pkg_name.endswith('.tar.gz'):
-            dir_name = pkg_name[:-7]
-        else:
-            dir_name = pkg_name
+        # ================= 验证上传是否成功 =================
+        with LoadingSpinner(" 正在验证上传结果..."):
+        # 使用 ls -l 查看文件是否存在，exec_cmd 如果返回 False 说明文件没找到
+            if not exec_cmd(ssh, f"ls -l {remote_file_path}"):
+                print(f"错误: 远程文件验证失败，{pkg_name} 未成功上传！")
+                return False
+        # =========================================================
+        commands = [f"cd {REMOTE_TEMP} && {transfer_extract_command(plan, remote_name, verbose=True)}"] # 解压
 
-        commands = [
-            f"cd {REMOTE_TEMP} && tar -xzvf {pkg_name}", # 解压
+    with LoadingSpinner(f" 执行应用安装脚本..."):
+        commands += [
             f"cd {REMOTE_TEMP}/{dir_name} && chmod +x ./install.sh",
             f"cd {REMOTE_TEMP}/{dir_name} && ./install.sh" # 执行安装脚本
         ]
+        if staged:
+            commands.append(f"rm -f {staged}")
         
-        for cmd in commands:
-            if not run_cmd_verbose(ssh, cmd):
-                return False
+        ok, _ = exec_batch(ssh, commands, verbose=True)
+        if not ok:
+            return False
 
     print("WARNING:重启设备以生效配置")           
     return True
@@ -257,33 +1381,463 @@ def step_3_boot_logo(ssh):
             "dd if=/recovery/bootlogo.jpg of=/dev/mmcblk0p4 bs=1024"
         ]
     
-    for cmd in commands:
-        if not exec_cmd(ssh, cmd):
-            return False
+    ok, _ = exec_batch(ssh, commands)
+    if not ok:
+        return False
             
     print(f"开机画面设置成功 \nWARNING:还需要在Uboot设置参数")
     return True
 
-def wait_for_device_online(timeout=300):
-    """等待设备上线 (用于烧录完后自动衔接)"""
-    with LoadingSpinner(f" 等待设备 {DEVICE_IP} 上线...", delay=0.5):
-        start = time.time()
-        while time.time() - start < timeout:
-            response = os.system(f"ping -n 1 -w 1000 {DEVICE_IP} > nul")
-            if response == 0:
-                #print("设备已上线")
-                time.sleep(5) # 等待 SSH 服务启动
-                return True
-            time.sleep(2)
-    print("等待超时，设备未上线")
+# ================= 黄金镜像 =================
+def _golden_object(digest, suffix):
+    return os.path.join(GOLDEN_DIR, 'objects', digest + suffix)
+
+
+def load_golden_manifest():
+    try:
+        with open(os.path.join(GOLDEN_DIR, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _capture_partition(ssh, device):
+    """按块读取设备分区, 每块压缩后按摘要存储, 返回分区清单"""
+    blocks = []
+    whole = hashlib.new(DIGEST_ALGO)
+    pending = bytearray()
+    size = 0
+
+    def store(block):
+        digest = hashlib.new(DIGEST_ALGO, block).hexdigest()
+        path = _golden_object(digest, '.gz')
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(gzip.compress(block, compresslevel=6))
+            os.replace(path + '.tmp', path)
+        blocks.append(digest)
+
+    def on_data(data):
+        nonlocal size
+        size += len(data)
+        whole.update(data)
+        pending.extend(data)
+        while len(pending) >= GOLDEN_BLOCK_SIZE:
+            store(bytes(pending[:GOLDEN_BLOCK_SIZE]))
+            del pending[:GOLDEN_BLOCK_SIZE]
+
+    err_tail = OutputTail()
+    stdin, stdout, stderr = ssh.exec_command(f"dd if={device} bs=1M")
+    status = drain_channel(stdout.channel, on_data, err_tail.feed)
+    if pending:
+        store(bytes(pending))
+    if status != 0 or size == 0:
+        print(f" 读取分区 {device} 失败: {err_tail.text()}")
+        return None
+    return {'device': device, 'size': size, 'block_size': GOLDEN_BLOCK_SIZE,
+            'digest': whole.hexdigest(), 'blocks': blocks}
+
+
+def _capture_tree(ssh, path, members=None):
+    """
+    把设备上的目录 (或文件) 打包为 tar.gz 按摘要存储, 返回目录清单
+    members: 只打包目录中的这些文件
+    """
+    path = path.rstrip('/')
+    # 目录以自身为根打包, 文件以所在目录为根打包
+    if members:
+        base, member = path, " ".join(shlex.quote(m) for m in members)
+    elif run_remote(ssh, f"[ -d {path} ]")[0] == 0:
+        base, member = path, '.'
+    else:
+        base, member = posixpath.split(path)
+    tmp = os.path.join(GOLDEN_DIR, 'objects', '.capture.tmp')
+    h = hashlib.new(DIGEST_ALGO)
+    err_tail = OutputTail()
+    with open(tmp, 'wb') as f:
+        def on_data(data):
+            f.write(data)
+            h.update(data)
+        stdin, stdout, stderr = ssh.exec_command(f"cd {base} && tar -czf - {member}")
+        status = drain_channel(stdout.channel, on_data, err_tail.feed)
+    if status != 0:
+        os.remove(tmp)
+        print(f" 打包 {path} 失败: {err_tail.text()}")
+        return None
+    digest = h.hexdigest()
+    os.replace(tmp, _golden_object(digest, '.tar.gz'))
+    tree = {'path': path, 'base': base, 'digest': digest, 'size': os.path.getsize(_golden_object(digest, '.tar.gz'))}
+    if members:
+        tree['members'] = list(members)
+    return tree
+
+
+def audio_tool_names():
+    """补丁包中 alsa-utils-<版本>/bin 下的文件名, 即步骤 1 复制到 GOLDEN_TOOLS_DIR 的文件"""
+    bin_dir = f"alsa-utils-{ALSA_VERSION}/bin"
+    with tarfile.open(os.path.join(LOCAL_AUDIO_PATH, 'alsa-lib_utils.tar.gz')) as tar:
+        return sorted(posixpath.basename(m.name) for m in tar.getmembers()
+                      if not m.isdir() and posixpath.dirname(posixpath.normpath(m.name)) == bin_dir)
+
+
+def _remove_unused_golden_objects(manifest):
+    used = {p + '.gz' for part in manifest['partitions'] for p in part['blocks']}
+    used |= {tree['digest'] + '.tar.gz' for tree in manifest['trees']}
+    objects_dir = os.path.join(GOLDEN_DIR, 'objects')
+    for name in os.listdir(objects_dir):
+        if name not in used:
+            os.remove(os.path.join(objects_dir, name))
+
+
+@traced("golden_capture")
+def capture_golden_image(ssh, host=DEVICE_IP):
+    """
+    从已完整部署的参考设备采集黄金镜像: GOLDEN_PARTITIONS 按块压缩存储, GOLDEN_TREES 存为 tar.gz
+    清单同时记录当前本地补丁包/安装包的摘要, 本地文件更新后镜像即视为过期
+    """
+    os.makedirs(os.path.join(GOLDEN_DIR, 'objects'), exist_ok=True)
+    manifest = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source': host,
+        'artifacts': {name: func() for name, func in STEP_ARTIFACTS.items() if name in BASE_STEP_NAMES},
+        'partitions': [],
+        'trees': [],
+    }
+    with LoadingSpinner(f" 从 {host} 采集黄金镜像..."):
+        for device in GOLDEN_PARTITIONS:
+            part = _capture_partition(ssh, device)
+            if part is None:
+                return False
+            manifest['partitions'].append(part)
+        for path in GOLDEN_TREES:
+            if run_remote(ssh, f"[ -e {path} ]")[0] != 0:
+                print(f"\n   设备上不存在 {path}，跳过")
+                continue
+            tree = _capture_tree(ssh, path)
+            if tree is None:
+                return False
+            manifest['trees'].append(tree)
+        tools = audio_tool_names()
+        if tools:
+            tree = _capture_tree(ssh, GOLDEN_TOOLS_DIR, tools)
+            if tree is None:
+                return False
+            manifest['trees'].append(tree)
+
+    path = os.path.join(GOLDEN_DIR, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    _remove_unused_golden_objects(manifest)
+
+    for part in manifest['partitions']:
+        stored = sum(os.path.getsize(_golden_object(d, '.gz')) for d in set(part['blocks']))
+        print(f"  分区 {part['device']:<24} {part['size'] / 1048576:>8.1f} MB -> {stored / 1048576:.1f} MB")
+    for tree in manifest['trees']:
+        members = f", {len(tree['members'])} 个文件" if 'members' in tree else ""
+        print(f"  目录 {tree['path']:<24} {tree['size'] / 1048576:>8.1f} MB (tar.gz{members})")
+    print(f" 黄金镜像已保存: {GOLDEN_DIR}")
+    return True
+
+
+def golden_image_status():
+    """返回 (清单, 不可用原因); 镜像可以直接使用时原因为 None"""
+    manifest = load_golden_manifest()
+    if manifest is None:
+        return None, "尚未采集黄金镜像"
+    for name, digests in manifest['artifacts'].items():
+        if STEP_ARTIFACTS[name]() != digests:
+            return manifest, f"{name} 的本地文件已更新"
+    for part in manifest['partitions']:
+        if not all(os.path.exists(_golden_object(d, '.gz')) for d in part['blocks']):
+            return manifest, f"分区 {part['device']} 的数据不完整"
+    for tree in manifest['trees']:
+        if not os.path.exists(_golden_object(tree['digest'], '.tar.gz')):
+            return manifest, f"目录 {tree['path']} 的数据不完整"
+    return manifest, None
+
+
+def write_partition(ssh, part):
+    """把按块存储的分区数据流式写入设备分区, 写入后回读校验"""
+    paths = [_golden_object(d, '.gz') for d in part['blocks']]
+
+    def read_blocks():
+        # 每块是一个独立的 gzip 成员, 直接拼接即是一个完整的 gzip 流
+        for path in paths:
+            with open(path, 'rb') as f:
+                yield f.read()
+
+    device = part['device']
+    total = sum(os.path.getsize(p) for p in paths)
+    if not stream_to_remote(ssh, read_blocks(), total, REMOTE_TEMP,
+                            f"gzip -dc | dd of={device} bs=1M conv=fsync 2>/dev/null",
+                            "golden_partition", device=device):
+        return False
+
+    status, out_tail, _ = run_remote(ssh, f"head -c {part['size']} {device} | {DIGEST_ALGO}sum")
+    words = out_tail.text().split()
+    if status != 0 or not words or words[0].lower() != part['digest']:
+        print(f" 分区 {device} 回读校验失败")
+        return False
+    return True
+
+
+def step_golden_image(ssh):
+    """
+    黄金镜像模式: 目录树和分区各自一次流式写入 (设备端校验), 代替步骤 1~3
+    """
+    manifest = load_golden_manifest()
+    with LoadingSpinner("[1/2] 写入黄金镜像..."):
+        bases = " ".join(sorted({tree['base'] for tree in manifest['trees']}))
+        ok, _ = exec_batch(ssh, ["mount -o remount,rw /", f"mkdir -p {bases}"])
+        if not ok:
+            return False
+
+        for tree in manifest['trees']:
+            if not stream_extract(ssh, _golden_object(tree['digest'], '.tar.gz'), REMOTE_TEMP,
+                                  tar_flags=f"-C {tree['base']} -xzf"):
+                print(f" 写入 {tree['path']} 失败")
+                return False
+
+        for part in manifest['partitions']:
+            if not write_partition(ssh, part):
+                return False
+
+    if GOLDEN_RUN_FIP:
+        with LoadingSpinner("[2/2] 更新内核..."):
+            if not upload_audio_bundle(ssh):
+                return False
+            ok, _ = exec_batch(ssh, [f"cd {REMOTE_TEMP} && chmod +x ./fip.bin.sh",
+                                     f"cd {REMOTE_TEMP} && ./fip.bin.sh"])
+            if not ok:
+                return False
+
+    ok, _ = exec_batch(ssh, GOLDEN_POST_COMMANDS)
+    if not ok:
+        return False
+    print("黄金镜像写入成功 \nWARNING:还需要在Uboot设置参数")
+    return True
+
+
+def probe_ssh(host=DEVICE_IP, port=None, timeout=1.0):
+    """
+    探测 sshd 是否可用: TCP 连接成功并收到 "SSH-" 开头的 banner
+    比 ping 更准确 (网络通但 sshd 未启动时返回 False), 且不依赖系统命令
+    """
+    try:
+        with socket.create_connection((host, port or SSH_PORT), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            banner = b''
+            while b'\n' not in banner and len(banner) < 256:
+                data = sock.recv(256)
+                if not data:
+                    break
+                banner += data
+            return banner.startswith(b'SSH-')
+    except OSError:
+        return False
+
+
+def _poll(check, timeout):
+    """按退避间隔反复调用 check(), 返回 True 或超时返回 False"""
+    deadline = time.time() + timeout
+    interval = PROBE_INTERVAL_MIN
+    while True:
+        if check():
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, PROBE_INTERVAL_MAX)
+
+
+@traced("wait_for_device_online")
+def wait_for_device_online(timeout=300, host=DEVICE_IP):
+    """等待设备上线 (sshd 可接受连接时立即返回)"""
+    with LoadingSpinner(f" 等待设备 {host} 上线...", delay=0.5):
+        if _poll(lambda: probe_ssh(host), timeout):
+            return True
+    print(f"[{host}] 等待超时，设备未上线")
     return False
 
-def step_4_uboot_settings(serial_port):
-    """通过串口修改 U-Boot 环境变量"""
+
+@traced("wait_for_device_offline")
+def wait_for_device_offline(timeout=REBOOT_DOWN_TIMEOUT, host=DEVICE_IP):
+    """发送 reboot 后等待设备真正下线, 避免重连到即将关闭的 sshd"""
+    with LoadingSpinner(f" 等待设备 {host} 重启...", delay=0.5):
+        if _poll(lambda: not probe_ssh(host), timeout):
+            return True
+    print(f"[{host}] 未检测到设备下线，继续等待上线")
+    return False
+
+def wait_boot_complete(console, profiler, host=DEVICE_IP, timeout=BOOT_PROFILE_TIMEOUT):
+    """
+    reset 之后继续读取串口 (数据照常写入日志), 直到出现登录提示, 再等待 SSH 可连接
+    串口上的 sshd 启动信息早于端口真正可用, 启动完成以主机侧探测到 SSH 为准 (记为 ssh 阶段)
+    """
+    deadline = time.time() + timeout
+    with LoadingSpinner(" 等待设备启动完成 (记录启动耗时)...", delay=0.5):
+        try:
+            console.expect(BOOT_DONE_PATTERN, timeout)
+        except ExpectTimeout:
+            print(f"\n {timeout}s 内串口未出现登录提示，不记录本次启动耗时")
+            return False
+        if _poll(lambda: probe_ssh(host), max(deadline - time.time(), 0)):
+            profiler.mark("ssh")
+    return True
+
+# ================= U-Boot 环境变量 (Linux 下修改) =================
+def _parse_printenv(text):
+    """fw_printenv / printenv 输出 -> {变量名: 值}"""
+    return dict(line.split("=", 1) for line in text.splitlines() if "=" in line)
+
+
+def uboot_env_access_test():
+    """shell 条件: 成立表示能在系统中修改 U-Boot 环境变量"""
+    if UBOOT_ENV_LOCATIONS:
+        return "true"
+    return f"command -v fw_setenv && fw_printenv || [ -f {UBOOT_ENV_CONFIG} ]"
+
+
+def _read_remote(ssh, command):
+    """执行命令, 返回 (退出码, stdout 全部字节, stderr 尾部)"""
+    out = bytearray()
+    err_tail = OutputTail()
+    stdin, stdout, stderr = ssh.exec_command(command)
+    status = drain_channel(stdout.channel, out.extend, err_tail.feed)
+    return status, bytes(out), err_tail
+
+
+def _dd_blocks(location):
+    """dd 的块大小和偏移/块数: 取偏移与大小的公约数, 避免 bs=1 逐字节读写"""
+    bs = math.gcd(location.offset, location.size)
+    return bs, location.offset // bs, location.size // bs
+
+
+def _force_ro_path(device):
+    """eMMC boot 分区默认只读, 写入前需要关闭 force_ro (与 fw_setenv 相同)"""
+    m = re.match(r"/dev/(mmcblk\d+boot\d+)$", device)
+    return f"/sys/block/{m.group(1)}/force_ro" if m else None
+
+
+def uboot_env_locations(ssh):
+    """环境变量区位置: UBOOT_ENV_LOCATIONS 或设备上的 fw_env.config"""
+    if UBOOT_ENV_LOCATIONS:
+        return [EnvLocation(*loc) for loc in UBOOT_ENV_LOCATIONS]
+    status, out_tail, _ = run_remote(ssh, f"cat {UBOOT_ENV_CONFIG}")
+    if status != 0:
+        raise UBootEnvError(f"设备上没有 {UBOOT_ENV_CONFIG}, 请配置 UBOOT_ENV_LOCATIONS")
+    locations = parse_fw_env_config(out_tail.text())
+    for loc in locations:
+        if loc.device.startswith('/dev/mtd'):
+            raise UBootEnvError(f"{loc.device} 是 MTD 设备 (写入前需要擦除), 请在设备上安装 fw_setenv")
+        if loc.offset < 0 or loc.size <= 0:
+            raise UBootEnvError(f"不支持的环境变量区位置: {loc}")
+    return locations
+
+
+def read_uboot_env_copies(ssh, locations):
+    """读取并解析每个环境变量区, 返回 [EnvCopy, ...]"""
+    copies = []
+    for loc in locations:
+        bs, skip, count = _dd_blocks(loc)
+        status, data, err_tail = _read_remote(ssh, f"dd if={loc.device} bs={bs} skip={skip} count={count} 2>/dev/null")
+        if status != 0 or len(data) != loc.size:
+            raise UBootEnvError(f"读取 {loc.device} 失败: {err_tail.text() or f'{len(data)} 字节'}")
+        copies.append(parse_env(data, redundant=len(locations) == 2))
+    return copies
+
+
+def write_uboot_env_copy(ssh, location, data):
+    """把一个环境变量区写入设备 (流式写入, 设备端校验摘要)"""
+    bs, seek, _ = _dd_blocks(location)
+    force_ro = _force_ro_path(location.device)
+    if force_ro:
+        exec_cmd(ssh, f"echo 0 > {force_ro}")
+    try:
+        return stream_to_remote(ssh, [data], len(data), REMOTE_TEMP,
+                                f"dd of={location.device} bs={bs} seek={seek} conv=notrunc,fsync 2>/dev/null",
+                                "uboot_env_write", device=location.device)
+    finally:
+        if force_ro:
+            exec_cmd(ssh, f"echo 1 > {force_ro}", ignore_error=True)
+
+
+def set_uboot_env_direct(ssh, env):
+    """
+    不依赖 fw_setenv, 直接读写环境变量区: 读取 -> 在生效的副本上修改 -> 写入 -> 回读
+    冗余环境变量写到另一份并递增 flags, 写入中途断电时 U-Boot 仍使用旧副本
+    返回回读到的当前环境变量
+    """
+    locations = uboot_env_locations(ssh)
+    copies = read_uboot_env_copies(ssh, locations)
+    target, data = update_env(copies, locations[0].size, env)
+    if not write_uboot_env_copy(ssh, locations[target], data):
+        raise UBootEnvError(f"写入 {locations[target].device} 失败")
+    copies = read_uboot_env_copies(ssh, locations)
+    if active_copy(copies) != target:
+        raise UBootEnvError("回读校验失败: 新写入的环境变量区 CRC 错误或未生效")
+    return copies[target].vars
+
+
+def set_uboot_env_fw(ssh, env):
+    """通过 fw_setenv 一次写入所有变量 (-s 脚本), 旧版本不支持 -s 时逐个设置; 返回 fw_printenv 回读结果"""
+    script = f"{REMOTE_TEMP}/.adp_fw_env"
+    lines = " ".join(shlex.quote(f"{name} {value}") for name, value in env.items())
+    if run_remote(ssh, f"printf '%s\\n' {lines} > {script} && fw_setenv -s {script}; "
+                       f"rc=$?; rm -f {script}; exit $rc")[0] != 0:
+        ok, _ = exec_batch(ssh, [f"fw_setenv {name} {shlex.quote(str(value))}" for name, value in env.items()])
+        if not ok:
+            raise UBootEnvError("fw_setenv 执行失败")
+    status, out_tail, err_tail = run_remote(ssh, "fw_printenv")
+    if status != 0:
+        raise UBootEnvError(f"fw_printenv 执行失败: {err_tail.text()}")
+    return _parse_printenv(out_tail.text())
+
+
+def set_uboot_env_linux(ssh, env):
+    """
+    在系统中修改 U-Boot 环境变量并回读校验, 下次启动生效
+    设备上有可用的 fw_setenv 时直接调用, 否则按环境变量区位置自行读写 (含 CRC 和冗余副本)
+    """
+    if not UBOOT_ENV_LOCATIONS and run_remote(ssh, "command -v fw_setenv && fw_printenv >/dev/null")[0] == 0:
+        current = set_uboot_env_fw(ssh, env)
+    else:
+        current = set_uboot_env_direct(ssh, env)
+    wrong = [name for name, value in env.items() if current.get(name) != str(value)]
+    if wrong:
+        raise UBootEnvError(f"回读不一致: {', '.join(wrong)}")
+
+
+def step_uboot_env(ssh):
+    """
+    [4/4] 通过 SSH 修改 U-Boot 环境变量, 不需要串口和重启进入 U-Boot
+    与其他步骤的重启合并, 下次启动时生效
+    """
+    print(f"\n[4/4] 修改 U-Boot 参数: {', '.join(UBOOT_ENV)}")
+    try:
+        with tracer.span("uboot_setenv", count=len(UBOOT_ENV)):
+            set_uboot_env_linux(ssh, UBOOT_ENV)
+    except UBootEnvError as e:
+        print(f" U-Boot 参数修改失败: {e}")
+        return False
+    print("   U-Boot 参数已写入并回读确认，下次启动生效")
+    return True
+
+
+def step_4_uboot_settings(serial_port, env=UBOOT_ENV, host=DEVICE_IP, board=None, ssh=None):
+    """
+    通过串口修改 U-Boot 环境变量
+    ssh 为设备当前的 SSH 连接, 通过它重启设备 (None 表示设备已在重启, 例如手动上电)
+    串口输出记录到 SERIAL_LOG_DIR (board 为日志文件名, 默认用设备地址);
+    BOOT_PROFILE_WAIT 时等待 reset 后的启动完成, 各阶段耗时追加到 BOOT_PROFILE_FILE
+    """
 
     input("修改设备信息后，按回车继续...")
-    print("\n正在重启设备...")
-    exec_cmd(ssh, "reboot", ignore_error=True)
+    if ssh is not None:
+        print("\n正在重启设备...")
+        exec_cmd(ssh, "reboot", ignore_error=True)
     
     with LoadingSpinner(" 连接串口..."):
         try:
@@ -309,128 +1863,993 @@ def step_4_uboot_settings(serial_port):
             return False
 
 
+    board = board or host
+    profiler = BootProfiler()
+    serial_log = None
+    if SERIAL_LOG_DIR:
+        serial_log = SerialLog(SERIAL_LOG_DIR, board, on_line=profiler.feed_line)
+
     with LoadingSpinner(f"[4/4] 通过串口{serial_port}修改 U-Boot 参数..."):
         
         try:
             print(f"  \n串口已打开，正在等待设备重启...")
             
-            start_time = time.time()
-            interrupted = False
-            
-            # 1. 拦截阶段
-            while time.time() - start_time < 60: 
-                ser.write(b'\n') # 发送回车
-                
-                if ser.in_waiting:
-                    try:
-                        #raw_data = ser.read(ser.in_waiting)
-                        output = ser.read(ser.in_waiting).decode('utf-8', errors='ignore')
-                        output_lower = output.lower()
-                        if "stop autoboot" in output_lower:
-                            ser.write(b'\n\n\n\n\n\n')
-                            time.sleep(0.05)
-
-                        # 如果检测到 U-Boot 提示符
-                        if "#" in output:
-                            ser.write(b'\n\n\n\n')
-                            time.sleep(0.5)
-                            ser.read_all()
-                            interrupted = True
-                            print("\n\n进入 U-Boot 命令行")
-                            break
-                    except:
-                        pass
-                
-                # 打印一个小点表示正在运行
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                time.sleep(0.5)
-                
+            # 1. 拦截阶段: 流式匹配倒计时/提示符, 数据到达即响应
+            console = SerialExpect(ser, on_data=serial_log.feed if serial_log else None)
+            try:
+                with tracer.span("uboot_intercept"):
+                    interrupted = intercept_uboot(console, timeout=60)
+                print("\n\n进入 U-Boot 命令行")
+            except ExpectTimeout:
+                interrupted = False
+
             if not interrupted:
                 SERIAL_PORT_CONNECT_TIMEOUT = False
                 print(f"\n 失败: 超时未检测到 U-Boot 提示符。")
                 print("   可能原因: 串口线接错了(TX/RX接反)，或者设备启动太快已进入系统。")
-                ser.close()
                 return False
 
-            # 2. 命令
-            cmds = [
-                'setenv bootcmd "setvobg 0 0; run run_logo; run update_script;"',
-                'saveenv',
-                'reset'
-            ]
-            
-            for cmd in cmds:
-                ser.write((cmd + "\n").encode('utf-8'))
-                time.sleep(1) # 等待写入
-                
-                # 简单的回显清理
-                if ser.in_waiting:
-                    ser.read(ser.in_waiting)
+            # 2. 命令: 每条命令等待回显和提示符, 检查错误后再发下一条
+            try:
+                with tracer.span("uboot_setenv", count=len(env)):
+                    set_uboot_env(console, env)
+                profiler.mark("reset")
+                uboot_command(console, 'reset', wait_prompt=False)
+            except (UBootError, ExpectTimeout) as e:
+                print(f"\n U-Boot 命令执行失败: {e}")
+                return False
             
             print(" U-Boot 参数修改完成，设备正在重启。")
-            ser.close()
+            if BOOT_PROFILE_WAIT and serial_log:
+                with tracer.span("boot_profile"):
+                    wait_boot_complete(console, profiler, host)
             return True
 
         except Exception as e:
             print(f"\n未知错误: {e}")
+            return False
+
+        finally:
             if ser.is_open:
                 ser.close()
+            if serial_log:
+                # 关闭日志时剩余的行都已交给 profiler
+                serial_log.close()
+                marks = profiler.last_boot()
+                if BOOT_PROFILE_WAIT and marks:
+                    intervals = append_profile(BOOT_PROFILE_FILE, board, marks)
+                    print(f" 启动耗时: {format_intervals(intervals)}")
+
+# ================= U-Boot 烧写 (串口 / TFTP) =================
+def parse_flash_image(item):
+    """'FILE=COMMAND' -> (FILE, COMMAND)"""
+    path, sep, command = item.partition("=")
+    if not sep or not path or not command:
+        raise ValueError(f"{item} (应为 FILE=COMMAND)")
+    return path, command
+
+
+def local_ip_for(host):
+    """本机访问 host 时使用的源地址 (不发送数据)"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((host, 9))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def _tftp_load(console, data, name):
+    """U-Boot 通过 tftp 把镜像拉到内存并校验"""
+    try:
+        size = uboot_tftp(console, UBOOT_LOAD_ADDR, name, UBOOT_FLASH_TIMEOUT)
+    except ExpectTimeout:
+        # U-Boot 的 tftp 超时后会无限重试, Ctrl+C 回到命令行
+        console.send(b'\x03')
+        raise
+    if size != len(data):
+        raise UBootError(f"tftp 收到 {size} 字节, 应为 {len(data)} 字节")
+    uboot_check_crc32(console, UBOOT_LOAD_ADDR, data, name)
+
+
+def uboot_flash_images(serial_port, images, method="serial", baudrate=SERIAL_LOAD_BAUDRATE,
+                       host=DEVICE_IP, reset=True):
+    """
+    在 U-Boot 下烧写镜像, 不需要启动 Linux:
+    拦截 U-Boot 后逐个把镜像传到内存 (method="serial": loady/YMODEM-1K; "tftp": 本机 TFTP 服务),
+    crc32 校验一致后执行烧写命令
+    images: [(本地文件, 烧写命令)], 格式见 UBOOT_FLASH_IMAGES
+    """
+    for path, _ in images:
+        if not os.path.isfile(path):
+            print(f" 找不到镜像文件: {path}")
             return False
 
+    server = None
+    if method == "tftp":
+        try:
+            server_ip = TFTP_SERVER_IP or local_ip_for(host)
+            server = TftpServer({os.path.basename(p): p for p, _ in images}, port=TFTP_PORT).start()
+        except OSError as e:
+            print(f" 无法启动 TFTP 服务 (端口 {TFTP_PORT}): {e}")
+            return False
+    try:
+        ser = serial.Serial(serial_port, BAUDRATE, timeout=0.1)
+    except serial.SerialException as e:
+        print(f"\n 串口错误: 无法打开 {serial_port}")
+        print(f"   原因: {e}")
+        if server:
+            server.stop()
+        return False
+
+    serial_log = None
+    if SERIAL_LOG_DIR:
+        serial_log = SerialLog(SERIAL_LOG_DIR, "flash-" + os.path.basename(serial_port))
+    console = SerialExpect(ser, on_data=serial_log.feed if serial_log else None)
+    try:
+        print(" 请给设备上电或重启，正在等待 U-Boot...")
+        with LoadingSpinner(" 拦截 U-Boot..."):
+            with tracer.span("uboot_intercept"):
+                intercept_uboot(console, timeout=120)
+
+        if server:
+            # 只在内存中设置, 不 saveenv
+            net_env = {"ipaddr": host, "serverip": server_ip,
+                       "tftpblocksize": TFTP_BLKSIZE, "tftpwindowsize": TFTP_WINDOWSIZE}
+            if server.port != 69:
+                net_env["tftpdstp"] = server.port
+            set_uboot_env(console, net_env, save=False)
+
+        for path, command in images:
+            name = os.path.basename(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            start = time.time()
+            with LoadingSpinner(f" {'TFTP' if server else '串口'}传输 {name} ({len(data) / 1048576:.1f}MB)..."):
+                if server:
+                    with tracer.span("uboot_tftp", file=name, bytes=len(data)):
+                        _tftp_load(console, data, name)
+                else:
+                    with tracer.span("serial_loady", file=name, bytes=len(data), baudrate=baudrate):
+                        uboot_load_verified(console, data, UBOOT_LOAD_ADDR, baudrate, name,
+                                            on_progress=lambda n: report_progress(done=n, total=len(data)))
+            elapsed = time.time() - start
+            print(f" {name}: {len(data)} 字节, {elapsed:.1f}s, {len(data) / 1024 / max(elapsed, 1e-6):.1f} KB/s")
+
+            blocks = (len(data) + 511) // 512
+            cmd = command.format(addr=f"0x{UBOOT_LOAD_ADDR:x}", size=f"0x{len(data):x}", blocks=f"0x{blocks:x}")
+            with LoadingSpinner(f" 烧写 {name}: {cmd}"):
+                with tracer.span("uboot_flash", file=name):
+                    uboot_command(console, cmd, UBOOT_FLASH_TIMEOUT)
+
+        if reset:
+            uboot_command(console, 'reset', wait_prompt=False)
+            print(" 烧写完成，设备正在重启。")
+        return True
+
+    except (ExpectTimeout, UBootError, YModemError) as e:
+        print(f"\n U-Boot 烧写失败: {e}")
+        return False
+
+    finally:
+        ser.close()
+        if serial_log:
+            serial_log.close()
+        if server:
+            server.stop()
+
+
+# ================= SSH 会话管理 =================
+class SSHSession:
+    """
+    管理一台设备的 SSH 连接
+    get() 总是返回可用的连接: 连接失效或设备重启后自动等待上线并重连
+    """
+
+    def __init__(self, host=DEVICE_IP):
+        self.host = host
+        self.client = None
+
+    def is_alive(self):
+        transport = self.client.get_transport() if self.client else None
+        return transport is not None and transport.is_active()
+
+    def get(self, timeout=REBOOT_ONLINE_TIMEOUT):
+        """返回可用的 SSHClient, 无法连接时返回 None"""
+        if self.is_alive():
+            return self.client
+        self.close()
+        for _ in range(RECONNECT_RETRIES):
+            if not probe_ssh(self.host) and not wait_for_device_online(timeout=timeout, host=self.host):
+                break
+            self.client = create_ssh_client(self.host)
+            if self.client:
+                return self.client
+        return None
+
+    def reboot(self):
+        """重启设备并等待其下线, 下一次 get() 会自动重连"""
+        if self.is_alive():
+            # ignore_error=True 防止因连接立即断开而报错
+            try:
+                exec_cmd(self.client, "reboot", ignore_error=True)
+            except Exception:
+                pass
+        self.close()
+        wait_for_device_offline(host=self.host)
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+
+
+# ================= 部署记录 (断点续做) =================
+def read_device_identity(ssh):
+    """
+    读取设备标识 (eth0 MAC) 和本次启动的 boot_id
+    boot_id 每次重启都会变化, 用于判断某步骤之后是否已经重启过
+    """
+    stdin, stdout, stderr = ssh.exec_command(
+        "cat /sys/class/net/eth0/address 2>/dev/null || echo unknown; "
+        "cat /proc/sys/kernel/random/boot_id 2>/dev/null || echo unknown")
+    lines = stdout.read().decode(errors='replace').split()
+    mac = lines[0].strip().lower() if lines else 'unknown'
+    boot_id = lines[1].strip() if len(lines) > 1 else 'unknown'
+    return mac, boot_id
+
+
+class DeviceJournal:
+    """
+    单台设备的部署记录, 以设备标识为键保存在 JOURNAL_DIR 下
+    记录每个已完成步骤的耗时、文件摘要和完成时的 boot_id
+    """
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.path = os.path.join(JOURNAL_DIR, device_id.replace(':', '') + '.json')
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {'device_id': device_id, 'steps': {}}
+
+    def save(self):
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        self.data['steps'] = {}
+        self.save()
+
+    def get(self, step):
+        return self.data['steps'].get(step)
+
+    def mark_done(self, step, elapsed, digests, boot_id, host):
+        self.data['host'] = host
+        self.data['steps'][step] = {
+            'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': round(elapsed, 1),
+            'digests': digests,
+            'boot_id': boot_id,
+        }
+        self.save()
+
+    def is_done(self, step, digests):
+        entry = self.get(step)
+        return entry is not None and entry['digests'] == digests
+
+
+# ================= 批量部署 (状态机) =================
+# 流水线定义: (步骤名, 函数, 执行后是否需要重启)
+PIPELINE_STEPS = [
+    ("usb_audio", step_1_usb_audio, True),
+    ("install_app", step_2_install_app, True),
+    ("boot_logo", step_3_boot_logo, False),
+]
+
+# 步骤依赖: 步骤名 -> [(依赖的步骤, 是否需要在依赖步骤之后先重启)]
+STEP_DEPENDS = {
+    # install.sh 在新内核下执行 (保守)
+    "install_app": [("usb_audio", True)],
+    # 只需要 install.sh 解出的 /app/dt/cfg/bootlogo-hg.jpg, 不需要重启
+    "boot_logo": [("install_app", False)],
+    # fip.bin.sh 会重写 U-Boot 所在的分区, 之后再写环境变量 (不需要重启);
+    # 新的 bootcmd 会加载开机画面并运行应用, 放在所有步骤之后, 随最后一次重启生效
+    "uboot_env": [("usb_audio", False), ("install_app", False), ("boot_logo", False), ("golden_image", False)],
+}
+
+# 可以提前在后台执行的准备工作: 步骤名 -> 函数(ssh)
+# 在前面的步骤执行时并行运行, 重启前必须完成; 失败时步骤按原方式执行
+STEP_PRESTAGE = {
+    "install_app": lambda ssh: prestage_app_package(ssh) if PRESTAGE_DIR else True,
+}
+
+# 黄金镜像模式: 一次写入代替步骤 1~3 (镜像过期时仍按上面的步骤执行)
+# 与步骤 1~3 一样需要重启 (fip.bin.sh 更新内核、分区被重写) 才能生效
+GOLDEN_STEPS = [
+    ("golden_image", step_golden_image, True),
+]
+# UBOOT_ENV_METHOD = 'linux' 时追加的步骤: 在系统中修改 U-Boot 环境变量, 随最后一次重启生效
+UBOOT_ENV_STEPS = [
+    ("uboot_env", step_uboot_env, False),
+]
+BASE_STEP_NAMES = [name for name, _, _ in PIPELINE_STEPS]
+
+# 每个步骤依赖的本地文件摘要; 摘要变化时即使已完成也需要重新执行
+STEP_ARTIFACTS = {
+    "usb_audio": lambda: {"bundle": get_patch_bundle(LOCAL_AUDIO_PATH)[1]},
+    "install_app": lambda: {"package": app_package_digest()},
+    "golden_image": lambda: {"manifest": local_digest(os.path.join(GOLDEN_DIR, 'manifest.json'))},
+    "uboot_env": lambda: {"env": hashlib.md5(json.dumps(UBOOT_ENV, sort_keys=True).encode()).hexdigest()},
+}
+
+
+def _downstream_reboots(name, depends):
+    """从该步骤出发的最长依赖链上的重启次数和步骤数, 用于确定优先级 (关键路径优先)"""
+    best = (0, 0)
+    for child, deps in depends.items():
+        for dep, after_reboot in deps:
+            if dep == name:
+                reboots, length = _downstream_reboots(child, depends)
+                best = max(best, (reboots + int(after_reboot), length + 1))
+    return best
+
+
+def schedule_steps(steps, depends=None):
+    """
+    按依赖关系安排步骤顺序和重启位置, 返回与 PIPELINE_STEPS 相同格式的列表
+    - 依赖满足的步骤在同一次启动中连续执行, 只在后续步骤确实需要时才重启
+    - 同时就绪的多个步骤, 先执行关键路径 (后面需要重启次数最多) 上的步骤
+    - 最后一次重启 (让修改生效) 放到所有步骤之后
+    """
+    depends = STEP_DEPENDS if depends is None else depends
+    names = {name for name, _, _ in steps}
+    remaining = list(steps)
+    done = set()
+    # 本次启动中执行过、需要重启才生效的步骤
+    dirty = set()
+    plan = []
+    while remaining:
+        ready = [s for s in remaining
+                 if all(dep in done and not (after_reboot and dep in dirty)
+                        for dep, after_reboot in depends.get(s[0], []) if dep in names)]
+        if not ready:
+            if not dirty:
+                raise ValueError(f"步骤依赖无法满足: {[s[0] for s in remaining]}")
+            plan[-1][2] = True
+            dirty.clear()
+            continue
+        step = max(ready, key=lambda s: _downstream_reboots(s[0], depends))
+        remaining.remove(step)
+        plan.append([step[0], step[1], False])
+        done.add(step[0])
+        if step[2]:
+            dirty.add(step[0])
+    if dirty:
+        plan[-1][2] = True
+    return [tuple(s) for s in plan]
+
+
+# ================= 远程状态检查 =================
+def step_marker(name):
+    """步骤完成标记的内容: 该步骤使用的本地文件摘要"""
+    artifacts = STEP_ARTIFACTS.get(name)
+    digests = artifacts() if artifacts else {}
+    return ",".join(f"{k}={v}" for k, v in sorted(digests.items()))
+
+
+def _marker_test(name):
+    return f"[ \"$(cat {DEVICE_STATE_DIR}/{name} 2>/dev/null)\" = '{step_marker(name)}' ]"
+
+
+def mark_step_on_device(ssh, name):
+    """
+    步骤成功后在设备上写入完成标记, 换一台电脑部署也能识别
+    重启后根文件系统可能是只读的, 先重新挂载为可写; 仍写不进去时返回 False (本机部署记录不受影响)
+    """
+    if name not in STEP_ARTIFACTS:
+        return True
+    return exec_cmd(ssh, f"mount -o remount,rw / 2>/dev/null; mkdir -p {DEVICE_STATE_DIR} && "
+                         f"echo '{step_marker(name)}' > {DEVICE_STATE_DIR}/{name}")
+
+
+# 每个步骤的远程检查: 返回 shell 条件, 成立表示设备已是该步骤的目标状态
+STEP_PROBES = {
+    # ALSA 工具和库已是目标版本, 且内核更新完成后写入的标记与当前补丁包一致
+    "usb_audio": lambda: (f"/usr/bin/aplay --version 2>/dev/null | grep -q 'version {ALSA_VERSION}'"
+                          f" && [ -d /root/hi626/lib-36a/_install/alsa-lib-{ALSA_VERSION} ]"
+                          f" && {_marker_test('usb_audio')}"),
+    # /app/dt 存在且由当前版本的安装包安装
+    "install_app": lambda: f"[ -d /app/dt ] && {_marker_test('install_app')}",
+    # 开机画面分区开头与 bootlogo 文件内容一致
+    "boot_logo": lambda: ("f=/app/dt/cfg/bootlogo-hg.jpg; [ -f $f ] && "
+                          f"[ \"$(head -c $(wc -c < $f) /dev/mmcblk0p4 | {DIGEST_ALGO}sum)\" = \"$({DIGEST_ALGO}sum < $f)\" ]"),
+    "golden_image": lambda: _marker_test('golden_image'),
+    # 有 fw_printenv 时直接比较变量值, 否则看完成标记
+    "uboot_env": lambda: ("if command -v fw_printenv; then "
+                          + " && ".join(f"[ \"$(fw_printenv -n {name} 2>/dev/null)\" = {shlex.quote(str(value))} ]"
+                                        for name, value in UBOOT_ENV.items())
+                          + f"; else {_marker_test('uboot_env')}; fi"),
+}
+
+
+def probe_device(ssh, names, uboot_env=None):
+    """
+    一次往返执行多个步骤的远程检查, 返回 {步骤名: 是否已是目标状态}
+    指定 uboot_env 时同时用 fw_printenv 检查 U-Boot 环境变量, 结果键为 'uboot_env'
+    包含 uboot_env 步骤时同时检查能否在系统中修改环境变量, 结果键为 'uboot_env_access'
+    """
+    probes = [name for name in names if name in STEP_PROBES]
+    if "uboot_env" in names:
+        probes.append("uboot_env_access")
+    tests = dict(STEP_PROBES, uboot_env_access=uboot_env_access_test)
+    commands = [f"( {tests[name]()} ) >/dev/null 2>&1 && echo OK; true" for name in probes]
+    if uboot_env:
+        commands.append("fw_printenv 2>/dev/null; true")
+    if not commands:
+        return {}
+
+    ok, results = exec_batch(ssh, commands)
+    found = {}
+    for name, result in zip(probes, results):
+        found[name] = result.stdout.strip() == "OK"
+    if uboot_env and len(results) > len(probes):
+        current = _parse_printenv(results[-1].stdout)
+        found['uboot_env'] = all(current.get(k) == str(v) for k, v in uboot_env.items())
+    return found
+
+
+def select_pipeline(use_golden=False):
+    """
+    选择部署步骤: 黄金镜像可用时使用 GOLDEN_STEPS, 否则逐步执行
+    UBOOT_ENV_METHOD = 'linux' 时再加上在系统中修改 U-Boot 环境变量的步骤
+    """
+    uboot_steps = UBOOT_ENV_STEPS if UBOOT_ENV_METHOD == 'linux' else []
+    if not use_golden:
+        return PIPELINE_STEPS + uboot_steps
+    manifest, reason = golden_image_status()
+    if reason:
+        print(f" 黄金镜像不可用 ({reason})，按步骤逐条执行")
+        return PIPELINE_STEPS + uboot_steps
+    print(f" 使用黄金镜像 (采集于 {manifest['created']}，来源 {manifest['source']})")
+    return GOLDEN_STEPS + uboot_steps
+
+# 设备状态
+STATE_PENDING = "PENDING"
+STATE_WAIT_ONLINE = "WAIT_ONLINE"
+STATE_CONNECT = "CONNECT"
+STATE_RUN_STEP = "RUN_STEP"
+STATE_REBOOT = "REBOOT"
+STATE_DONE = "DONE"
+STATE_FAILED = "FAILED"
+# 批量结果中: 步骤都已完成, 但还需要通过串口设置 U-Boot 参数
+STATE_INCOMPLETE = "INCOMPLETE"
+
+
+class DeviceProvisioner:
+    """
+    单台设备的部署状态机
+    每台设备持有自己的 SSH 连接, 负责 上线等待 -> 连接 -> 执行步骤 -> 重启重连
+    """
+
+    def __init__(self, host, steps=PIPELINE_STEPS, restart=False, final_reboot=True, uboot_env=None):
+        self.host = host
+        self.base_steps = steps
+        self.steps = schedule_steps(steps)
+        # 最后一个步骤之后是否重启; 单台模式由步骤 4 重启, 这里不再单独重启一次
+        self.final_reboot = final_reboot
+        # 最后一步需要重启但 final_reboot=False 时为 True, 由调用方负责重启
+        self.reboot_pending = False
+        # 需要检查的 U-Boot 环境变量, 检查结果 (fw_printenv) 存入 uboot_env_done
+        self.uboot_env = uboot_env
+        self.uboot_env_done = False
+        # 设备不支持在系统中修改 U-Boot 环境变量, uboot_env 步骤已移除, 需要改用串口
+        self.uboot_env_fallback = False
+        # 远程检查发现已是目标状态而跳过的步骤
+        self.probed_steps = []
+        self._probed = False
+        self.state = STATE_PENDING
+        self.step_index = 0
+        self.session = SSHSession(host)
+        # 部署记录, 首次连接后按设备标识加载
+        self.journal = None
+        self.restart = restart
+        self.boot_id = None
+        self.resumed_steps = []
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+        # 每个步骤耗时 (秒)
+        self.step_times = {}
+        # 每次重启从发送 reboot 到重新连接成功的耗时 (秒)
+        self.reboot_times = []
+        self._reboot_start = None
+        # 进度显示中该设备所在的行
+        self.task = None
+        # 后台准备工作: 步骤名 -> 线程
+        self.prestage = {}
+        self._warm_thread = None
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    def _fail(self, reason):
+        self.error = reason
+        return STATE_FAILED
+
+    @property
+    def ssh(self):
+        return self.session.client
+
+    def _close(self):
+        self.session.close()
+
+    def _progress_label(self):
+        if self.state == STATE_RUN_STEP:
+            name = self.steps[self.step_index][0]
+            return f"[{self.host}] 步骤 {self.step_index + 1}/{len(self.steps)} {name}"
+        return f"[{self.host}] {self.state}"
+
+    def _on_wait_online(self):
+        timeout = 300 if self.step_index == 0 else REBOOT_ONLINE_TIMEOUT
+        if not wait_for_device_online(timeout=timeout, host=self.host):
+            return self._fail("等待上线超时")
+        return STATE_CONNECT
+
+    def _on_connect(self):
+        ssh = self.session.get()
+        if ssh is None:
+            return self._fail("SSH 连接失败")
+        if self._reboot_start is not None:
+            self.reboot_times.append(time.time() - self._reboot_start)
+            self._reboot_start = None
+        state = STATE_RUN_STEP
+        if JOURNAL_ENABLED:
+            device_id, self.boot_id = read_device_identity(ssh)
+            if self.journal is None:
+                if self._warm_thread is not None:
+                    self._warm_thread.join()
+                state = self._resume(device_id)
+        if REMOTE_PROBE_ENABLED and not self._probed:
+            self._probed = True
+            state = self._apply_probes(ssh, state)
+        if state == STATE_RUN_STEP and "install_app" in [name for name, _, _ in self.steps[self.step_index:]]:
+            # 传输格式探测要测设备的解压速度, 在预上传和第一个步骤 (fip.bin.sh 等) 开始之前单独进行
+            # 转码仍在预上传线程中与步骤并行
+            with tracer.span("transfer_probe"):
+                app_transfer_format(ssh)
+        return state
+
+    def _apply_probes(self, ssh, state):
+        """首次连接时检查设备状态, 跳过目标状态已满足的步骤, 其余步骤重新安排"""
+        remaining = self.steps[self.step_index:] if state == STATE_RUN_STEP else []
+        results = probe_device(ssh, [name for name, _, _ in remaining], self.uboot_env)
+        self.uboot_env_done = results.get('uboot_env', False)
+        self.uboot_env_fallback = results.get('uboot_env_access') is False
+
+        all_names = {name for name, _, _ in self.base_steps}
+        done = {name for name, _, _ in self.steps[:self.step_index]}
+        skipped = []
+        for name, _, _ in remaining:
+            # 依赖的步骤需要重新执行时, 检查结果已不可信
+            deps = [d for d, _ in STEP_DEPENDS.get(name, []) if d in all_names]
+            if results.get(name) and all(d in done or d in skipped for d in deps):
+                skipped.append(name)
+        if not skipped and not self.uboot_env_fallback:
+            return state
+
+        if skipped:
+            self.probed_steps = skipped
+            print(f" [{self.host}] 设备已是目标状态，跳过: {', '.join(skipped)}")
+        for name in skipped:
+            if self.journal is not None:
+                self.journal.mark_done(name, 0.0, self._step_digests(name), None, self.host)
+        if self.uboot_env_fallback:
+            print(f" [{self.host}] 设备上没有 fw_setenv / {UBOOT_ENV_CONFIG}，无法在系统中修改 U-Boot 参数，需要通过串口设置")
+        base = {s[0]: s for s in self.base_steps}
+        keep = [base[name] for name, _, _ in remaining
+                if name not in skipped and not (name == "uboot_env" and self.uboot_env_fallback)]
+        self.steps = self.steps[:self.step_index] + schedule_steps(keep)
+        if self.step_index >= len(self.steps):
+            return STATE_DONE
+        return STATE_RUN_STEP
+
+    def _warm_artifacts(self):
+        """等待上线期间在后台计算本地文件摘要 (打包补丁、扫描安装包)"""
+        for name, _, _ in self.steps:
+            try:
+                self._step_digests(name)
+            except BaseException:
+                # 出错时在 _resume 中重新计算并报告
+                pass
+
+    def _start_prestage(self, ssh):
+        """启动后续步骤的准备工作, 与当前步骤并行"""
+        for name, _, _ in self.steps[self.step_index + 1:]:
+            func = STEP_PRESTAGE.get(name)
+            if func is None or name in self.prestage:
+                continue
+
+            def worker(name=name, func=func):
+                _trace_ctx.device = self.host
+                try:
+                    with tracer.span("prestage", step=name):
+                        func(ssh)
+                except Exception as e:
+                    print(f" [{self.host}] {name} 预上传失败，将按原方式执行: {e}")
+
+            t = threading.Thread(target=worker, name=f"prestage-{self.host}-{name}", daemon=True)
+            self.prestage[name] = t
+            t.start()
+
+    def _join_prestage(self, name=None):
+        for step, t in self.prestage.items():
+            if name is None or step == name:
+                t.join()
+
+    def _step_digests(self, name):
+        artifacts = STEP_ARTIFACTS.get(name)
+        return artifacts() if artifacts else {}
+
+    def _resume(self, device_id):
+        """加载部署记录, 跳到第一个未完成的步骤"""
+        if device_id == 'unknown':
+            device_id = self.host
+        self.journal = DeviceJournal(device_id)
+        if self.restart:
+            self.journal.clear()
+
+        for name, _, need_reboot in self.steps:
+            if not self.journal.is_done(name, self._step_digests(name)):
+                break
+            self.resumed_steps.append(name)
+            self.step_index += 1
+            # 步骤完成后还未重启过 (boot_id 未变化), 先补一次重启
+            last = self.step_index >= len(self.steps)
+            if need_reboot and self.journal.get(name)['boot_id'] == self.boot_id and \
+                    (not last or self.final_reboot):
+                print(f" [{self.host}] 已完成步骤: {', '.join(self.resumed_steps)}，需先重启")
+                return STATE_REBOOT
+
+        if self.resumed_steps:
+            print(f" [{self.host}] 跳过已完成步骤: {', '.join(self.resumed_steps)}")
+        if self.step_index >= len(self.steps):
+            return STATE_DONE
+        return STATE_RUN_STEP
+
+    def _on_run_step(self):
+        name, func, need_reboot = self.steps[self.step_index]
+        # 连接在步骤之间失效时自动重连
+        ssh = self.session.get()
+        if ssh is None:
+            return self._fail("SSH 连接失败")
+        self._join_prestage(name)
+        self._start_prestage(ssh)
+        t0 = time.time()
+        ok = func(ssh)
+        self.step_times[name] = time.time() - t0
+        if not ok:
+            return self._fail(f"步骤 {name} 失败")
+        # 标记只用于换电脑后识别已完成的步骤, 写入失败不影响本次部署
+        if not mark_step_on_device(ssh, name):
+            print(f" [{self.host}] 注意: 步骤 {name} 完成标记写入设备失败，仅记录在本机部署记录中")
+        if self.journal is not None:
+            self.journal.mark_done(name, self.step_times[name], self._step_digests(name),
+                                   self.boot_id, self.host)
+
+        self.step_index += 1
+        if self.step_index >= len(self.steps):
+            if need_reboot and not self.final_reboot:
+                self.reboot_pending = True
+                return STATE_DONE
+            return STATE_REBOOT if need_reboot else STATE_DONE
+        if need_reboot:
+            return STATE_REBOOT
+        return STATE_RUN_STEP
+
+    def _on_reboot(self):
+        # 后台上传必须在重启前完成
+        self._join_prestage()
+        self._reboot_start = time.time()
+        self.session.reboot()
+        if self.step_index >= len(self.steps):
+            return STATE_DONE
+        return STATE_WAIT_ONLINE
+
+    def run(self, keep_connection=False):
+        """运行状态机直到 DONE/FAILED, 返回是否成功"""
+        handlers = {
+            STATE_WAIT_ONLINE: self._on_wait_online,
+            STATE_CONNECT: self._on_connect,
+            STATE_RUN_STEP: self._on_run_step,
+            STATE_REBOOT: self._on_reboot,
+        }
+        self.start_time = time.time()
+        self.state = STATE_WAIT_ONLINE
+        _trace_ctx.device = self.host
+        if JOURNAL_ENABLED:
+            self._warm_thread = threading.Thread(target=self._warm_artifacts, daemon=True)
+            self._warm_thread.start()
+        self.task = renderer.add_task(self._progress_label(), quiet=True)
+        push_task(self.task)
+        try:
+            while self.state not in (STATE_DONE, STATE_FAILED):
+                fields = {}
+                if self.state == STATE_RUN_STEP:
+                    fields['step'] = self.steps[self.step_index][0]
+                self.task.update(label=self._progress_label())
+                with tracer.span(self.state.lower(), **fields):
+                    self.state = handlers[self.state]()
+        except Exception as e:
+            self.state = self._fail(f"异常: {e}")
+        finally:
+            self._join_prestage()
+            pop_task(self.task)
+            self.task.finish()
+            self.end_time = time.time()
+            if not keep_connection or self.state != STATE_DONE:
+                self._close()
+        return self.state == STATE_DONE
+
+
+def parse_device_list(specs):
+    """
+    解析设备地址列表
+    支持: 单个 IP "192.168.1.10"、末段范围 "192.168.1.10-25"、逗号分隔
+    """
+    hosts = []
+    for spec in specs:
+        for item in spec.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "-" in item:
+                start, end = item.split("-", 1)
+                first = ipaddress.IPv4Address(start)
+                if "." in end:
+                    last = ipaddress.IPv4Address(end)
+                else:
+                    last = ipaddress.IPv4Address(start.rsplit(".", 1)[0] + "." + end)
+                if last < first:
+                    raise ValueError(f"地址范围错误: {item}")
+                hosts.extend(str(ipaddress.IPv4Address(i)) for i in range(int(first), int(last) + 1))
+            else:
+                hosts.append(str(ipaddress.IPv4Address(item)))
+    # 去重并保持顺序
+    return list(dict.fromkeys(hosts))
+
+
+def fleet_complete(p):
+    """设备是否已部署完成: 状态机成功结束, 且不需要再通过串口设置 U-Boot 参数"""
+    return p.state == STATE_DONE and not p.uboot_env_fallback
+
+
+def print_fleet_summary(provisioners, wall_time):
+    """打印每台设备的结果及整体吞吐量"""
+    print("\n================= 批量部署结果 =================")
+    print(f"{'设备':<16} {'状态':<8} {'耗时(s)':>8}  详情")
+    for p in provisioners:
+        detail = p.error or " ".join(f"{k}={v:.0f}s" for k, v in p.step_times.items())
+        if p.resumed_steps:
+            detail += f" (续做, 跳过 {','.join(p.resumed_steps)})"
+        if p.probed_steps:
+            detail += f" (已是目标状态, 跳过 {','.join(p.probed_steps)})"
+        state = p.state
+        if p.uboot_env_fallback and p.state == STATE_DONE:
+            state = STATE_INCOMPLETE
+            detail += " (需串口设置 U-Boot 参数)"
+        print(f"{p.host:<16} {state:<8} {p.elapsed:>8.1f}  {detail}")
+
+    # 还需要串口设置 U-Boot 参数的设备没有部署完, 不计入成功数和吞吐量
+    done = sum(1 for p in provisioners if fleet_complete(p))
+    incomplete = sum(1 for p in provisioners if p.state == STATE_DONE and p.uboot_env_fallback)
+    print("------------------------------------------------")
+    print(f"成功 {done}/{len(provisioners)}，总耗时 {wall_time:.1f}s")
+    if incomplete:
+        print(f"未完成 {incomplete} 台: 需要通过串口设置 U-Boot 参数")
+    if wall_time > 0:
+        print(f"吞吐量: {done * 3600 / wall_time:.1f} 台/小时")
+    if UBOOT_ENV_METHOD != 'linux':
+        print("WARNING: 批量模式不包含串口 U-Boot 设置 (步骤 4)")
+
+
+def run_fleet(hosts, workers=FLEET_WORKERS, restart=False, steps=PIPELINE_STEPS):
+    """并发部署多台设备, 每台设备一个独立的状态机和 SSH 连接"""
+    global SPINNER_ENABLED
+    SPINNER_ENABLED = False
+
+    provisioners = [DeviceProvisioner(h, steps, restart) for h in hosts]
+    print(f"批量部署 {len(hosts)} 台设备，并发数 {min(workers, len(hosts))}")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(p.run): p for p in provisioners}
+        for future in as_completed(futures):
+            p = futures[future]
+            if not future.result():
+                result = f"失败: {p.error}"
+            else:
+                result = "完成" if fleet_complete(p) else "未完成: 需串口设置 U-Boot 参数"
+            print(f" [{p.host}] {result} ({p.elapsed:.0f}s)")
+    print_fleet_summary(provisioners, time.time() - start)
+    return all(fleet_complete(p) for p in provisioners)
+
+
+def finish_trace(chrome_path=None):
+    """关闭追踪文件, 并按需导出 Chrome trace"""
+    tracer.close()
+    if chrome_path:
+        tracer.export_chrome(chrome_path)
+        print(f"时间线已导出: {chrome_path} (可在 chrome://tracing 或 Perfetto 中打开)")
+
+
 # ================= 主程序 =================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会议对讲模块组件自动化安装")
+    parser.add_argument("--fleet", nargs="+", metavar="IP",
+                        help="批量模式: 设备地址列表, 支持 192.168.1.10-25 形式的范围")
+    parser.add_argument("--workers", type=int, default=FLEET_WORKERS, help="批量模式并发数")
+    parser.add_argument("--restart", action="store_true",
+                        help="忽略部署记录, 从第一步重新开始")
+    parser.add_argument("--bench-upload", metavar="FILE",
+                        help="上传测试: 对比 SCP 与多通道 SFTP 上传该文件的速度")
+    parser.add_argument("--trace", metavar="FILE.jsonl",
+                        help="把每个操作的耗时/字节数/返回码写入 JSONL 文件")
+    parser.add_argument("--chrome-trace", metavar="FILE.json",
+                        help="结束时导出 Chrome trace 格式的时间线")
+    parser.add_argument("--cmd-log", metavar="FILE",
+                        help="把远程命令的完整输出实时写入日志文件")
+    parser.add_argument("--app-version", metavar="VERSION",
+                        help="固定使用指定版本的应用安装包 (默认取版本号最高的)")
+    parser.add_argument("--transfer-format", choices=['auto'] + list(FORMATS), default=APP_TRANSFER_FORMAT,
+                        help="应用安装包的传输格式 (默认 auto: 按链路速度和设备解压速度自动选择)")
+    parser.add_argument("--list-apps", action="store_true",
+                        help="列出上一级目录中所有应用安装包的版本后退出")
+    parser.add_argument("--golden", action="store_true",
+                        help="黄金镜像模式: 直接写入采集好的镜像 (镜像过期时自动按步骤执行)")
+    parser.add_argument("--golden-capture", nargs="?", const=DEVICE_IP, metavar="IP",
+                        help="从已完整部署的参考设备采集黄金镜像后退出 (默认 DEVICE_IP)")
+    parser.add_argument("--setenv", action="append", default=[], metavar="NAME=VALUE",
+                        help="额外设置的 U-Boot 环境变量, 可重复指定")
+    parser.add_argument("--uboot-env-method", choices=['linux', 'serial'], default=UBOOT_ENV_METHOD,
+                        help="U-Boot 环境变量的修改方式: linux 在系统中通过 SSH 修改 (默认), serial 重启后通过串口修改")
+    parser.add_argument("--serial-flash", nargs="*", metavar="FILE=COMMAND",
+                        help="网络不可用时通过串口 (U-Boot loady) 烧写镜像后退出, 不指定则使用 UBOOT_FLASH_IMAGES")
+    parser.add_argument("--tftp-flash", nargs="*", metavar="FILE=COMMAND",
+                        help="在 U-Boot 下通过本机 TFTP 服务烧写镜像后退出, 不指定则使用 UBOOT_FLASH_IMAGES")
+    parser.add_argument("--serial-baud", type=int, default=SERIAL_LOAD_BAUDRATE, metavar="BAUD",
+                        help="串口烧写时临时切换的波特率, 0 表示不切换")
+    parser.add_argument("--boot-profile", action="store_true",
+                        help="步骤 4 reset 后等待设备启动完成, 记录各启动阶段耗时")
+    parser.add_argument("--boot-report", action="store_true",
+                        help="按板子汇总已记录的启动耗时后退出")
+    args = parser.parse_args()
+
     print(f"当前工作目录: {BASE_DIR}")
     print(f"上一级资源目录: {PARENT_DIR}")
-    
-    # 1. 等待设备上线
-    if not wait_for_device_online():
-        sys.exit(1)
 
-    # 2. 建立 SSH 连接
-    ssh = create_ssh_client()
-    if not ssh:
-        sys.exit(1)
+    if args.cmd_log:
+        CMD_LOG_FILE = args.cmd_log
+
+    if args.list_apps:
+        list_app_packages()
+        sys.exit(0)
+    if args.boot_report:
+        print_boot_report(BOOT_PROFILE_FILE)
+        sys.exit(0)
+    if args.boot_profile:
+        BOOT_PROFILE_WAIT = True
+    APP_TRANSFER_FORMAT = args.transfer_format
+    if args.app_version:
+        try:
+            parse_version(args.app_version)
+        except ValueError:
+            print(f"版本号格式错误: {args.app_version}，应为 XX.YY.ZZ.NNNN")
+            sys.exit(1)
+        APP_VERSION = args.app_version
+
+    if args.trace or args.chrome_trace:
+        tracer.open(args.trace)
+        atexit.register(finish_trace, args.chrome_trace)
+
+    flash_items = args.tftp_flash if args.tftp_flash is not None else args.serial_flash
+    if flash_items is not None:
+        try:
+            images = [parse_flash_image(item) for item in flash_items] or UBOOT_FLASH_IMAGES
+        except ValueError as e:
+            print(f"镜像参数错误: {e}")
+            sys.exit(1)
+        if not images:
+            print("没有要烧写的镜像: 请在 UBOOT_FLASH_IMAGES 中配置或用 FILE=COMMAND 指定")
+            sys.exit(1)
+        method = "tftp" if args.tftp_flash is not None else "serial"
+        sys.exit(0 if uboot_flash_images(SERIAL_PORT, images, method, args.serial_baud or None) else 1)
+
+    if args.bench_upload:
+        ssh = create_ssh_client()
+        if not ssh:
+            sys.exit(1)
+        try:
+            benchmark_upload(ssh, args.bench_upload)
+        finally:
+            ssh.close()
+        sys.exit(0)
+
+    if args.golden_capture:
+        ssh = create_ssh_client(args.golden_capture)
+        if not ssh:
+            sys.exit(1)
+        try:
+            ok = capture_golden_image(ssh, args.golden_capture)
+        finally:
+            ssh.close()
+        sys.exit(0 if ok else 1)
+
+    uboot_env = dict(UBOOT_ENV)
+    for item in args.setenv:
+        name, sep, value = item.partition("=")
+        if not sep or not name:
+            print(f"U-Boot 环境变量格式错误: {item} (应为 NAME=VALUE)")
+            sys.exit(1)
+        uboot_env[name] = value
+    # uboot_env 步骤 (UBOOT_ENV_METHOD = 'linux') 使用 UBOOT_ENV
+    UBOOT_ENV = uboot_env
+    UBOOT_ENV_METHOD = args.uboot_env_method
 
+    steps = select_pipeline(args.golden)
+
+    if args.fleet:
+        try:
+            hosts = parse_device_list(args.fleet)
+        except ValueError as e:
+            print(f"设备地址错误: {e}")
+            sys.exit(1)
+        try:
+            sys.exit(0 if run_fleet(hosts, args.workers, args.restart, steps) else 1)
+        except KeyboardInterrupt:
+            print("\n用户取消操作")
+            sys.exit(1)
+
+    # 单台模式: 步骤由状态机执行, 完成后保留连接; 通过串口设置 U-Boot 参数时用于步骤 4
+    linux_env = UBOOT_ENV_METHOD == 'linux'
+    provisioner = DeviceProvisioner(DEVICE_IP, steps, args.restart, final_reboot=False,
+                                    uboot_env=None if linux_env else uboot_env)
+    ssh = None
     try:
-        # 3. 按顺序执行部署步骤
-        if step_1_usb_audio(ssh):
-            print("\n设备重启中，断开当前 SSH 连接...")
-            ssh.close() # 主动关闭旧连接
-            
-            # --- 等待重启并重连 ---
-            with LoadingSpinner("等待设备重启..."):
-                time.sleep(10) # 等待几秒，避开设备刚关机时的 Ping 通假象
-            
-            if wait_for_device_online(timeout=120):
-                with LoadingSpinner("重新连接设备..."):
-                    ssh = create_ssh_client() # 【创建新连接】
-                
-                if ssh:
-                    if step_2_install_app(ssh):
-                        print("\n 正在重启设备以应用配置...")
-                        exec_cmd(ssh, "reboot", ignore_error=True)
-                        ssh.close()
-                         # --- 等待重启并重连 ---
-                        with LoadingSpinner("等待设备重新连接..."):
-                            time.sleep(10)
-                        
-                        if wait_for_device_online(timeout=120):
-                            with LoadingSpinner("重新连接设备..."):
-                                ssh = create_ssh_client() # 【创建新连接】
-                            
-                            if ssh:
-                                if step_3_boot_logo(ssh):                    
-                                    step_4_uboot_settings(SERIAL_PORT)
-                
+        if provisioner.run(keep_connection=True):
+            ssh = provisioner.ssh
+            if (linux_env and not provisioner.uboot_env_fallback) or provisioner.uboot_env_done:
+                if provisioner.uboot_env_done:
+                    # fw_printenv 显示 U-Boot 参数已是目标值, 不需要串口操作
+                    print(" U-Boot 参数已是目标值，跳过步骤 4")
+                if provisioner.reboot_pending:
+                    print("\n正在重启设备...")
+                    provisioner.session.reboot()
+                    ssh = None
+            else:
+                board = provisioner.journal.device_id if provisioner.journal else DEVICE_IP
+                step_4_uboot_settings(SERIAL_PORT, uboot_env, DEVICE_IP, board, ssh)
+        else:
+            print(f"\n部署失败: {provisioner.error}")
+            sys.exit(1)
+
     except KeyboardInterrupt:
         print("\n用户取消操作")
     except Exception as e:
         print(f"\n发生未知错误: {e}")
     finally:
-        if 'ssh' in locals() and ssh is not None:
+        if ssh is not None:
             try:
                 ssh.close()
                 print(" SSH 连接已关闭")
             except Exception:
-                pass
\ No newline at end of file
+                pass
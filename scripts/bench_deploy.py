@@ -0,0 +1,884 @@
+"""
+auto_deploy.py 的本地性能测试工具 (无需真实设备)
+
+在本机启动基于 paramiko 的模拟设备:
+  * SSH / SCP / SFTP 服务, 命令在沙箱目录中执行 (设备上的绝对路径映射到沙箱)
+  * reboot 会让 SSH 端口下线一段时间后重新上线 (boot_id 随之变化)
+  * pty 模拟的 U-Boot 串口, 支持倒计时拦截、setenv/printenv/saveenv/reset,
+    以及 loady (YMODEM, 按当前波特率限速) / tftp / crc32 / mmc write
+然后用 auto_deploy 的真实流程跑一遍, 输出每步耗时、上传吞吐量和重连耗时
+
+仅支持 Linux (依赖 pty 和 127.0.0.x 回环地址)
+用法: python bench_deploy.py [--boards 4] [--pkg-mb 64] [--upload-mb 64]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import select
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tty
+import uuid
+import zlib
+
+import paramiko
+
+import auto_deploy
+import tftp_server
+import uboot_env
+import ymodem
+
+
+# ================= 模拟设备配置 =================
+BENCH_SSH_PORT = 2222
+# 关机阶段耗时 (reboot 之后, U-Boot 输出之前)
+SHUTDOWN_TIME = 1.0
+# U-Boot 倒计时 (秒)
+BOOTDELAY = 1.0
+# 内核 + 用户态启动到 sshd 可用的耗时
+LINUX_BOOT_TIME = 2.0
+# fip.bin.sh (内核更新) 模拟耗时
+FIP_TIME = 1.0
+# install.sh 模拟输出的行数 (用于测试大量输出)
+INSTALL_OUTPUT_LINES = 5000
+# U-Boot 环境变量区 (冗余, 两份) 在模拟 eMMC 中的位置, 与 /etc/fw_env.config 一致
+ENV_LOCATIONS = [("/dev/mmcblk0", 0x80000, 0x10000), ("/dev/mmcblk0", 0x90000, 0x10000)]
+
+# 设备上的绝对路径 -> 沙箱路径
+_REMOTE_PATHS = ["/dev/shm", "/usr/bin", "/root", "/app", "/recovery", "/dev/mmcblk0p4", "/dev/mmcblk0",
+                 "/etc/fw_env.config", "/sys/class/net/eth0/address", "/proc/sys/kernel/random/boot_id"]
+_PATH_RE = re.compile(r"(?<![\w./-])(" + "|".join(re.escape(p) for p in _REMOTE_PATHS) + r")")
+
+# 沙箱中用于替代系统命令的脚本
+_FAKE_BINS = {
+    "reboot": 'touch "$BOARD_ROOT/.reboot"\n',
+    "mount": "exit 0\n",
+    "addgroup": "exit 0\n",
+    "sync": "exit 0\n",
+}
+# ======================================================
+
+
+class FakeBoard:
+    """
+    模拟一台 ss528v100 设备: SSH 服务 + U-Boot 串口
+    """
+
+    def __init__(self, host, port, root, host_key, mac):
+        self.host = host
+        self.port = port
+        self.root = root
+        self.host_key = host_key
+        self.regen_host_key = False
+        self.lock = threading.Lock()
+        self.listener = None
+        self.transports = []
+        self.env = {"bootcmd": "run bootcmd_default", "bootdelay": str(int(BOOTDELAY))}
+        self.boot_count = 0
+        # U-Boot 内存 (loady 加载地址 -> 数据) 和串口当前波特率
+        self.ram = {}
+        self.baudrate = auto_deploy.BAUDRATE
+
+        for d in ["dev/shm", "usr/bin", "root", "app", "recovery", "sys/class/net/eth0",
+                  "proc/sys/kernel/random", "fakebin", "etc"]:
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+        with open(os.path.join(root, "sys/class/net/eth0/address"), "w") as f:
+            f.write(mac + "\n")
+        open(os.path.join(root, "dev/mmcblk0p4"), "wb").close()
+        # 环境变量保存在模拟 eMMC 中 (没有 fw_setenv, 只有 fw_env.config)
+        with open(os.path.join(root, "etc/fw_env.config"), "w") as f:
+            f.writelines(f"{dev} 0x{offset:x} 0x{size:x}\n" for dev, offset, size in ENV_LOCATIONS)
+        with open(os.path.join(root, "dev/mmcblk0"), "wb") as f:
+            for i, (_, offset, size) in enumerate(ENV_LOCATIONS):
+                f.seek(offset)
+                f.write(uboot_env.build_env(self.env, size, redundant=True, flags=1 - i))
+        for name, body in _FAKE_BINS.items():
+            path = os.path.join(root, "fakebin", name)
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\n" + body)
+            os.chmod(path, 0o755)
+
+        # 串口: 主端由模拟设备读写, 从端路径交给 auto_deploy 用 pyserial 打开
+        self.console_fd, self.console_slave = os.openpty()
+        tty.setraw(self.console_fd)
+        tty.setraw(self.console_slave)
+        os.set_blocking(self.console_fd, False)
+        self.serial_port = os.ttyname(self.console_slave)
+
+    # ---------------- U-Boot 环境变量 (保存在模拟 eMMC 中) ----------------
+    def _read_env_copies(self):
+        with open(os.path.join(self.root, "dev/mmcblk0"), "rb") as f:
+            copies = []
+            for _, offset, size in ENV_LOCATIONS:
+                f.seek(offset)
+                copies.append(uboot_env.parse_env(f.read(size), redundant=True))
+        return copies
+
+    def saved_env(self):
+        """U-Boot 启动时会加载的环境变量 (生效的副本), 都无效时为 None"""
+        copies = self._read_env_copies()
+        current = uboot_env.active_copy(copies)
+        return dict(copies[current].vars) if current is not None else None
+
+    def _save_env(self):
+        target, data = uboot_env.update_env(self._read_env_copies(), ENV_LOCATIONS[0][2], self.env)
+        with open(os.path.join(self.root, "dev/mmcblk0"), "r+b") as f:
+            f.seek(ENV_LOCATIONS[target][1])
+            f.write(data)
+
+    # ---------------- 启动 / 重启 ----------------
+    def _new_boot_id(self):
+        self.boot_count += 1
+        with open(os.path.join(self.root, "proc/sys/kernel/random/boot_id"), "w") as f:
+            f.write(str(uuid.uuid4()) + "\n")
+
+    def power_on(self):
+        self._new_boot_id()
+        self._start_sshd()
+
+    def reboot(self):
+        """SSH 立即下线, 经过关机/U-Boot/内核启动后重新上线"""
+        self._stop_sshd()
+        threading.Thread(target=self._boot_sequence, daemon=True).start()
+
+    def _boot_sequence(self):
+        try:
+            self._boot()
+        except (OSError, ValueError):
+            # 测试结束时串口已关闭
+            pass
+
+    def _boot(self):
+        time.sleep(SHUTDOWN_TIME)
+        self.env = self.saved_env() or self.env
+        while True:
+            self._console_write(b"\r\n\r\nU-Boot 2020.01 (bench)\r\n\r\nMMC:   sdhci: 0\r\n")
+            if not self._autoboot_countdown():
+                break
+            # 进入 U-Boot 命令行, 直到 reset
+            if not self._uboot_shell():
+                break
+        self._console_write(b"Starting kernel ...\r\n\r\n")
+        time.sleep(LINUX_BOOT_TIME * 0.6)
+        self._console_write(b"Freeing unused kernel memory: 1024K\r\nRun /sbin/init as init process\r\n")
+        time.sleep(LINUX_BOOT_TIME * 0.4)
+        self._console_write(b"Starting sshd: OK\r\n")
+        self._new_boot_id()
+        if self.regen_host_key:
+            # 模拟只读根文件系统上的 dropbear -R: 每次启动生成新的主机密钥
+            self.host_key = paramiko.RSAKey.generate(1024)
+        self._start_sshd()
+        self._console_write(b"\r\nWelcome to ss528v100\r\nss528v100 login: ")
+
+    def _autoboot_countdown(self):
+        """倒计时期间收到任意字节即进入命令行, 返回是否被拦截"""
+        self._console_write(b"Hit any key to stop autoboot:  1 ")
+        deadline = time.time() + BOOTDELAY
+        while time.time() < deadline:
+            r, _, _ = select.select([self.console_fd], [], [], max(deadline - time.time(), 0))
+            if r and self._console_read():
+                self._console_write(b"\b\b\b 0 \r\nhisilicon # ")
+                return True
+        self._console_write(b"\b\b\b 0 \r\n")
+        return False
+
+    def _uboot_shell(self):
+        """简单的 U-Boot 命令行, reset 时返回 True"""
+        buf = b""
+        while True:
+            select.select([self.console_fd], [], [], 1.0)
+            data = self._console_read()
+            if not data:
+                continue
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                cmd = line.decode(errors="replace").strip("\r")
+                if cmd.startswith("loady"):
+                    self._console_write(cmd.encode())
+                    self._loady(cmd.split()[1:])
+                    self._console_write(b"\r\nhisilicon # ")
+                    continue
+                if cmd.split()[:1] == ["tftp"] and len(cmd.split()) == 3:
+                    self._console_write(cmd.encode())
+                    self._console_write(self._tftp(cmd.split()[1:]).encode() + b"\r\nhisilicon # ")
+                    continue
+                out = self._uboot_exec(cmd)
+                if out is None:
+                    self._console_write(cmd.encode() + b"\r\nresetting ...\r\n")
+                    return True
+                self._console_write(cmd.encode() + out.encode() + b"\r\nhisilicon # ")
+
+    def _uboot_exec(self, cmd):
+        args = cmd.split(None, 2)
+        if not args:
+            return ""
+        if args[0] == "setenv" and len(args) >= 2:
+            value = args[2] if len(args) > 2 else ""
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            self.env[args[1]] = value
+            return ""
+        if args[0] == "printenv":
+            names = args[1:] or sorted(self.env)
+            return "".join(f"\r\n{n}={self.env[n]}" if n in self.env
+                           else f"\r\n## Error: \"{n}\" not defined" for n in names)
+        if args[0] == "saveenv":
+            time.sleep(0.2)
+            self._save_env()
+            return "\r\nSaving Environment to MMC... Writing to MMC(0)... OK"
+        if args[0] in ("reset", "boot"):
+            return None
+        if args[0] == "crc32" and len(args) == 3:
+            addr, size = int(args[1], 16), int(args[2], 16)
+            data = self.ram.get(addr, b"")[:size].ljust(size, b"\0")
+            return f"\r\nCRC32 for {addr:08x} ... {addr + size - 1:08x} ==> {zlib.crc32(data) & 0xFFFFFFFF:08x}"
+        if args[0] == "mmc" and len(args) == 3 and args[1] == "write":
+            addr, blk, cnt = (int(v, 16) for v in args[2].split())
+            data = self.ram.get(addr, b"")[:cnt * 512].ljust(cnt * 512, b"\0")
+            path = os.path.join(self.root, "dev/mmcblk0")
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(blk * 512)
+                f.write(data)
+            return f"\r\n\r\nMMC write: dev # 0, block # {blk}, count {cnt} ... {cnt} blocks written: OK"
+        return f"\r\nUnknown command '{args[0]}' - try 'help'"
+
+    def _tftp(self, args):
+        """
+        U-Boot tftp: 与真实 U-Boot 一样边下载边输出 "#" (分多次写入, 每 65 个换行),
+        每次写入后串口上的最后一行都以 "#" 结尾
+        """
+        addr = int(args[0], 16)
+        result = {}
+
+        def fetch():
+            try:
+                result["data"] = tftp_server.tftp_get(
+                    self.env["serverip"], args[1], int(self.env.get("tftpdstp", 69)),
+                    int(self.env.get("tftpblocksize", 512)), int(self.env.get("tftpwindowsize", 1)))
+            except (tftp_server.TftpError, KeyError, OSError) as e:
+                result["error"] = e
+
+        self._console_write(f"\r\nUsing eth0 device\r\nTFTP from server {self.env.get('serverip')}\r\n"
+                            f"Loading: ".encode())
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        hashes = 0
+        # 下载很快时也至少输出几次, 保证提示符匹配经历过以 "#" 结尾的中间状态
+        while thread.is_alive() or hashes < 3:
+            thread.join(0.02)
+            self._console_write(b"\r\n\t #" if hashes and hashes % 65 == 0 else b"#")
+            hashes += 1
+        if "error" in result:
+            return f"\r\nTFTP error: {result['error']}"
+        data = result["data"]
+        self.ram[addr] = data
+        return f"\r\n\t done\r\nBytes transferred = {len(data)} ({len(data):x} hex)"
+
+    def _loady(self, args):
+        """U-Boot loady: 可选切换波特率, YMODEM 接收到内存, 结束后切回原波特率"""
+        addr = int(args[0], 16) if args else 0x42000000
+        baudrate = int(args[1]) if len(args) > 1 else self.baudrate
+        old = self.baudrate
+        if baudrate != old:
+            self._console_write(f"\r\n## Switch baudrate to {baudrate} bps and press ENTER ...\r\n".encode())
+            self.baudrate = baudrate
+            self._console_wait_key(b"\r")
+        self._console_write(f"\r\n## Ready for binary (ymodem) download to 0x{addr:08X} at {baudrate} bps...\r\n".encode())
+        try:
+            _, data = ymodem.ymodem_receive(_ConsolePort(self))
+        except ymodem.YModemError:
+            data = b""
+            self._console_write(b"\r\n## Binary (ymodem) download aborted\r\n")
+        self.ram[addr] = data
+        self._console_write(f"## Total Size      = 0x{len(data):08x} = {len(data)} Bytes\r\n".encode())
+        if baudrate != old:
+            self._console_write(f"## Switch baudrate to {old} bps and press ESC ...\r\n".encode())
+            self.baudrate = old
+            self._console_wait_key(b"\x1b")
+
+    def _console_wait_key(self, key, timeout=10.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            select.select([self.console_fd], [], [], max(deadline - time.time(), 0))
+            if key in self._console_read():
+                return
+
+    def _console_write(self, data):
+        try:
+            os.write(self.console_fd, data)
+        except (BlockingIOError, OSError):
+            pass
+
+    def _console_read(self):
+        return self._console_read_n(4096)
+
+    def _console_read_n(self, n):
+        try:
+            return os.read(self.console_fd, n)
+        except (BlockingIOError, OSError):
+            return b""
+
+    # ---------------- SSH 服务 ----------------
+    def _start_sshd(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(16)
+        with self.lock:
+            self.listener = sock
+        threading.Thread(target=self._accept_loop, args=(sock,), daemon=True).start()
+
+    def _stop_sshd(self):
+        with self.lock:
+            sock, self.listener = self.listener, None
+            transports, self.transports = self.transports, []
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        for t in transports:
+            t.close()
+
+    def _accept_loop(self, sock):
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SandboxSFTP, self)
+        with self.lock:
+            if self.listener is None:
+                conn.close()
+                return
+            self.transports.append(transport)
+        try:
+            transport.start_server(server=_BoardServer(self))
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+
+    def map_path(self, path):
+        return _PATH_RE.sub(lambda m: self.root + m.group(1), path)
+
+    def run_command(self, channel, command):
+        """在沙箱中执行一条命令, 输出转发到通道"""
+        env = dict(os.environ, BOARD_ROOT=self.root, FIP_TIME=str(FIP_TIME),
+                   INSTALL_OUTPUT_LINES=str(INSTALL_OUTPUT_LINES),
+                   PATH=os.path.join(self.root, "fakebin") + os.pathsep + os.environ.get("PATH", ""))
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = []
+        if argv[:1] == ["scp"] and "-t" in argv:
+            status = _scp_sink(channel, self.map_path(argv[-1]))
+        else:
+            proc = subprocess.Popen(["sh", "-c", self.map_path(command)], cwd=self.root, env=env,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            pumps = [
+                threading.Thread(target=_pump, args=(proc.stdout.read1, channel.sendall)),
+                threading.Thread(target=_pump, args=(proc.stderr.read1, channel.sendall_stderr)),
+                threading.Thread(target=_feed_stdin, args=(channel, proc.stdin), daemon=True),
+            ]
+            for t in pumps:
+                t.start()
+            status = proc.wait()
+            pumps[0].join()
+            pumps[1].join()
+
+        try:
+            channel.send_exit_status(status)
+            channel.close()
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+
+        reboot_flag = os.path.join(self.root, ".reboot")
+        if os.path.exists(reboot_flag):
+            os.remove(reboot_flag)
+            time.sleep(0.05)
+            self.reboot()
+
+    def close(self):
+        self._stop_sshd()
+        for fd in (self.console_fd, self.console_slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def _pump(read, write):
+    try:
+        while True:
+            data = read(65536)
+            if not data:
+                return
+            write(data)
+    except (OSError, EOFError, paramiko.SSHException):
+        pass
+
+
+def _feed_stdin(channel, stdin):
+    try:
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            stdin.write(data)
+            stdin.flush()
+    except (OSError, EOFError, BrokenPipeError):
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def _scp_sink(channel, target):
+    """最小 SCP 接收端 (scp -t), 支持单文件上传"""
+    f = channel.makefile("rb")
+    channel.sendall(b"\0")
+    while True:
+        line = f.readline()
+        if not line:
+            return 0
+        kind = line[:1]
+        if kind == b"C":
+            _, size, name = line[1:].decode().rstrip("\n").split(" ", 2)
+            dest = os.path.join(target, name) if os.path.isdir(target) else target
+            channel.sendall(b"\0")
+            remaining = int(size)
+            with open(dest, "wb") as out:
+                while remaining:
+                    data = f.read(min(remaining, 65536))
+                    if not data:
+                        return 1
+                    out.write(data)
+                    remaining -= len(data)
+            f.read(1)
+            channel.sendall(b"\0")
+        elif kind in (b"T", b"D", b"E"):
+            channel.sendall(b"\0")
+        else:
+            return 1
+
+
+class _ConsolePort:
+    """模拟设备串口主端的 read/write 接口 (供 ymodem 使用), 按当前波特率限速"""
+
+    def __init__(self, board):
+        self.board = board
+        self.timeout = 1.0
+
+    def read(self, n):
+        deadline = time.time() + self.timeout
+        out = b""
+        while len(out) < n:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([self.board.console_fd], [], [], remaining)[0]:
+                break
+            out += self.board._console_read_n(n - len(out))
+        # 每字节 10 bit (8N1)
+        time.sleep(len(out) * 10 / self.board.baudrate)
+        return out
+
+    def write(self, data):
+        self.board._console_write(data)
+
+
+class _BoardServer(paramiko.ServerInterface):
+    def __init__(self, board):
+        self.board = board
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == auto_deploy.USERNAME and password == auto_deploy.PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.board.run_command,
+                         args=(channel, command.decode(errors="replace")), daemon=True).start()
+        return True
+
+
+class _SandboxHandle(paramiko.SFTPHandle):
+    def chattr(self, attr):
+        if attr.st_size is not None:
+            self.writefile.truncate(attr.st_size)
+        return paramiko.SFTP_OK
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SandboxSFTP(paramiko.SFTPServerInterface):
+    """把设备路径映射到沙箱的 SFTP 服务"""
+
+    def __init__(self, server, board, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.board = board
+
+    def _path(self, path):
+        return self.board.map_path(path)
+
+    def open(self, path, flags, attr):
+        path = self._path(path)
+        try:
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        handle = _SandboxHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+# ================= 测试数据 =================
+def make_artifacts(work_dir, pkg_mb):
+    """生成音频补丁目录和应用安装包"""
+    audio_dir = os.path.join(work_dir, auto_deploy.AUDIO_PATCH_DIR_NAME)
+    os.makedirs(audio_dir, exist_ok=True)
+    with open(os.path.join(audio_dir, "fip.bin.sh"), "w") as f:
+        f.write('#!/bin/sh\nsleep "$FIP_TIME"\necho "fip updated"\n')
+
+    staging = os.path.join(work_dir, "staging")
+    for sub in ("alsa-utils-1.2.9/bin", "alsa-lib-1.2.9/share"):
+        os.makedirs(os.path.join(staging, sub), exist_ok=True)
+    for tool in ("aplay", "arecord", "amixer"):
+        with open(os.path.join(staging, "alsa-utils-1.2.9/bin", tool), "wb") as f:
+            f.write(f'#!/bin/sh\necho "{tool}: version 1.2.9 by Jaroslav Kysela"\nexit 0\n#'.encode())
+            f.write(os.urandom(64 * 1024).hex().encode())
+        os.chmod(os.path.join(staging, "alsa-utils-1.2.9/bin", tool), 0o755)
+    with tarfile.open(os.path.join(audio_dir, "alsa-lib_utils.tar.gz"), "w:gz") as tar:
+        tar.add(os.path.join(staging, "alsa-utils-1.2.9"), "alsa-utils-1.2.9")
+        tar.add(os.path.join(staging, "alsa-lib-1.2.9"), "alsa-lib-1.2.9")
+
+    pkg_dir_name = "install_dt-1.0.0.1-ss528v100-Linux"
+    pkg_dir = os.path.join(staging, pkg_dir_name)
+    os.makedirs(pkg_dir, exist_ok=True)
+    with open(os.path.join(pkg_dir, "install.sh"), "w") as f:
+        f.write('#!/bin/sh\n'
+                'mkdir -p "$BOARD_ROOT/app/dt/cfg"\n'
+                'cp bootlogo-hg.jpg "$BOARD_ROOT/app/dt/cfg/"\n'
+                'i=0; while [ $i -lt "$INSTALL_OUTPUT_LINES" ]; do echo "install: file $i"; i=$((i+1)); done\n')
+    with open(os.path.join(pkg_dir, "bootlogo-hg.jpg"), "wb") as f:
+        f.write(os.urandom(200 * 1024))
+    with open(os.path.join(pkg_dir, "payload.bin"), "wb") as f:
+        for _ in range(pkg_mb):
+            f.write(os.urandom(1024 * 1024))
+    with tarfile.open(os.path.join(work_dir, pkg_dir_name + ".tar.gz"), "w:gz", compresslevel=1) as tar:
+        tar.add(pkg_dir, pkg_dir_name)
+    shutil.rmtree(staging)
+
+
+def configure_auto_deploy(work_dir, port):
+    """让 auto_deploy 使用模拟设备和测试数据"""
+    auto_deploy.SSH_PORT = port
+    auto_deploy.PARENT_DIR = work_dir
+    auto_deploy.LOCAL_AUDIO_PATH = os.path.join(work_dir, auto_deploy.AUDIO_PATCH_DIR_NAME)
+    auto_deploy.CACHE_DIR = os.path.join(work_dir, "cache")
+    auto_deploy.DIGEST_CACHE_FILE = os.path.join(auto_deploy.CACHE_DIR, "digests.json")
+    auto_deploy.ARTIFACT_INDEX_FILE = os.path.join(auto_deploy.CACHE_DIR, "artifacts.db")
+    auto_deploy.BUNDLE_CACHE_DIR = os.path.join(auto_deploy.CACHE_DIR, "bundles")
+    auto_deploy.TRANSCODE_CACHE_DIR = os.path.join(auto_deploy.CACHE_DIR, "transcode")
+    auto_deploy.JOURNAL_DIR = os.path.join(auto_deploy.CACHE_DIR, "journal")
+    auto_deploy.GOLDEN_DIR = os.path.join(auto_deploy.CACHE_DIR, "golden")
+    auto_deploy.SERIAL_LOG_DIR = os.path.join(auto_deploy.CACHE_DIR, "serial")
+    auto_deploy.BOOT_PROFILE_FILE = os.path.join(auto_deploy.CACHE_DIR, "boot_profiles.jsonl")
+    # TFTP 服务用本机回环地址和随机端口 (通过 tftpdstp 告知模拟设备)
+    auto_deploy.TFTP_SERVER_IP = "127.0.0.1"
+    auto_deploy.TFTP_PORT = 0
+    # step_4 中的人工确认直接通过
+    auto_deploy.input = lambda prompt="": ""
+
+
+# ================= 测试流程 =================
+def bench_pipeline(boards, workers):
+    """用真实的部署流程跑所有模拟设备, 返回每台设备的结果"""
+    hosts = [b.host for b in boards]
+    steps = auto_deploy.select_pipeline()
+    start = time.time()
+    if len(boards) == 1:
+        p = auto_deploy.DeviceProvisioner(hosts[0], steps, final_reboot=False)
+        ok = p.run(keep_connection=True)
+        provisioners = [p]
+        if ok:
+            t0 = time.time()
+            if auto_deploy.UBOOT_ENV_METHOD == "linux" and not p.uboot_env_fallback:
+                # U-Boot 参数已在系统中写入, 只剩最后一次重启
+                p.session.reboot()
+            else:
+                ok = auto_deploy.step_4_uboot_settings(boards[0].serial_port, host=hosts[0], ssh=p.ssh)
+                p.step_times["uboot_serial"] = time.time() - t0
+                if not ok:
+                    p.state, p.error = auto_deploy.STATE_FAILED, "步骤 uboot_serial 失败"
+                p.ssh.close()
+            # 两种方式都计到设备重新上线为止
+            if ok and auto_deploy.wait_for_device_online(timeout=60, host=hosts[0]):
+                p.step_times["final_boot"] = time.time() - t0
+    else:
+        auto_deploy.run_fleet(hosts, workers, steps=steps)
+        provisioners = None
+    return provisioners, time.time() - start
+
+
+def bench_golden(ref_board, boards, workers):
+    """从已部署的参考设备采集黄金镜像, 再用黄金镜像模式部署一批新设备"""
+    auto_deploy.wait_for_device_online(timeout=60, host=ref_board.host)
+    ssh = auto_deploy.create_ssh_client(ref_board.host)
+    t0 = time.time()
+    try:
+        ok = auto_deploy.capture_golden_image(ssh, ref_board.host)
+    finally:
+        ssh.close()
+    capture_time = time.time() - t0
+    if not ok:
+        return None, capture_time, 0.0
+
+    steps = auto_deploy.select_pipeline(use_golden=True)
+    start = time.time()
+    provisioners = [auto_deploy.DeviceProvisioner(b.host, steps) for b in boards]
+    if len(boards) == 1:
+        provisioners[0].run()
+    else:
+        auto_deploy.run_fleet([b.host for b in boards], workers, steps=steps)
+        provisioners = None
+    return provisioners, capture_time, time.time() - start
+
+
+def _bench_uboot_flash(board, data, work_dir, method, baudrate=None):
+    """重启设备, 在 U-Boot 下烧写一次测试镜像并检查写入内容, 返回耗时 (失败返回 None)"""
+    path = os.path.join(work_dir, "uboot_image.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+    auto_deploy.wait_for_device_online(timeout=60, host=board.host)
+    board.reboot()
+    t0 = time.time()
+    ok = auto_deploy.uboot_flash_images(board.serial_port, [(path, "mmc write {addr} 0x800 {blocks}")],
+                                        method, baudrate, host=board.host)
+    elapsed = time.time() - t0
+    os.remove(path)
+    with open(os.path.join(board.root, "dev/mmcblk0"), "rb") as f:
+        f.seek(0x800 * 512)
+        ok = ok and f.read(len(data)) == data
+    return elapsed if ok else None
+
+
+def bench_serial_flash(board, size_kb, work_dir):
+    """不切换波特率和切换到 SERIAL_LOAD_BAUDRATE 各用串口烧写一次, 返回 [(波特率, 耗时)]"""
+    data = os.urandom(size_kb * 1024)
+    return [(baudrate or auto_deploy.BAUDRATE, _bench_uboot_flash(board, data, work_dir, "serial", baudrate))
+            for baudrate in (None, auto_deploy.SERIAL_LOAD_BAUDRATE)]
+
+
+def bench_tftp_flash(board, size_mb, work_dir):
+    """默认参数 (512 字节块, 无窗口) 和协商的块大小/窗口各用 TFTP 烧写一次, 返回 [(参数, 耗时)]"""
+    data = os.urandom(size_mb * 1024 * 1024)
+    tuned = (auto_deploy.TFTP_BLKSIZE, auto_deploy.TFTP_WINDOWSIZE)
+    results = []
+    for blksize, windowsize in ((512, 1), tuned):
+        auto_deploy.TFTP_BLKSIZE, auto_deploy.TFTP_WINDOWSIZE = blksize, windowsize
+        results.append((f"{blksize}/{windowsize}", _bench_uboot_flash(board, data, work_dir, "tftp")))
+    auto_deploy.TFTP_BLKSIZE, auto_deploy.TFTP_WINDOWSIZE = tuned
+    return results
+
+
+def bench_upload(board, upload_mb, work_dir):
+    """对比 SCP 与多通道 SFTP 的上传吞吐量"""
+    path = os.path.join(work_dir, "upload.bin")
+    with open(path, "wb") as f:
+        for _ in range(upload_mb):
+            f.write(os.urandom(1024 * 1024))
+    ssh = auto_deploy.create_ssh_client(board.host)
+    try:
+        return auto_deploy.benchmark_upload(ssh, path)
+    finally:
+        ssh.close()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="auto_deploy 本地性能测试 (模拟设备)")
+    parser.add_argument("--boards", type=int, default=1, help="模拟设备数量 (>1 时走批量模式)")
+    parser.add_argument("--workers", type=int, default=auto_deploy.FLEET_WORKERS)
+    parser.add_argument("--port", type=int, default=BENCH_SSH_PORT)
+    parser.add_argument("--pkg-mb", type=int, default=16, help="应用安装包中随机数据大小 (MB)")
+    parser.add_argument("--upload-mb", type=int, default=32, help="上传测试文件大小, 0 表示跳过")
+    parser.add_argument("--transfer-format", choices=["auto"] + list(auto_deploy.FORMATS), default="auto",
+                        help="应用安装包的传输格式 (对比不同格式的安装耗时)")
+    parser.add_argument("--uboot-env-method", choices=["linux", "serial"], default=auto_deploy.UBOOT_ENV_METHOD,
+                        help="U-Boot 环境变量的修改方式 (对比在系统中修改与串口修改)")
+    parser.add_argument("--golden", action="store_true",
+                        help="再采集黄金镜像, 并用黄金镜像模式部署同样数量的新设备")
+    parser.add_argument("--serial-flash-kb", type=int, default=0,
+                        help="串口 (loady) 烧写测试镜像大小 (KB), 0 表示跳过")
+    parser.add_argument("--tftp-flash-mb", type=int, default=0,
+                        help="U-Boot 下 TFTP 烧写测试镜像大小 (MB), 0 表示跳过")
+    parser.add_argument("--regen-host-key", action="store_true",
+                        help="模拟设备每次启动重新生成 SSH 主机密钥 (dropbear -R)")
+    parser.add_argument("--boot-profile", action="store_true",
+                        help="步骤 4 之后等待设备启动完成并输出启动耗时分析")
+    parser.add_argument("--json", metavar="FILE", help="结果另存为 JSON")
+    parser.add_argument("--trace", metavar="FILE.jsonl", help="记录每个操作的耗时 (JSONL)")
+    parser.add_argument("--chrome-trace", metavar="FILE.json", help="导出 Chrome trace 时间线")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        print("仅支持 Linux")
+        sys.exit(1)
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    if args.trace or args.chrome_trace:
+        auto_deploy.tracer.open(args.trace)
+
+    work_dir = tempfile.mkdtemp(prefix="adp_bench_")
+    print(f"临时目录: {work_dir}")
+    host_key = paramiko.RSAKey.generate(2048)
+    boards = []
+    report = {}
+    try:
+        make_artifacts(work_dir, args.pkg_mb)
+        configure_auto_deploy(work_dir, args.port)
+        auto_deploy.BOOT_PROFILE_WAIT = args.boot_profile
+        auto_deploy.APP_TRANSFER_FORMAT = args.transfer_format
+        auto_deploy.UBOOT_ENV_METHOD = args.uboot_env_method
+        for i in range(args.boards):
+            board = FakeBoard(f"127.0.0.{i + 2}", args.port, os.path.join(work_dir, f"board{i}"),
+                              host_key, f"02:00:00:00:00:{i + 2:02x}")
+            board.regen_host_key = args.regen_host_key
+            board.power_on()
+            boards.append(board)
+
+        provisioners, wall = bench_pipeline(boards, args.workers)
+        report["wall_time"] = round(wall, 2)
+        report["boards"] = args.boards
+        report["devices_per_hour"] = round(args.boards * 3600 / wall, 1) if wall else 0
+        if auto_deploy._transfer_plan is not None:
+            report["transfer_format"] = auto_deploy._transfer_plan.fmt
+        # 每台设备下次启动时 U-Boot 加载的环境变量是否为目标值
+        report["uboot_env_ok"] = sum(all((b.saved_env() or {}).get(k) == v for k, v in auto_deploy.UBOOT_ENV.items())
+                                     for b in boards)
+        if provisioners:
+            p = provisioners[0]
+            report["state"] = p.state
+            report["error"] = p.error
+            report["step_times"] = {k: round(v, 2) for k, v in p.step_times.items()}
+            report["reconnect_times"] = [round(t, 2) for t in p.reboot_times]
+
+        if args.golden:
+            fresh = []
+            for i in range(args.boards):
+                n = args.boards + i + 2
+                board = FakeBoard(f"127.0.0.{n}", args.port, os.path.join(work_dir, f"golden{i}"),
+                                  host_key, f"02:00:00:00:01:{n:02x}")
+                board.power_on()
+                boards.append(board)
+                fresh.append(board)
+            golden, capture_time, golden_wall = bench_golden(boards[0], fresh, args.workers)
+            report["golden_capture_time"] = round(capture_time, 2)
+            report["golden_wall_time"] = round(golden_wall, 2)
+            if golden:
+                report["golden_state"] = golden[0].state
+                report["golden_step_times"] = {k: round(v, 2) for k, v in golden[0].step_times.items()}
+
+        if args.serial_flash_kb:
+            report["serial_flash"] = [(baud, round(t, 2) if t else None)
+                                      for baud, t in bench_serial_flash(boards[0], args.serial_flash_kb, work_dir)]
+
+        if args.tftp_flash_mb:
+            report["tftp_flash"] = [(opts, round(t, 2) if t else None)
+                                    for opts, t in bench_tftp_flash(boards[0], args.tftp_flash_mb, work_dir)]
+
+        if args.upload_mb:
+            for board in boards:
+                auto_deploy.wait_for_device_online(timeout=60, host=board.host)
+            results = bench_upload(boards[0], args.upload_mb, work_dir)
+            report["upload"] = {name: round(args.upload_mb / max(t, 1e-6), 1) for name, t in results}
+
+        print("\n================= 测试结果 =================")
+        print(f"设备数: {args.boards}  总耗时: {report['wall_time']}s  吞吐量: {report['devices_per_hour']} 台/小时")
+        if "step_times" in report:
+            print(f"状态: {report['state']} {report['error'] or ''}")
+            for name, t in report["step_times"].items():
+                print(f"  {name:<16} {t:>7.2f}s")
+            print(f"  重连耗时: {report['reconnect_times']}")
+        if "transfer_format" in report:
+            print(f"安装包传输格式: {report['transfer_format']}")
+        print(f"U-Boot 参数 ({args.uboot_env_method}): {report['uboot_env_ok']}/{args.boards} 台已是目标值")
+        if "golden_wall_time" in report:
+            print(f"黄金镜像: 采集 {report['golden_capture_time']}s  部署 {args.boards} 台 {report['golden_wall_time']}s "
+                  f"{report.get('golden_state', '')}")
+            for name, t in report.get("golden_step_times", {}).items():
+                print(f"  {name:<16} {t:>7.2f}s")
+        if args.boot_profile:
+            print("启动耗时:")
+            auto_deploy.print_boot_report(auto_deploy.BOOT_PROFILE_FILE)
+        for baud, t in report.get("serial_flash", []):
+            result = f"{t:>7.2f}s  {args.serial_flash_kb / t:.1f} KB/s" if t else "失败"
+            print(f"  串口烧写 {args.serial_flash_kb}KB @ {baud:<7} {result}")
+        for opts, t in report.get("tftp_flash", []):
+            result = f"{t:>7.2f}s" if t else "失败"
+            print(f"  TFTP 烧写 {args.tftp_flash_mb}MB 块大小/窗口 {opts:<8} {result}")
+        for name, mbps in report.get("upload", {}).items():
+            print(f"  上传 {name:<18} {mbps:>7.1f} MB/s")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1, ensure_ascii=False)
+    finally:
+        if args.trace or args.chrome_trace:
+            auto_deploy.finish_trace(args.chrome_trace)
+        for board in boards:
+            board.close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""
+串口启动日志与启动耗时分析
+
+SerialLog: 串口原始数据加时间戳写入压缩日志 (按大小轮转)
+BootProfiler: 从日志行中识别启动阶段 (U-Boot / 内核 / init / sshd), 计算各阶段耗时
+
+单独运行可分析已保存的日志或启动耗时记录:
+  python boot_log.py analyze .deploy_cache/serial/*.log.gz
+  python boot_log.py report .deploy_cache/boot_profiles.jsonl
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+import collections
+
+
+# ================= 串口日志配置 =================
+# 预分配的接收缓冲区大小 (字节), 日志写入线程跟不上时丢弃最旧的未写入数据
+CAPTURE_BUFFER_SIZE = 4 * 1024 * 1024
+# 单个日志文件 (压缩前) 超过该大小后轮转
+LOG_ROTATE_BYTES = 16 * 1024 * 1024
+# 每块板子最多保留的日志文件数
+LOG_KEEP_FILES = 20
+# gzip 压缩级别
+LOG_COMPRESS_LEVEL = 6
+# 日志落盘间隔 (秒), 空闲超过该时间时未换行的内容也会写出
+LOG_FLUSH_INTERVAL = 1.0
+# 单行最大长度, 超过后强制换行
+LOG_MAX_LINE = 4096
+
+# 启动阶段: (名称, 匹配的串口输出), 按启动顺序排列
+BOOT_PHASES = [
+    ("uboot", re.compile(rb"U-Boot (SPL )?\d{4}\.\d\d")),
+    ("autoboot", re.compile(rb"Hit any key|stop autoboot", re.IGNORECASE)),
+    ("kernel", re.compile(rb"Starting kernel")),
+    ("init", re.compile(rb"Freeing unused kernel|Run /\S*init|init started")),
+    ("sshd", re.compile(rb"Starting (sshd|dropbear)|sshd.*(listening|OK)")),
+    ("login", re.compile(rb"login:|Welcome to")),
+]
+# 串口上表示启动完成的输出
+BOOT_DONE_PATTERN = re.compile(rb"login:|Welcome to")
+# 各阶段耗时: (键, 显示名称, 起点, 终点)
+# reset: 发送 reset 的时刻; ssh: 主机上检测到 SSH 端口可连接的时刻
+BOOT_INTERVALS = [
+    ("reset", "复位", "reset", "uboot"),
+    ("uboot", "U-Boot", "uboot", "autoboot"),
+    ("bootdelay", "倒计时/加载内核", "autoboot", "kernel"),
+    ("kernel", "内核", "kernel", "init"),
+    ("userspace", "用户态", "init", "sshd"),
+    ("ssh", "SSH 可连接", "sshd", "ssh"),
+]
+# 启动总耗时的终点, 按优先级
+BOOT_END_MARKS = ["ssh", "sshd", "login"]
+# 启动总耗时超过所有板子中位数的该倍数时标记为慢
+BOOT_SLOW_FACTOR = 1.3
+# ======================================================
+
+_LINE_RE = re.compile(rb"^\[\s*(\d+\.\d+)\] ?(.*)$")
+_HEADER_RE = re.compile(rb"^# .* start=(\d+\.\d+)")
+
+
+class SerialLog:
+    """
+    串口原始数据日志
+    读串口的线程只把数据拷贝进预分配的环形缓冲区并记下到达时间, 不做任何 I/O;
+    后台线程按行加时间戳 (相对开始时间的秒数) 写入 gzip 日志, 超过大小后轮转
+    on_line(时间, 行): 每写出一行调用一次 (在后台线程中), 用于启动阶段分析
+    """
+
+    def __init__(self, directory, name, on_line=None, buffer_size=CAPTURE_BUFFER_SIZE,
+                 rotate_bytes=LOG_ROTATE_BYTES, keep=LOG_KEEP_FILES):
+        self.directory = directory
+        self.name = re.sub(r"[^\w.-]", "_", name)
+        self.on_line = on_line
+        self.rotate_bytes = rotate_bytes
+        self.keep = keep
+
+        self.ring = bytearray(buffer_size)
+        self.size = buffer_size
+        # head / tail 为累计字节数: [tail, head) 是还没写入日志的数据
+        self.head = 0
+        self.tail = 0
+        # (累计偏移, 到达时间), 每次 feed 一条
+        self.stamps = collections.deque()
+        self.dropped = 0
+        self.cond = threading.Condition()
+        self.closed = False
+
+        self.start = time.time()
+        self.file = None
+        self.file_bytes = 0
+        self.files = []
+        self.partial = None
+        self.last_flush = self.start
+        self.thread = threading.Thread(target=self._writer, name=f"serial-log-{self.name}", daemon=True)
+        self.thread.start()
+
+    # ---------------- 接收 (串口读取线程) ----------------
+    def feed(self, data, t=None):
+        """记录一段收到的数据, 可直接作为 SerialExpect 的 on_data 回调"""
+        n = len(data)
+        if not n:
+            return
+        if t is None:
+            t = time.time()
+        with self.cond:
+            if n >= self.size:
+                # 单次数据比整个缓冲区还大, 只保留最后一段
+                self.dropped += self.head - self.tail + n - self.size
+                self.head += n - self.size
+                self.tail = self.head
+                data = data[n - self.size:]
+                n = self.size
+            overflow = self.head + n - self.tail - self.size
+            if overflow > 0:
+                self.tail += overflow
+                self.dropped += overflow
+            pos = self.head % self.size
+            first = min(n, self.size - pos)
+            self.ring[pos:pos + first] = data[:first]
+            if first < n:
+                self.ring[:n - first] = data[first:]
+            self.stamps.append((self.head, t))
+            self.head += n
+            self.cond.notify()
+
+    def _take(self):
+        """取出所有未写入的数据, 返回 ([(时间, 数据), ...], 丢弃字节数); 空闲超时返回 ([], 0)"""
+        with self.cond:
+            if self.head == self.tail and not self.closed:
+                self.cond.wait(LOG_FLUSH_INTERVAL)
+            start, end = self.tail, self.head
+            if start == end:
+                return [], 0
+            pos = start % self.size
+            length = end - start
+            first = min(length, self.size - pos)
+            data = bytes(self.ring[pos:pos + first]) + bytes(self.ring[:length - first])
+            stamps = []
+            while self.stamps and self.stamps[0][0] < end:
+                stamps.append(self.stamps.popleft())
+            dropped, self.dropped = self.dropped, 0
+            self.tail = end
+
+        # 开头的数据可能已被覆盖, 取覆盖位置之前最后一个时间戳
+        while len(stamps) > 1 and stamps[1][0] <= start:
+            stamps.pop(0)
+        segments = []
+        for i, (offset, t) in enumerate(stamps):
+            seg_end = stamps[i + 1][0] if i + 1 < len(stamps) else end
+            segments.append((t, data[max(offset, start) - start:seg_end - start]))
+        return segments, dropped
+
+    # ---------------- 写入 (后台线程) ----------------
+    def _writer(self):
+        while True:
+            segments, dropped = self._take()
+            if dropped:
+                self._end_partial()
+                self._emit(segments[0][0], f"(丢弃 {dropped} 字节, 日志写入跟不上串口速度)".encode('utf-8'))
+            for t, chunk in segments:
+                self._write_chunk(t, chunk)
+
+            now = time.time()
+            if not segments or now - self.last_flush >= LOG_FLUSH_INTERVAL:
+                if not segments:
+                    # 空闲: 提示符等没有换行的内容也写出
+                    self._end_partial()
+                if self.file is not None:
+                    self.file.flush()
+                self.last_flush = now
+            if self.closed and not segments:
+                break
+
+        self._end_partial()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write_chunk(self, t, chunk):
+        pos = 0
+        while pos < len(chunk):
+            if self.partial is None:
+                self.partial = (t, bytearray())
+            nl = chunk.find(b"\n", pos)
+            if nl < 0:
+                self.partial[1].extend(chunk[pos:])
+                if len(self.partial[1]) >= LOG_MAX_LINE:
+                    self._end_partial()
+                return
+            self.partial[1].extend(chunk[pos:nl])
+            self._end_partial()
+            pos = nl + 1
+
+    def _end_partial(self):
+        if self.partial is not None:
+            t, line = self.partial
+            self.partial = None
+            self._emit(t, bytes(line))
+
+    def _emit(self, t, line):
+        line = line.replace(b"\r", b"")
+        if self.file is None:
+            self._open_file()
+        record = f"[{t - self.start:12.6f}] ".encode() + line + b"\n"
+        self.file.write(record)
+        self.file_bytes += len(record)
+        if self.on_line is not None:
+            try:
+                self.on_line(t, line)
+            except Exception:
+                pass
+        if self.file_bytes >= self.rotate_bytes:
+            self.file.close()
+            self.file = None
+
+    def _open_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.name}-{stamp}-{len(self.files):03d}.log.gz")
+        self.file = gzip.open(path, 'wb', compresslevel=LOG_COMPRESS_LEVEL)
+        header = f"# {self.name} start={self.start:.6f} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start))}\n"
+        self.file.write(header.encode('utf-8'))
+        self.file_bytes = 0
+        self.files.append(path)
+        self._remove_old_files()
+
+    def _remove_old_files(self):
+        prefix = self.name + "-"
+        try:
+            names = sorted(n for n in os.listdir(self.directory)
+                           if n.startswith(prefix) and n.endswith(".log.gz"))
+        except OSError:
+            return
+        for name in names[:max(len(names) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def close(self):
+        """写出剩余数据并关闭日志文件"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+# ================= 启动阶段分析 =================
+class BootProfiler:
+    """
+    根据串口输出识别每次启动的各阶段时刻
+    每次 reset 或出现 U-Boot 启动信息时开始一条新的启动记录, 每个阶段只记录第一次出现的时刻
+    """
+
+    def __init__(self, phases=BOOT_PHASES):
+        self.phases = phases
+        self.boots = []
+        self.lock = threading.Lock()
+
+    def _current(self, new_boot=False):
+        if new_boot or not self.boots:
+            self.boots.append({})
+        return self.boots[-1]
+
+    def feed_line(self, t, line):
+        """处理一行串口输出, 可直接作为 SerialLog 的 on_line 回调"""
+        for name, regex in self.phases:
+            if regex.search(line):
+                self.mark(name, t)
+
+    def mark(self, name, t=None):
+        """记录一个阶段的时刻 (也用于 reset / ssh 等主机侧事件)"""
+        if t is None:
+            t = time.time()
+        with self.lock:
+            boot = self.boots[-1] if self.boots else None
+            # reset 总是开始新的启动; U-Boot 信息在本次启动已出现过 U-Boot 时才开始新的启动
+            new_boot = boot is None or name == "reset" or (name == "uboot" and "uboot" in boot)
+            boot = self._current(new_boot)
+            boot.setdefault(name, t)
+
+    def last_boot(self):
+        """最近一次进入内核的启动记录 (被拦截在 U-Boot 的启动不算), 没有返回 None"""
+        with self.lock:
+            for boot in reversed(self.boots):
+                if "kernel" in boot:
+                    return dict(boot)
+        return None
+
+
+def boot_intervals(marks):
+    """
+    由阶段时刻计算各阶段耗时 (秒), 返回有序字典
+    'total' 为 U-Boot 开始 (没有则为最早的时刻) 到启动完成的耗时
+    """
+    result = collections.OrderedDict()
+    for key, _, begin, end in BOOT_INTERVALS:
+        if begin in marks and end in marks:
+            result[key] = marks[end] - marks[begin]
+    start = marks.get("uboot", min(marks.values()) if marks else None)
+    for name in BOOT_END_MARKS:
+        if name in marks and start is not None:
+            result["total"] = marks[name] - start
+            break
+    return result
+
+
+def format_intervals(intervals):
+    labels = {key: label for key, label, _, _ in BOOT_INTERVALS}
+    labels["total"] = "总计"
+    return "  ".join(f"{labels.get(k, k)} {v:.2f}s" for k, v in intervals.items())
+
+
+# ================= 启动耗时记录 =================
+def append_profile(path, board, marks):
+    """把一次启动的耗时追加到 JSONL 记录文件, 返回各阶段耗时"""
+    intervals = boot_intervals(marks)
+    start = min(marks.values())
+    record = {
+        "board": board,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+        "marks": {k: round(v - start, 3) for k, v in sorted(marks.items(), key=lambda kv: kv[1])},
+        "intervals": {k: round(v, 3) for k, v in intervals.items()},
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return intervals
+
+
+def load_profiles(path):
+    records = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def print_boot_report(path, slow_factor=BOOT_SLOW_FACTOR):
+    """按板子汇总启动耗时 (各阶段平均值), 启动总耗时明显高于其他板子的标记为慢"""
+    records = load_profiles(path)
+    if not records:
+        print(f"没有启动耗时记录: {path}")
+        return
+    boards = collections.OrderedDict()
+    for r in records:
+        boards.setdefault(r["board"], []).append(r["intervals"])
+
+    keys = [key for key, _, _, _ in BOOT_INTERVALS] + ["total"]
+    keys = [k for k in keys if any(k in iv for ivs in boards.values() for iv in ivs)]
+    averages = {}
+    for board, ivs in boards.items():
+        averages[board] = {k: sum(iv[k] for iv in ivs if k in iv) / max(sum(1 for iv in ivs if k in iv), 1)
+                           for k in keys if any(k in iv for iv in ivs)}
+    totals = [a["total"] for a in averages.values() if "total" in a]
+    median = _median(totals) if totals else None
+
+    labels = {key: label for key, label, _, _ in BOOT_INTERVALS}
+    labels["total"] = "总计"
+    print(f"{'板子':<20} {'次数':>4} " + " ".join(f"{labels[k]:>10}" for k in keys))
+    for board, avg in averages.items():
+        cells = " ".join(f"{avg[k]:>9.2f}s" if k in avg else f"{'-':>10}" for k in keys)
+        slow = median is not None and avg.get("total", 0) > median * slow_factor
+        print(f"{board:<20} {len(boards[board]):>4} {cells}{'  <- 偏慢' if slow else ''}")
+    if median is not None:
+        print(f"启动总耗时中位数: {median:.2f}s")
+
+
+# ================= 离线分析 =================
+def read_log(path):
+    """读取 SerialLog 写出的日志, 逐行返回 (绝对时间, 行内容)"""
+    start = 0.0
+    with gzip.open(path, 'rb') as f:
+        for raw in f:
+            raw = raw.rstrip(b"\n")
+            m = _HEADER_RE.match(raw)
+            if m:
+                start = float(m.group(1))
+                continue
+            m = _LINE_RE.match(raw)
+            if m:
+                yield start + float(m.group(1)), m.group(2)
+
+
+def analyze_logs(paths):
+    """分析日志文件中的每次启动, 返回 [阶段时刻字典, ...]"""
+    profiler = BootProfiler()
+    for path in sorted(paths):
+        for t, line in read_log(path):
+            profiler.feed_line(t, line)
+    return profiler.boots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="串口启动日志分析")
+    sub = parser.add_subparsers(dest="command")
+    # add_subparsers(required=...) 需要 Python 3.7
+    sub.required = True
+    p = sub.add_parser("analyze", help="分析串口日志中每次启动的各阶段耗时")
+    p.add_argument("logs", nargs="+", metavar="LOG.gz")
+    p = sub.add_parser("report", help="按板子汇总启动耗时记录")
+    p.add_argument("profiles", metavar="FILE.jsonl")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_boot_report(args.profiles)
+        return
+    for i, marks in enumerate(analyze_logs(args.logs), 1):
+        start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(min(marks.values())))
+        print(f"启动 {i} ({start}): {format_intervals(boot_intervals(marks)) or '(没有完整的阶段)'}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,22 @@
-import win32gui
-import win32con
-import win32api
-import pyautogui
+import argparse
+import queue
+import shlex
+import subprocess
+import threading
 import time
 import sys
 
+import serial.tools.list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+try:
+    import win32gui
+    import win32con
+    import pyautogui
+except ImportError:
+    # 非 Windows 环境只能使用 cmd / fake 后端
+    win32gui = None
+
 # ================= 配置区域 =================
 # 1. 填入校准好的坐标偏移量 (必须填!)
 OFFSET_X = 170    # <--- 替换这里 (例如 850)
@@ -12,6 +24,21 @@ OFFSET_Y = 348    # <--- 替换这里 (例如 420)
 
 # 2. 窗口标题关键词 (越准越好)
 WINDOW_TITLE_KEY = "ToolPlatform" 
+
+# 3. 触发烧录的方式: click (点击烧录软件按钮) / cmd (执行命令行) / fake (仅打印, 用于测试)
+BURN_BACKEND = "click"
+# cmd 后端执行的命令, {port} 替换为新插入板子的串口, 例如 "burn_tool.exe --port {port}"
+BURN_COMMAND = None
+
+# 4. 插板检测
+# 串口列表的轮询间隔 (秒)
+PORT_POLL_INTERVAL = 0.2
+# 只响应描述/硬件 ID 中包含该关键词的串口 (例如 "CP210" 或 "VID:PID=10C4:EA60"), None 表示任意新串口
+PORT_FILTER = None
+# 检测到新串口后等待驱动就绪的时间 (秒)
+PORT_SETTLE_TIME = 0.3
+# 两次触发之间的最小间隔, 防止连点 (秒)
+BURN_COOLDOWN = 1.0
 # ===========================================
 
 def find_window_hwnd(keyword):
@@ -47,11 +74,206 @@ def activate_window(hwnd):
     except Exception:
         pass
 
-def auto_burn_instant():
-    if OFFSET_X == 0 and OFFSET_Y == 0:
-        print("❌ 错误：请填入 OFFSET_X 和 OFFSET_Y！(也就是您第一步测出来的坐标)")
-        return
 
+# ================= 触发后端 =================
+class ClickBackend:
+    """
+    点击烧录软件中的按钮
+    窗口句柄缓存起来重复使用, 只在窗口关闭或标题不符时重新 EnumWindows
+    """
+
+    name = "click"
+
+    def __init__(self, keyword=WINDOW_TITLE_KEY, offset=(OFFSET_X, OFFSET_Y)):
+        if win32gui is None:
+            raise RuntimeError("click 后端需要 Windows 及 pywin32 / pyautogui")
+        # 手动和插板两种模式都经过这里, 未校准时不能点击
+        if offset == (0, 0):
+            raise RuntimeError("错误：请填入 OFFSET_X 和 OFFSET_Y！(也就是您第一步测出来的坐标)")
+        self.keyword = keyword
+        self.offset = offset
+        self.hwnd = None
+
+    def _window(self):
+        hwnd = self.hwnd
+        if hwnd and win32gui.IsWindow(hwnd) and \
+                self.keyword.lower() in win32gui.GetWindowText(hwnd).lower():
+            return hwnd
+        self.hwnd, _ = find_window_hwnd(self.keyword)
+        return self.hwnd
+
+    def burn(self, port=None):
+        hwnd = self._window()
+        if not hwnd:
+            print("❌ 找不到窗口，请检查软件是否打开！")
+            return False
+
+        activate_window(hwnd)
+
+        # 窗口可能被移动过, 每次都取当前的绝对坐标 (Left, Top, Right, Bottom)
+        window_left, window_top = win32gui.GetWindowRect(hwnd)[:2]
+        pyautogui.click(window_left + self.offset[0], window_top + self.offset[1])
+        print(f"✅ 已点击! (窗口位置: {window_left},{window_top})")
+        return True
+
+
+class CommandBackend:
+    """执行命令行烧录工具, 命令中的 {port} 替换为板子的串口"""
+
+    name = "cmd"
+
+    def __init__(self, command=BURN_COMMAND):
+        if not command:
+            raise RuntimeError("cmd 后端需要设置 BURN_COMMAND 或 --cmd")
+        self.command = command
+
+    def burn(self, port=None):
+        cmd = self.command.format(port=port or "")
+        result = subprocess.run(shlex.split(cmd, posix=(sys.platform != "win32")))
+        if result.returncode != 0:
+            print(f"❌ 烧录命令失败 (返回码 {result.returncode}): {cmd}")
+            return False
+        print(f"✅ 烧录命令完成: {cmd}")
+        return True
+
+
+class FakeBackend:
+    """只记录触发, 不做任何操作 (在 Linux 上测试检测和队列)"""
+
+    name = "fake"
+
+    def __init__(self, burn_time=0.0):
+        self.burn_time = burn_time
+        self.burned = []
+
+    def burn(self, port=None):
+        time.sleep(self.burn_time)
+        self.burned.append(port)
+        print(f"✅ [fake] 触发烧录: {port}")
+        return True
+
+
+def make_backend(name, command=None):
+    if name == "click":
+        return ClickBackend()
+    if name == "cmd":
+        return CommandBackend(command or BURN_COMMAND)
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"未知的后端: {name}")
+
+
+# ================= 插板检测 =================
+def _port_matches(port, keyword):
+    if not keyword:
+        return True
+    text = f"{port.device} {port.description} {port.hwid}".lower()
+    return keyword.lower() in text
+
+
+class PortWatcher:
+    """
+    轮询串口列表, 与上一次的结果比较, 新出现的串口放入队列
+    拔出后再插入会再次触发; 启动时已存在的串口不触发
+    """
+
+    def __init__(self, arrivals, keyword=PORT_FILTER, interval=PORT_POLL_INTERVAL,
+                 list_ports=serial.tools.list_ports.comports):
+        self.arrivals = arrivals
+        self.keyword = keyword
+        self.interval = interval
+        self.list_ports = list_ports
+        self.known = set()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _snapshot(self):
+        return {p.device: p for p in self.list_ports() if _port_matches(p, self.keyword)}
+
+    def poll(self):
+        """比较一次串口列表, 返回新出现的串口"""
+        current = self._snapshot()
+        new = [current[d] for d in sorted(set(current) - self.known)]
+        self.known = set(current)
+        for port in new:
+            self.arrivals.put((time.time(), port.device))
+        return new
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️ 读取串口列表失败: {e}")
+
+    def start(self):
+        self.known = set(self._snapshot())
+        self.thread = threading.Thread(target=self._loop, name="port-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+
+def run_burn_queue(arrivals, backend, settle=PORT_SETTLE_TIME, cooldown=BURN_COOLDOWN,
+                   stop_event=None):
+    """
+    依次处理队列中的插板事件并触发烧录, 返回 (成功数, 失败数)
+    stop_event 置位后处理完已排队的事件即返回
+    """
+    ok_count = fail_count = 0
+    start = time.time()
+    last_burn = 0.0
+    while True:
+        try:
+            arrived, device = arrivals.get(timeout=0.2)
+        except queue.Empty:
+            if stop_event is not None and stop_event.is_set():
+                return ok_count, fail_count
+            continue
+
+        # 等待驱动就绪, 并与上一次触发保持最小间隔
+        wait = max(arrived + settle, last_burn + cooldown) - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        print(f"\n🔌 检测到板子: {device} (排队 {arrivals.qsize()} 个)")
+        try:
+            ok = backend.burn(device)
+        except Exception as e:
+            print(f"⚠️ 发生错误: {e}")
+            ok = False
+        last_burn = time.time()
+        if ok:
+            ok_count += 1
+        else:
+            fail_count += 1
+        elapsed = time.time() - start
+        print(f"   已触发 {ok_count} 块，失败 {fail_count} 块，约 {ok_count * 3600 / max(elapsed, 1e-6):.0f} 块/小时")
+
+
+def auto_burn_hotplug(backend, keyword=PORT_FILTER):
+    """插板自动触发: 操作员只需依次插入板子"""
+    arrivals = queue.Queue()
+    watcher = PortWatcher(arrivals, keyword)
+    watcher.start()
+
+    print(f"⚡ 插板自动触发已启动 | 后端: {backend.name} | 过滤: {keyword or '任意串口'}")
+    print("------------------------------------------------")
+    print(f"当前串口: {', '.join(sorted(watcher.known)) or '(无)'}")
+    print("插入板子即可自动烧录，Ctrl+C 退出")
+
+    try:
+        run_burn_queue(arrivals, backend)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+
+
+def auto_burn_instant(backend=None):
+    backend = backend or ClickBackend()
     print(f"⚡ 光速版脚本已启动 | 目标: {WINDOW_TITLE_KEY}")
     print("------------------------------------------------")
     print("不用等待连接，直接按回车即可！")
@@ -62,35 +284,61 @@ def auto_burn_instant():
             cmd = input("\n👉 请插板子并按回车 (q退出): ")
             if cmd.lower() == 'q': break
 
-            # 2. 毫秒级查找窗口
-            hwnd, title = find_window_hwnd(WINDOW_TITLE_KEY)
-            
-            if not hwnd:
-                print("❌ 找不到窗口，请检查软件是否打开！")
-                continue
-
-            # 3. 激活窗口
-            activate_window(hwnd)
-            
-            # 4. 获取窗口当前的绝对坐标 (Left, Top, Right, Bottom)
-            rect = win32gui.GetWindowRect(hwnd)
-            window_left, window_top = rect[0], rect[1]
-
-            # 5. 计算点击位置
-            click_x = window_left + OFFSET_X
-            click_y = window_top + OFFSET_Y
-
-            # 6. 执行点击
-            pyautogui.click(click_x, click_y)
-            print(f"✅ 已点击! (窗口位置: {window_left},{window_top})")
-            
-            # 7. 防抖延时
-            time.sleep(1) # 稍微等一下，防止连点
+            # 2. 触发烧录 (窗口句柄已缓存, 无需每次查找)
+            backend.burn()
+
+            # 3. 防抖延时
+            time.sleep(BURN_COOLDOWN) # 稍微等一下，防止连点
 
         except KeyboardInterrupt:
             sys.exit()
         except Exception as e:
             print(f"⚠️ 发生错误: {e}")
 
+def self_test():
+    """
+    不接硬件检查插板检测: 模拟插入一个新串口, 应恰好排队并触发一次烧录
+    (启动时已存在的串口和之后的重复轮询都不应触发)
+    """
+    ports = [ListPortInfo("COM1", skip_link_detection=True)]
+    arrivals = queue.Queue()
+    watcher = PortWatcher(arrivals, keyword=None, interval=0.01, list_ports=lambda: list(ports))
+    watcher.start()
+    ports.append(ListPortInfo("COM7", skip_link_detection=True))
+    time.sleep(0.2)
+    watcher.stop()
+
+    backend = FakeBackend()
+    stop_event = threading.Event()
+    stop_event.set()
+    run_burn_queue(arrivals, backend, settle=0, cooldown=0, stop_event=stop_event)
+    if backend.burned != ["COM7"]:
+        print(f"❌ 自检失败: 期望触发 ['COM7']，实际 {backend.burned}")
+        return False
+    print("✅ 自检通过: 插入一块板子触发一次烧录")
+    return True
+
+
 if __name__ == "__main__":
-    auto_burn_instant()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="烧录软件自动触发")
+    parser.add_argument("--manual", action="store_true", help="手动模式: 插板后按回车触发 (原方式)")
+    parser.add_argument("--backend", choices=["click", "cmd", "fake"], default=BURN_BACKEND)
+    parser.add_argument("--cmd", metavar="COMMAND", help="cmd 后端执行的命令, 支持 {port}")
+    parser.add_argument("--filter", metavar="KEYWORD", default=PORT_FILTER,
+                        help="只响应描述/硬件 ID 中包含该关键词的串口")
+    parser.add_argument("--selftest", action="store_true", help="不接硬件, 用模拟串口检查插板检测和队列")
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if self_test() else 1)
+
+    try:
+        burn_backend = make_backend(args.backend, args.cmd)
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.manual:
+        auto_burn_instant(burn_backend)
+    else:
+        auto_burn_hotplug(burn_backend, args.filter)
@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import threading
+import itertools
+
+
+# ================= 进度显示配置 =================
+# 终端刷新帧率 (每秒最多重绘次数)
+RENDER_FPS = 10
+# 非终端输出 (重定向到文件/管道) 时, 进度行的最小间隔 (秒)
+LOG_INTERVAL = 5.0
+# ======================================================
+
+_SPINNER_CHARS = ['|', '/', '-', '\\']
+
+
+def _enable_vt_mode(stream):
+    """Windows 控制台需要显式开启 ANSI 转义序列支持, 失败返回 False"""
+    if os.name != 'nt':
+        return True
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except Exception:
+        return False
+
+
+def _format_size(n):
+    return f"{n / 1048576:.1f}MB"
+
+
+class Task:
+    """一个正在进行的任务 (一行进度)"""
+
+    def __init__(self, renderer, label, total=None, quiet=False):
+        self.renderer = renderer
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.status = ''
+        self.quiet = quiet
+        self.start = time.time()
+        self.last_log = self.start
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    def update(self, done=None, advance=0, total=None, status=None, label=None):
+        """更新进度: done 为已完成量, advance 为增量 (可在多个线程中调用)"""
+        with self.renderer.lock:
+            if total is not None:
+                self.total = total
+            if done is not None:
+                self.done = done
+            self.done += advance
+            if status is not None:
+                self.status = status
+            if label is not None:
+                self.label = label
+        self.renderer._touch(self)
+
+    def reset_progress(self):
+        with self.renderer.lock:
+            self.total = None
+            self.done = 0
+            self.status = ''
+
+    def render(self, spin):
+        parts = [f"{spin} {self.label}"]
+        if self.total:
+            pct = min(self.done * 100.0 / self.total, 100.0)
+            rate = self.done / 1048576 / max(self.elapsed, 1e-6)
+            parts.append(f"{pct:5.1f}% {_format_size(self.done)}/{_format_size(self.total)} {rate:.1f}MB/s")
+        if self.status:
+            parts.append(self.status)
+        parts.append(f"{self.elapsed:.0f}s")
+        return "  ".join(parts)
+
+    def finish(self, message=None):
+        self.renderer._finish(self, message)
+
+
+class _RendererStdout:
+    """
+    替换 sys.stdout, 使普通 print 输出显示在进度区域上方, 不被重绘覆盖
+    """
+
+    def __init__(self, renderer, real):
+        self.renderer = renderer
+        self.real = real
+        self.pending = ''
+
+    def write(self, text):
+        with self.renderer.lock:
+            self.pending += text
+            if '\n' in self.pending:
+                lines, self.pending = self.pending.rsplit('\n', 1)
+                self.renderer._write_above(lines + '\n')
+        return len(text)
+
+    def flush(self):
+        # 不带换行的内容 (例如 input 提示) 立即输出, 在换行前暂停重绘
+        with self.renderer.lock:
+            if self.pending:
+                self.renderer._write_above(self.pending)
+                self.renderer.partial_line = True
+                self.pending = ''
+            self.real.flush()
+
+    def isatty(self):
+        return self.real.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+class ProgressRenderer:
+    """
+    统一的进度显示: 一个后台线程按固定帧率绘制所有进行中的任务
+    stdout 不是终端时不启动线程, 改为逐行输出任务开始/结束和定期进度
+    """
+
+    def __init__(self, stream=None, fps=RENDER_FPS):
+        self.real = stream or sys.stdout
+        self.interval = 1.0 / fps
+        self.lock = threading.RLock()
+        self.tasks = []
+        self.drawn_lines = 0
+        self.partial_line = False
+        self.thread = None
+        self.spinner = itertools.cycle(_SPINNER_CHARS)
+        self.interactive = (hasattr(self.real, 'isatty') and self.real.isatty()
+                            and _enable_vt_mode(self.real))
+        self.wrapper = None
+
+    # ---------------- 任务管理 ----------------
+    def add_task(self, label, total=None, quiet=False):
+        task = Task(self, label, total, quiet)
+        with self.lock:
+            self.tasks.append(task)
+            if self.interactive:
+                self._ensure_thread()
+            elif not quiet:
+                self._log(f"... {label}")
+        return task
+
+    def _touch(self, task):
+        if self.interactive or not task.total:
+            return
+        now = time.time()
+        if now - task.last_log >= LOG_INTERVAL:
+            task.last_log = now
+            with self.lock:
+                self._log("   " + task.render('>'))
+
+    def _finish(self, task, message):
+        with self.lock:
+            if task in self.tasks:
+                self.tasks.remove(task)
+            if message:
+                if self.interactive:
+                    self._write_above(message + '\n')
+                else:
+                    self._log(message)
+            elif self.interactive:
+                self._redraw()
+
+    # ---------------- 输出 ----------------
+    def _log(self, line):
+        self.real.write(line + '\n')
+        self.real.flush()
+
+    def _erase(self):
+        if self.drawn_lines:
+            # 光标移到进度区域第一行并清除到屏幕末尾
+            self.real.write(f"\x1b[{self.drawn_lines}F\x1b[J")
+            self.drawn_lines = 0
+
+    def _write_above(self, text):
+        self._erase()
+        self.real.write(text)
+        if text.endswith('\n'):
+            self.partial_line = False
+        self._redraw()
+
+    def _redraw(self):
+        if self.partial_line:
+            self.real.flush()
+            return
+        self._erase()
+        spin = next(self.spinner)
+        for task in self.tasks:
+            self.real.write("\x1b[2K" + task.render(spin) + "\n")
+        self.drawn_lines = len(self.tasks)
+        self.real.flush()
+
+    def _ensure_thread(self):
+        if self.wrapper is None:
+            self.wrapper = _RendererStdout(self, self.real)
+            sys.stdout = self.wrapper
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, name='progress', daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                if not self.tasks:
+                    self._redraw()
+                    self.thread = None
+                    return
+                self._redraw()
+            time.sleep(self.interval)
+
+
+renderer = ProgressRenderer()
+
+# 每个线程当前最内层的任务, 供上传等底层函数上报进度
+_local = threading.local()
+
+
+def current_task():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def push_task(task):
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(task)
+
+
+def pop_task(task):
+    stack = getattr(_local, 'stack', [])
+    if task in stack:
+        stack.remove(task)
+
+
+def report_progress(done=None, advance=0, total=None):
+    """更新当前线程最内层任务的进度 (没有任务时忽略)"""
+    task = current_task()
+    if task is not None:
+        task.update(done=done, advance=advance, total=total)
@@ -0,0 +1,277 @@
+import re
+import time
+import zlib
+
+from ymodem import ymodem_send, YModemError, CAN
+
+
+# ================= 串口匹配配置 =================
+# 滚动缓冲区上限 (字节), 超出后丢弃最早的数据
+EXPECT_BUFFER_SIZE = 64 * 1024
+
+# U-Boot 倒计时提示
+AUTOBOOT_PATTERN = re.compile(rb"stop autoboot|hit any key", re.IGNORECASE)
+# U-Boot 提示符, 例如 "hisilicon # "
+# 只用于进入命令行时识别; 之后按 intercept_uboot 记下的完整提示符匹配,
+# 否则 tftp 的 "Loading: ####"、mmc write 的 "dev # 0, block # ..." 这类输出也会被当成提示符
+UBOOT_PROMPT = re.compile(rb"[\r\n][^\r\n]*# ?$")
+# U-Boot 命令输出中表示失败的内容
+UBOOT_ERROR_PATTERN = re.compile(
+    rb"Unknown command|## Error|Usage:|failed|error:|not supported", re.IGNORECASE)
+# 单条 U-Boot 命令的默认超时 (秒)
+UBOOT_CMD_TIMEOUT = 10
+# loady 切换波特率时的提示, 例如 "## Switch baudrate to 921600 bps and press ENTER ..."
+LOADY_SWITCH_PATTERN = re.compile(rb"Switch baudrate to \d+ bps and press (ENTER|ESC)")
+LOADY_READY_PATTERN = re.compile(rb"Ready for binary \(ymodem\) download[^\n]*\n")
+LOADY_SIZE_PATTERN = re.compile(rb"Total Size\s*=\s*0x[0-9a-fA-F]+\s*=\s*(\d+) Bytes")
+# tftp 完成时的输出, 例如 "Bytes transferred = 1048576 (100000 hex)"
+TFTP_SIZE_PATTERN = re.compile(r"Bytes transferred = (\d+)")
+# U-Boot 切换波特率前后各有约 50ms 延时, 主机切换前等待的时间 (秒)
+BAUD_SWITCH_DELAY = 0.1
+# ======================================================
+
+
+class ExpectTimeout(Exception):
+    """在超时时间内没有匹配到任何模式"""
+
+
+class UBootError(Exception):
+    """U-Boot 命令执行失败"""
+
+
+def _compile(pattern):
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    if isinstance(pattern, bytes):
+        return re.compile(re.escape(pattern))
+    return pattern
+
+
+class SerialExpect:
+    """
+    基于 pyserial 端口的流式匹配 (expect)
+    数据保存在滚动缓冲区中, 跨多次读取的匹配也能命中;
+    读取使用带超时的阻塞读, 数据一到就处理, 不依赖固定间隔轮询
+    port 只需提供 read(n) / write(data) / in_waiting / timeout, 可以是真实串口或 pty
+    """
+
+    def __init__(self, port, buffer_size=EXPECT_BUFFER_SIZE, on_data=None):
+        self.port = port
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        # 收到原始数据时的回调 on_data(bytes), 用于日志记录
+        self.on_data = on_data
+        # 最近一次匹配之前的内容
+        self.before = b''
+        # U-Boot 提示符, intercept_uboot 进入命令行后替换为实际的完整提示符
+        self.prompt = UBOOT_PROMPT
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.port.write(data)
+
+    def read_some(self, timeout):
+        """阻塞读取, 有数据到达或超时即返回, 返回读到的字节"""
+        self.port.timeout = max(timeout, 0)
+        data = self.port.read(1)
+        if data:
+            waiting = self.port.in_waiting
+            if waiting:
+                data += self.port.read(waiting)
+            if self.on_data:
+                self.on_data(data)
+            self.buffer += data
+            if len(self.buffer) > self.buffer_size:
+                del self.buffer[:len(self.buffer) - self.buffer_size]
+        return data
+
+    def expect(self, patterns, timeout, poke=None, poke_interval=0.2):
+        """
+        等待任一模式出现, 返回 (模式序号, 匹配对象)
+        匹配成功后缓冲区中匹配结束之前的内容被消费, 存入 self.before
+        poke: 等待期间每隔 poke_interval 秒发送一次的数据 (例如回车, 用于打断倒计时)
+        超时抛出 ExpectTimeout
+        """
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        compiled = [_compile(p) for p in patterns]
+        deadline = time.time() + timeout
+        next_poke = time.time()
+
+        while True:
+            for i, regex in enumerate(compiled):
+                m = regex.search(self.buffer)
+                if m:
+                    # 匹配对象引用缓冲区, 消费之前在不可变的副本上重新匹配, 保证分组内容有效
+                    consumed = bytes(self.buffer[:m.end()])
+                    m = regex.search(consumed, m.start())
+                    self.before = consumed[:m.start()]
+                    del self.buffer[:m.end()]
+                    return i, m
+
+            now = time.time()
+            if now >= deadline:
+                raise ExpectTimeout(f"{timeout}s 内未匹配到: {[p.pattern for p in compiled]}")
+            if poke is not None and now >= next_poke:
+                self.send(poke)
+                next_poke = now + poke_interval
+            wait = deadline - now
+            if poke is not None:
+                wait = min(wait, max(next_poke - now, 0))
+            self.read_some(wait)
+
+    def drain(self, quiet=0.1, timeout=2.0):
+        """读取并丢弃数据, 直到连续 quiet 秒没有新数据"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.read_some(quiet):
+                break
+        self.buffer.clear()
+
+
+def intercept_uboot(console, timeout=60):
+    """
+    拦截 U-Boot 自动启动并进入命令行
+    持续发送回车, 看到倒计时提示立即再发送回车, 直到出现提示符
+    记下实际的提示符 (例如 "hisilicon # "), 之后的命令只匹配这一行
+    """
+    deadline = time.time() + timeout
+    while True:
+        idx, m = console.expect([AUTOBOOT_PATTERN, UBOOT_PROMPT],
+                                timeout=max(deadline - time.time(), 0), poke=b'\n')
+        if idx == 0:
+            # 倒计时中, 立即打断
+            console.send(b'\n\n')
+            continue
+        prompt = m.group(0).lstrip(b'\r\n')
+        console.prompt = re.compile(rb"[\r\n]" + re.escape(prompt) + rb"$")
+        console.drain()
+        return True
+
+
+def uboot_command(console, cmd, timeout=UBOOT_CMD_TIMEOUT, wait_prompt=True):
+    """
+    发送一条 U-Boot 命令并等待回显和下一个提示符, 返回命令输出
+    输出中包含错误信息 (Unknown command / saveenv 失败等) 时抛出 UBootError
+    wait_prompt=False 用于 reset 等不会返回提示符的命令, 只等待回显
+    """
+    console.send(cmd + "\n")
+    console.expect(cmd.encode('utf-8'), timeout)
+    if not wait_prompt:
+        return ''
+
+    console.expect(console.prompt, timeout)
+    output = console.before.decode('utf-8', errors='replace').strip()
+    if UBOOT_ERROR_PATTERN.search(console.before):
+        raise UBootError(f"{cmd}: {output}")
+    return output
+
+
+def set_uboot_env(console, env, save=True, timeout=UBOOT_CMD_TIMEOUT):
+    """
+    设置一组 U-Boot 环境变量并回读校验
+    env: {变量名: 值} 或 [(变量名, 值), ...]
+    """
+    items = list(env.items()) if isinstance(env, dict) else list(env)
+    for name, value in items:
+        uboot_command(console, f'setenv {name} "{value}"', timeout)
+
+    for name, value in items:
+        output = uboot_command(console, f'printenv {name}', timeout)
+        if f"{name}={value}" not in output:
+            raise UBootError(f"{name} 回读不一致: {output}")
+
+    if save:
+        # saveenv 写 Flash 可能较慢
+        output = uboot_command(console, 'saveenv', timeout * 3)
+        if 'OK' not in output and 'done' not in output.lower():
+            raise UBootError(f"saveenv 未确认成功: {output}")
+
+
+def _switch_baudrate(console, baudrate, key):
+    """U-Boot 提示切换波特率后, 主机同步切换并按提示发送确认键"""
+    console.expect(LOADY_SWITCH_PATTERN, UBOOT_CMD_TIMEOUT)
+    time.sleep(BAUD_SWITCH_DELAY)
+    console.port.baudrate = baudrate
+    time.sleep(BAUD_SWITCH_DELAY)
+    console.send(key)
+
+
+def uboot_loady(console, data, addr, baudrate=None, name="image.bin", on_progress=None,
+                timeout=UBOOT_CMD_TIMEOUT):
+    """
+    用 U-Boot 的 loady (YMODEM-1K, CRC16) 把数据传到内存 addr, 返回 U-Boot 报告的大小
+    baudrate: 传输期间双方临时切换到的波特率 (loady 自带参数, 传完自动切回原波特率), None 表示不切换
+    on_progress(已发送字节数): 传输进度回调
+    """
+    port = console.port
+    old_baudrate = port.baudrate
+    switch = bool(baudrate) and baudrate != old_baudrate
+    cmd = f"loady 0x{addr:x}" + (f" {baudrate}" if switch else "")
+    console.send(cmd + "\n")
+    console.expect(cmd.encode('utf-8'), timeout)
+    if switch:
+        _switch_baudrate(console, baudrate, b'\r')
+
+    try:
+        console.expect(LOADY_READY_PATTERN, timeout)
+        # 接收端的 'C' 可能已经读进缓冲区
+        pending = bytes(console.buffer)
+        console.buffer.clear()
+        ymodem_send(port, name, data, pending, on_progress)
+    except (YModemError, ExpectTimeout):
+        # 取消传输, 让 U-Boot 回到命令行
+        port.write(bytes([CAN] * 5))
+        if switch:
+            # loady 失败后 U-Boot 同样会提示切回原波特率
+            try:
+                _switch_baudrate(console, old_baudrate, b'\x1b')
+            except ExpectTimeout:
+                port.baudrate = old_baudrate
+        raise
+
+    _, m = console.expect(LOADY_SIZE_PATTERN, timeout)
+    size = int(m.group(1))
+    if switch:
+        _switch_baudrate(console, old_baudrate, b'\x1b')
+    console.expect(console.prompt, timeout)
+    if size != len(data):
+        raise UBootError(f"loady 收到 {size} 字节, 应为 {len(data)} 字节")
+    return size
+
+
+def uboot_crc32(console, addr, size, timeout=UBOOT_CMD_TIMEOUT):
+    """用 U-Boot 的 crc32 命令计算内存中数据的 CRC32"""
+    output = uboot_command(console, f"crc32 0x{addr:x} 0x{size:x}", timeout)
+    m = re.search(r"==>\s*([0-9a-fA-F]{8})", output)
+    if not m:
+        raise UBootError(f"无法解析 crc32 输出: {output}")
+    return int(m.group(1), 16)
+
+
+def uboot_check_crc32(console, addr, data, name="image.bin"):
+    """用 crc32 校验已加载到内存 addr 的数据, 不一致抛出 UBootError"""
+    crc = uboot_crc32(console, addr, len(data))
+    expected = zlib.crc32(data) & 0xFFFFFFFF
+    if crc != expected:
+        raise UBootError(f"{name} 内存校验失败: crc32 {crc:08x}, 应为 {expected:08x}")
+
+
+def uboot_load_verified(console, data, addr, baudrate=None, name="image.bin", on_progress=None):
+    """loady 传输后用 crc32 校验内存中的数据, 不一致抛出 UBootError"""
+    size = uboot_loady(console, data, addr, baudrate, name, on_progress)
+    uboot_check_crc32(console, addr, data, name)
+    return size
+
+
+def uboot_tftp(console, addr, name, timeout=UBOOT_CMD_TIMEOUT):
+    """
+    U-Boot 通过 tftp 把文件拉到内存 addr, 返回传输的字节数
+    服务器地址、块大小、窗口等由 serverip / tftpblocksize / tftpwindowsize / tftpdstp 环境变量决定
+    """
+    output = uboot_command(console, f"tftp 0x{addr:x} {name}", timeout)
+    m = TFTP_SIZE_PATTERN.search(output)
+    if not m:
+        raise UBootError(f"tftp {name} 未完成: {output[-200:]}")
+    return int(m.group(1))
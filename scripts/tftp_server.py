@@ -0,0 +1,307 @@
+import os
+import time
+import socket
+import struct
+import threading
+
+
+# ================= TFTP 配置 =================
+TFTP_PORT = 69
+# 协商允许的最大块大小 (RFC 2348), 超过以太网 MTU 会导致 IP 分片
+TFTP_MAX_BLKSIZE = 65464
+# 协商允许的最大窗口 (RFC 7440): 每收到一次 ACK 最多连续发送的块数
+TFTP_MAX_WINDOWSIZE = 64
+# 等待 ACK 的超时 (秒) 和最大重传次数
+TFTP_TIMEOUT = 1.0
+TFTP_RETRIES = 5
+# ======================================================
+
+OP_RRQ = 1
+OP_WRQ = 2
+OP_DATA = 3
+OP_ACK = 4
+OP_ERROR = 5
+OP_OACK = 6
+
+ERR_NOT_FOUND = 1
+ERR_ACCESS = 2
+ERR_ILLEGAL = 4
+ERR_OPTION = 8
+
+DEFAULT_BLKSIZE = 512
+
+
+class TftpError(Exception):
+    """TFTP 传输失败"""
+
+
+def _error_packet(code, message):
+    return struct.pack("!HH", OP_ERROR, code) + message.encode('utf-8') + b"\0"
+
+
+def _parse_request(packet):
+    """RRQ/WRQ -> (文件名, 模式, {选项: 值}), 选项名统一小写"""
+    fields = packet[2:].split(b"\0")
+    if len(fields) < 3:
+        raise ValueError("请求格式错误")
+    name = fields[0].decode('utf-8', errors='replace')
+    mode = fields[1].decode('ascii', errors='replace').lower()
+    options = {}
+    pairs = fields[2:-1]
+    for i in range(0, len(pairs) - 1, 2):
+        options[pairs[i].decode('ascii', errors='replace').lower()] = pairs[i + 1].decode('ascii', errors='replace')
+    return name, mode, options
+
+
+def _oack_packet(options):
+    body = b"".join(k.encode() + b"\0" + str(v).encode() + b"\0" for k, v in options.items())
+    return struct.pack("!H", OP_OACK) + body
+
+
+def negotiate(options, size, max_blksize=TFTP_MAX_BLKSIZE, max_windowsize=TFTP_MAX_WINDOWSIZE):
+    """
+    处理客户端请求的选项, 返回 (块大小, 窗口大小, 需要在 OACK 中回复的选项)
+    不认识或不合法的选项直接忽略 (按 RFC 2347 不回复即表示拒绝)
+    """
+    blksize, windowsize, accepted = DEFAULT_BLKSIZE, 1, {}
+    try:
+        if "blksize" in options and int(options["blksize"]) >= 8:
+            blksize = min(int(options["blksize"]), max_blksize)
+            accepted["blksize"] = blksize
+    except ValueError:
+        pass
+    try:
+        if "windowsize" in options and int(options["windowsize"]) >= 1:
+            windowsize = min(int(options["windowsize"]), max_windowsize)
+            accepted["windowsize"] = windowsize
+    except ValueError:
+        pass
+    if "tsize" in options:
+        accepted["tsize"] = size
+    if "timeout" in options:
+        accepted["timeout"] = options["timeout"]
+    return blksize, windowsize, accepted
+
+
+class TftpServer:
+    """
+    只读 TFTP 服务 (只处理 RRQ), 用于 U-Boot 下 tftp 拉取镜像
+    files: {请求的文件名: 本地路径}, 只提供列出的文件
+    每个传输使用单独的端口和线程; 支持 blksize / windowsize / tsize 选项协商
+    """
+
+    def __init__(self, files, host='0.0.0.0', port=TFTP_PORT,
+                 max_blksize=TFTP_MAX_BLKSIZE, max_windowsize=TFTP_MAX_WINDOWSIZE):
+        self.files = dict(files)
+        self.host = host
+        self.port = port
+        self.max_blksize = max_blksize
+        self.max_windowsize = max_windowsize
+        self.sock = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # 已完成的传输: (文件名, 字节数, 耗时, 块大小, 窗口大小)
+        self.transfers = []
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        # 关闭 UDP 套接字不会唤醒阻塞的 recvfrom, 用超时轮询停止标志
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._serve, name="tftp", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _serve(self):
+        while not self.stop_event.is_set():
+            try:
+                packet, addr = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(packet, addr), daemon=True).start()
+
+    def _handle(self, packet, addr):
+        # 按 TFTP 协议, 每个传输使用新的端口 (TID)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind((self.host, 0))
+            sock.settimeout(TFTP_TIMEOUT)
+            if len(packet) < 4:
+                return
+            opcode = struct.unpack("!H", packet[:2])[0]
+            if opcode == OP_WRQ:
+                sock.sendto(_error_packet(ERR_ACCESS, "read only"), addr)
+                return
+            if opcode != OP_RRQ:
+                sock.sendto(_error_packet(ERR_ILLEGAL, "illegal operation"), addr)
+                return
+            try:
+                name, mode, options = _parse_request(packet)
+            except ValueError:
+                sock.sendto(_error_packet(ERR_ILLEGAL, "bad request"), addr)
+                return
+            path = self.files.get(name) or self.files.get(name.lstrip('/'))
+            if path is None or not os.path.isfile(path):
+                sock.sendto(_error_packet(ERR_NOT_FOUND, f"{name} not found"), addr)
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            blksize, windowsize, accepted = negotiate(options, len(data), self.max_blksize, self.max_windowsize)
+            start = time.time()
+            send_file(sock, addr, data, blksize, windowsize, accepted)
+            with self.lock:
+                self.transfers.append((name, len(data), time.time() - start, blksize, windowsize))
+        except (TftpError, OSError):
+            pass
+        finally:
+            sock.close()
+
+
+def _recv_ack(sock, addr, deadline):
+    """等待对方的 ACK, 返回 16 位块号; 超时返回 None; 收到 ERROR 抛出 TftpError"""
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        sock.settimeout(remaining)
+        try:
+            packet, peer = sock.recvfrom(65536)
+        except socket.timeout:
+            return None
+        if peer != addr or len(packet) < 4:
+            continue
+        opcode, value = struct.unpack("!HH", packet[:4])
+        if opcode == OP_ACK:
+            return value
+        if opcode == OP_ERROR:
+            raise TftpError(f"对方返回错误 {value}: {packet[4:-1].decode('utf-8', errors='replace')}")
+
+
+def send_file(sock, addr, data, blksize=DEFAULT_BLKSIZE, windowsize=1, options=None):
+    """
+    按 RFC 1350 / 2348 / 7440 发送数据: 有协商选项时先发 OACK 并等待 ACK 0,
+    然后每次连续发送 windowsize 个块, 按收到的 ACK 滑动窗口, 超时从第一个未确认的块重发
+    """
+    if options:
+        oack = _oack_packet(options)
+        for _ in range(TFTP_RETRIES):
+            sock.sendto(oack, addr)
+            if _recv_ack(sock, addr, time.time() + TFTP_TIMEOUT) == 0:
+                break
+        else:
+            raise TftpError("OACK 未被确认")
+
+    view = memoryview(data)
+    # 最后一块小于块大小 (可能为 0 字节) 表示结束
+    last = len(data) // blksize + 1
+    base = 1
+    retries = 0
+    while base <= last:
+        end = min(base + windowsize - 1, last)
+        for n in range(base, end + 1):
+            sock.sendto(struct.pack("!HH", OP_DATA, n & 0xFFFF) + view[(n - 1) * blksize:n * blksize], addr)
+
+        deadline = time.time() + TFTP_TIMEOUT
+        while True:
+            ack = _recv_ack(sock, addr, deadline)
+            if ack is None:
+                retries += 1
+                if retries > TFTP_RETRIES:
+                    raise TftpError(f"块 {base} 重传 {TFTP_RETRIES} 次仍未确认")
+                break
+            # 16 位块号换算成绝对块号, 窗口之外的 (过期的重复 ACK) 忽略
+            acked = base - 1 + ((ack - (base - 1)) & 0xFFFF)
+            if acked > end:
+                continue
+            if acked >= base:
+                base = acked + 1
+                retries = 0
+            break
+
+
+def tftp_get(server, name, port=TFTP_PORT, blksize=DEFAULT_BLKSIZE, windowsize=1, timeout=TFTP_TIMEOUT):
+    """
+    简单的 TFTP 客户端 (RRQ), 返回文件内容
+    用于测试 (模拟 U-Boot 的 tftp 命令)
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        request = struct.pack("!H", OP_RRQ) + name.encode('utf-8') + b"\0octet\0"
+        if blksize != DEFAULT_BLKSIZE or windowsize != 1:
+            request += _oack_packet({"blksize": blksize, "windowsize": windowsize, "tsize": 0})[2:]
+        blksize, windowsize = DEFAULT_BLKSIZE, 1
+
+        data = bytearray()
+        expected = 1
+        in_window = 0
+        peer = None
+        retries = 0
+        last_sent = request
+        sock.sendto(request, (server, port))
+        while True:
+            try:
+                packet, addr = sock.recvfrom(65536)
+            except socket.timeout:
+                retries += 1
+                if retries > TFTP_RETRIES:
+                    raise TftpError("服务器无响应")
+                sock.sendto(last_sent, peer or (server, port))
+                continue
+            if peer is None:
+                peer = addr
+            elif addr != peer:
+                continue
+            opcode = struct.unpack("!H", packet[:2])[0]
+            if opcode == OP_ERROR:
+                raise TftpError(packet[4:-1].decode('utf-8', errors='replace'))
+            if opcode == OP_OACK and expected == 1:
+                _, _, options = _parse_request(b"\0\0\0\0" + packet[2:])
+                blksize = int(options.get("blksize", DEFAULT_BLKSIZE))
+                windowsize = int(options.get("windowsize", 1))
+                last_sent = struct.pack("!HH", OP_ACK, 0)
+                sock.sendto(last_sent, peer)
+                continue
+            if opcode != OP_DATA:
+                continue
+            retries = 0
+            block = struct.unpack("!H", packet[2:4])[0]
+            payload = packet[4:]
+            if block == expected & 0xFFFF:
+                data += payload
+                expected += 1
+                in_window += 1
+                if len(payload) < blksize or in_window >= windowsize:
+                    in_window = 0
+                    last_sent = struct.pack("!HH", OP_ACK, (expected - 1) & 0xFFFF)
+                    sock.sendto(last_sent, peer)
+                if len(payload) < blksize:
+                    return bytes(data)
+            else:
+                # 乱序或丢块: 确认最后一个连续收到的块, 服务器从下一块重发
+                in_window = 0
+                last_sent = struct.pack("!HH", OP_ACK, (expected - 1) & 0xFFFF)
+                sock.sendto(last_sent, peer)
+    finally:
+        sock.close()
@@ -0,0 +1,170 @@
+import io
+import os
+import bz2
+import json
+import gzip
+import lzma
+import time
+import zlib
+import shutil
+import hashlib
+import threading
+import subprocess
+
+
+# ================= 安装包转码配置 =================
+# 传输格式: (文件后缀, 设备端解压命令列表)
+# 解压命令从 stdin 读、向 stdout 写, 按顺序尝试, 设备上第一个可用的生效 (busybox 裁剪后可能只有部分命令)
+FORMATS = {
+    'none':  ('.tar',     ['cat']),
+    'gzip':  ('.tar.gz',  ['gzip -dc', 'busybox gzip -dc', 'zcat']),
+    'lzop':  ('.tar.lzo', ['lzop -dc', 'busybox unlzop -c', 'unlzop -c']),
+    'bzip2': ('.tar.bz2', ['bzip2 -dc', 'busybox bunzip2 -c', 'bunzip2 -c']),
+    'xz':    ('.tar.xz',  ['xz -dc', 'busybox unxz -c', 'unxz -c']),
+}
+# 压缩级别; xz 解压所需内存约等于字典大小 (-6 为 8MB), 设备内存紧张时调低
+GZIP_LEVEL = 6
+BZIP2_LEVEL = 9
+XZ_PRESET = 6
+# 每次读取的大小
+READ_CHUNK = 1024 * 1024
+# ======================================================
+
+_cache_lock = threading.Lock()
+
+
+def host_formats():
+    """本机能生成的格式 (lzop 没有标准库实现, 需要本机安装 lzop 命令)"""
+    return [fmt for fmt in FORMATS if fmt != 'lzop' or shutil.which('lzop')]
+
+
+def _encoder(fmt, out):
+    """返回 (写入函数, 结束函数): 未压缩的数据按 fmt 压缩后写入文件 out"""
+    if fmt == 'lzop':
+        proc = subprocess.Popen([shutil.which('lzop'), '-c'], stdin=subprocess.PIPE, stdout=out)
+
+        def finish():
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise OSError(f"lzop 返回码 {proc.returncode}")
+        return proc.stdin.write, finish
+
+    if fmt == 'none':
+        return out.write, lambda: None
+    if fmt == 'gzip':
+        comp = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif fmt == 'bzip2':
+        comp = bz2.BZ2Compressor(BZIP2_LEVEL)
+    elif fmt == 'xz':
+        comp = lzma.LZMACompressor(preset=XZ_PRESET)
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+    return (lambda data: out.write(comp.compress(data))), (lambda: out.write(comp.flush()))
+
+
+def compress_bytes(fmt, data):
+    """把一段数据压缩为 fmt 格式 (用于探测样本)"""
+    if fmt == 'lzop':
+        return subprocess.run([shutil.which('lzop'), '-c'], input=data, stdout=subprocess.PIPE, check=True).stdout
+    out = io.BytesIO()
+    write, finish = _encoder(fmt, out)
+    write(data)
+    finish()
+    return out.getvalue()
+
+
+def read_sample(src, size):
+    """读取 .tar.gz 解压后的前 size 字节"""
+    with gzip.open(src, 'rb') as f:
+        return f.read(size)
+
+
+def gzip_raw_size(src):
+    """
+    .tar.gz 解压后的大小 (gzip 尾部记录的长度)
+    只记录了低 32 位, 超过 4GB 或多段 gzip 时不准确, 仅用于估算
+    """
+    with open(src, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+
+class TranscodeCache:
+    """
+    转码后的安装包缓存: 按源安装包摘要 + 格式保存, 每种格式只生成一次
+    gzip 就是源文件本身, 不复制
+    """
+
+    def __init__(self, directory, max_bytes, algo='md5'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.algo = algo
+
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load(self):
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, index):
+        path = self._index_path()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def _evict(self, index, keep):
+        """按最近使用时间淘汰, 直到总大小不超过 max_bytes"""
+        total = sum(e['size'] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index.pop(key)['size']
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except OSError:
+                pass
+
+    def _transcode(self, src, fmt, out_path):
+        """解压源 .tar.gz 并按 fmt 重新压缩, 返回 (摘要, 解压后大小)"""
+        raw_size = 0
+        with gzip.open(src, 'rb') as fin, open(out_path, 'wb') as fout:
+            write, finish = _encoder(fmt, fout)
+            for chunk in iter(lambda: fin.read(READ_CHUNK), b''):
+                raw_size += len(chunk)
+                write(chunk)
+            finish()
+        # lzop 由子进程直接写文件, 摘要统一在写完后计算
+        h = hashlib.new(self.algo)
+        with open(out_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                h.update(chunk)
+        return h.hexdigest(), raw_size
+
+    def get(self, src, src_digest, fmt):
+        """返回 (路径, 摘要) ; 缓存中没有时先转码"""
+        if fmt == 'gzip':
+            return src, src_digest
+        key = src_digest + FORMATS[fmt][0]
+        path = os.path.join(self.directory, key)
+        with _cache_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            index = self._load()
+            entry = index.get(key)
+            if entry is None or not os.path.exists(path):
+                tmp = os.path.join(self.directory, f'build-{os.getpid()}{FORMATS[fmt][0]}')
+                t0 = time.time()
+                digest, raw_size = self._transcode(src, fmt, tmp)
+                os.replace(tmp, path)
+                entry = {'digest': digest, 'raw_size': raw_size, 'size': os.path.getsize(path)}
+                print(f"   转码为 {fmt}: {entry['size'] / 1048576:.1f} MB, 耗时 {time.time() - t0:.1f}s")
+            entry['last_used'] = time.time()
+            index[key] = entry
+            self._evict(index, keep=key)
+            self._save(index)
+            return path, entry['digest']
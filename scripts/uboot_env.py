@@ -0,0 +1,120 @@
+import zlib
+import struct
+import collections
+
+
+# ================= U-Boot 环境变量格式 =================
+# 环境变量区: CRC32 (小端, 4 字节) [+ 冗余环境变量的 flags (1 字节)] + "name=value\0...\0\0" + 填充
+# CRC 覆盖头部之后的整个数据区 (包括填充)
+ENV_CRC_SIZE = 4
+# 冗余环境变量 (CONFIG_SYS_REDUNDAND_ENVIRONMENT) 的 flags 字节
+ENV_FLAGS_SIZE = 1
+# ======================================================
+
+EnvCopy = collections.namedtuple("EnvCopy", "valid flags vars")
+EnvLocation = collections.namedtuple("EnvLocation", "device offset size")
+
+
+class UBootEnvError(Exception):
+    """环境变量区无法解析 / 写不下 / 配置错误"""
+
+
+def parse_fw_env_config(text):
+    """
+    解析 /etc/fw_env.config: 每行 "设备 偏移 大小 [扇区大小 [扇区数]]", 第二行为冗余环境变量
+    返回 [EnvLocation, ...]
+    """
+    locations = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) < 3:
+            raise UBootEnvError(f"fw_env.config 格式错误: {line}")
+        try:
+            locations.append(EnvLocation(fields[0], int(fields[1], 0), int(fields[2], 0)))
+        except ValueError:
+            raise UBootEnvError(f"fw_env.config 格式错误: {line}")
+    if not 1 <= len(locations) <= 2:
+        raise UBootEnvError(f"fw_env.config 应有 1 或 2 个环境变量区, 实际 {len(locations)} 个")
+    if len(locations) == 2 and locations[0].size != locations[1].size:
+        raise UBootEnvError("两个环境变量区大小不一致")
+    return locations
+
+
+def _header_size(redundant):
+    return ENV_CRC_SIZE + (ENV_FLAGS_SIZE if redundant else 0)
+
+
+def parse_env(data, redundant=False):
+    """解析一个环境变量区, 返回 EnvCopy (CRC 错误时 valid=False, vars 为空)"""
+    header = _header_size(redundant)
+    if len(data) <= header:
+        return EnvCopy(False, None, collections.OrderedDict())
+    crc = struct.unpack("<I", data[:ENV_CRC_SIZE])[0]
+    flags = data[ENV_CRC_SIZE] if redundant else None
+    body = data[header:]
+    if zlib.crc32(body) & 0xFFFFFFFF != crc:
+        return EnvCopy(False, flags, collections.OrderedDict())
+
+    env = collections.OrderedDict()
+    for entry in body.split(b'\0'):
+        # 连续两个 \0 表示结束
+        if not entry:
+            break
+        name, sep, value = entry.partition(b'=')
+        if sep:
+            env[name.decode('utf-8', errors='surrogateescape')] = value.decode('utf-8', errors='surrogateescape')
+    return EnvCopy(True, flags, env)
+
+
+def build_env(env, size, redundant=False, flags=0):
+    """按 size 生成环境变量区 (含 CRC 和 flags), 数据区用 \\0 填充"""
+    header = _header_size(redundant)
+    body = b''.join(f"{k}={v}".encode('utf-8', errors='surrogateescape') + b'\0' for k, v in env.items()) + b'\0'
+    if len(body) > size - header:
+        raise UBootEnvError(f"环境变量共 {len(body)} 字节, 超过环境变量区容量 {size - header} 字节")
+    body = body.ljust(size - header, b'\0')
+    head = struct.pack("<I", zlib.crc32(body) & 0xFFFFFFFF)
+    if redundant:
+        head += bytes([flags & 0xFF])
+    return head + body
+
+
+def active_copy(copies):
+    """
+    按 U-Boot (env_import_redund) 的规则选出生效的副本, 返回下标; 都无效返回 None
+    两份都有效时 flags 大的较新 (计数 255 -> 0 回绕), 相同时取第一份
+    """
+    valid = [i for i, c in enumerate(copies) if c.valid]
+    if len(valid) < 2:
+        return valid[0] if valid else None
+    f1, f2 = copies[0].flags, copies[1].flags
+    if f1 == 255 and f2 == 0:
+        return 1
+    if f2 == 255 and f1 == 0:
+        return 0
+    return 1 if f2 > f1 else 0
+
+
+def update_env(copies, size, changes):
+    """
+    在当前生效的副本上修改变量 (值为 None 表示删除), 返回 (要写入的副本下标, 新数据)
+    冗余环境变量写到另一份并把 flags 加 1, 与 U-Boot saveenv 相同, 写入中断时旧副本仍然有效
+    没有有效副本 (U-Boot 正在使用内置默认值) 时拒绝写入, 否则会丢掉默认值中的其他变量
+    """
+    current = active_copy(copies)
+    if current is None:
+        raise UBootEnvError("没有 CRC 正确的环境变量区 (U-Boot 使用内置默认值), 请先在 U-Boot 中 saveenv")
+    env = collections.OrderedDict(copies[current].vars)
+    for name, value in changes.items():
+        if value is None:
+            env.pop(name, None)
+        else:
+            env[name] = str(value)
+
+    if len(copies) == 1:
+        return 0, build_env(env, size)
+    target = 1 - current
+    return target, build_env(env, size, redundant=True, flags=(copies[current].flags + 1) & 0xFF)
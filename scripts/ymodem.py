@@ -0,0 +1,219 @@
+import time
+import binascii
+
+
+# ================= YMODEM 配置 =================
+# 单个数据块的最大重传次数
+YMODEM_RETRIES = 10
+# 等待 ACK / 数据块的超时 (秒)
+YMODEM_TIMEOUT = 10
+# 等待接收端发出第一个 'C' 的超时 (秒)
+YMODEM_START_TIMEOUT = 60
+# ======================================================
+
+SOH = 0x01   # 128 字节数据块
+STX = 0x02   # 1024 字节数据块
+EOT = 0x04
+ACK = 0x06
+NAK = 0x15
+CAN = 0x18
+CRC_REQUEST = 0x43   # 'C': 接收端请求使用 CRC16 校验
+PAD = 0x1A
+
+
+class YModemError(Exception):
+    """YMODEM 传输失败 (重传次数用尽 / 对方取消 / 超时)"""
+
+
+def _crc16(data):
+    # CRC-16/XMODEM (多项式 0x1021, 初值 0)
+    return binascii.crc_hqx(data, 0)
+
+
+def make_block(seq, payload, size=1024, pad=PAD):
+    """组一个数据块: 头 + 序号 + 序号反码 + 数据 (不足补 pad) + CRC16"""
+    payload = bytes(payload).ljust(size, bytes([pad]))
+    head = bytes([SOH if size == 128 else STX, seq & 0xFF, 0xFF - (seq & 0xFF)])
+    return head + payload + _crc16(payload).to_bytes(2, 'big')
+
+
+class _Link:
+    """
+    对端口的简单封装: 先消费已经读到的字节 (pending), 再从端口读取
+    port 只需提供 read(n) / write(data) / timeout, 与 SerialExpect 相同
+    """
+
+    def __init__(self, port, pending=b''):
+        self.port = port
+        self.pending = bytearray(pending)
+
+    def read(self, n, timeout):
+        out = bytearray()
+        if self.pending:
+            out += self.pending[:n]
+            del self.pending[:n]
+        deadline = time.time() + timeout
+        while len(out) < n:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self.port.timeout = remaining
+            data = self.port.read(n - len(out))
+            if data:
+                out += data
+        return bytes(out)
+
+    def getc(self, timeout):
+        data = self.read(1, timeout)
+        return data[0] if data else None
+
+    def write(self, data):
+        self.port.write(data)
+
+
+# ================= 发送端 =================
+def _wait_crc_request(link, timeout):
+    """等待接收端的 'C', 期间的其他字节 (例如 U-Boot 的提示信息) 忽略"""
+    deadline = time.time() + timeout
+    cancels = 0
+    while True:
+        c = link.getc(max(deadline - time.time(), 0))
+        if c is None:
+            return False
+        if c == CRC_REQUEST:
+            return True
+        cancels = cancels + 1 if c == CAN else 0
+        if cancels >= 2:
+            raise YModemError("接收端取消了传输")
+
+
+def _send_block(link, block, timeout):
+    cancels = 0
+    for _ in range(YMODEM_RETRIES):
+        link.write(block)
+        while True:
+            c = link.getc(timeout)
+            if c == ACK:
+                return
+            if c == CAN:
+                cancels += 1
+                if cancels >= 2:
+                    raise YModemError("接收端取消了传输")
+                continue
+            if c == CRC_REQUEST and block[1] != 0:
+                # 等待开始时积压的 'C', 只对文件头表示重传
+                continue
+            # NAK / 超时 / 其他字节: 重传
+            break
+    raise YModemError(f"数据块 {block[1]} 重传 {YMODEM_RETRIES} 次仍失败")
+
+
+def ymodem_send(port, name, data, pending=b'', on_progress=None,
+                start_timeout=YMODEM_START_TIMEOUT, timeout=YMODEM_TIMEOUT):
+    """
+    YMODEM-1K (CRC16) 发送一个文件
+    pending: 调用前已从端口读到、尚未处理的字节 (可能包含接收端的 'C')
+    on_progress(已发送字节数): 每发送一个数据块调用一次
+    """
+    link = _Link(port, pending)
+    if not _wait_crc_request(link, start_timeout):
+        raise YModemError(f"{start_timeout}s 内接收端未就绪")
+
+    # 第 0 块: 文件名 + 大小
+    header = name.encode('utf-8') + b'\0' + str(len(data)).encode() + b'\0'
+    _send_block(link, make_block(0, header, 128 if len(header) <= 128 else 1024, pad=0), timeout)
+    if not _wait_crc_request(link, timeout):
+        raise YModemError("接收端未确认文件头")
+
+    view = memoryview(data)
+    seq = 1
+    offset = 0
+    while offset < len(data):
+        chunk = view[offset:offset + 1024]
+        # 最后不足 128 字节的部分用短块, 少发填充字节
+        _send_block(link, make_block(seq, chunk, 128 if len(chunk) <= 128 else 1024), timeout)
+        offset += len(chunk)
+        seq += 1
+        if on_progress is not None:
+            on_progress(offset)
+
+    # 结束: EOT 直到 ACK (有的接收端第一次回 NAK)
+    for _ in range(YMODEM_RETRIES):
+        link.write(bytes([EOT]))
+        if link.getc(timeout) == ACK:
+            break
+    else:
+        raise YModemError("EOT 未被确认")
+
+    # 空文件头表示批量传输结束 (接收端不再请求时直接结束)
+    if _wait_crc_request(link, timeout):
+        _send_block(link, make_block(0, b'', 128, pad=0), timeout)
+
+
+# ================= 接收端 =================
+def _read_block(link, timeout):
+    """读取一个数据块, 返回 (序号, 数据) / ('EOT', None) / None (超时或校验失败)"""
+    c = link.getc(timeout)
+    if c == EOT:
+        return 'EOT', None
+    if c == CAN:
+        raise YModemError("发送端取消了传输")
+    if c not in (SOH, STX):
+        return None
+    size = 128 if c == SOH else 1024
+    rest = link.read(size + 4, timeout)
+    if len(rest) != size + 4 or rest[0] != 0xFF - rest[1]:
+        return None
+    payload = rest[2:2 + size]
+    if _crc16(payload) != int.from_bytes(rest[2 + size:], 'big'):
+        return None
+    return rest[0], payload
+
+
+def ymodem_receive(port, timeout=YMODEM_TIMEOUT, start_timeout=YMODEM_START_TIMEOUT, pending=b''):
+    """
+    YMODEM 接收一个文件, 返回 (文件名, 数据)
+    用于测试 (模拟 U-Boot loady 的对端)
+    """
+    link = _Link(port, pending)
+    deadline = time.time() + start_timeout
+    while True:
+        if time.time() > deadline:
+            raise YModemError(f"{start_timeout}s 内未收到文件头")
+        link.write(bytes([CRC_REQUEST]))
+        block = _read_block(link, 1.0)
+        if block and block[0] == 0:
+            break
+    name, _, rest = block[1].partition(b'\0')
+    size = int(rest.split(b'\0', 1)[0].split(b' ', 1)[0] or 0)
+    link.write(bytes([ACK, CRC_REQUEST]))
+
+    data = bytearray()
+    expected = 1
+    errors = 0
+    while True:
+        block = _read_block(link, timeout)
+        if block is None:
+            errors += 1
+            if errors > YMODEM_RETRIES:
+                raise YModemError("数据块错误次数过多")
+            link.write(bytes([NAK]))
+            continue
+        seq, payload = block
+        if seq == 'EOT':
+            link.write(bytes([ACK]))
+            break
+        if seq == expected & 0xFF:
+            data += payload
+            expected += 1
+        elif seq != (expected - 1) & 0xFF:
+            raise YModemError(f"数据块序号错误: 期望 {expected & 0xFF}, 收到 {seq}")
+        # 重复的上一块 (ACK 丢失) 只确认不追加
+        link.write(bytes([ACK]))
+
+    # 结束批量传输的空文件头
+    link.write(bytes([CRC_REQUEST]))
+    block = _read_block(link, timeout)
+    if block and block[0] == 0:
+        link.write(bytes([ACK]))
+    return name.decode('utf-8', errors='replace'), bytes(data[:size])